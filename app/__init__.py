@@ -4,15 +4,18 @@ Factory function để tạo Flask app với cấu trúc modular
 from flask import Flask
 from .config import config
 from .models import DatabaseManager
+from .services import IngestionService, CoverService
 from .utils import DirectoryHelper
 from .views import main_bp
 
-def create_app(config_name='default'):
+def create_app(config_name='default', start_jobs=True):
     """
     Factory function để tạo và cấu hình Flask app
     
     Args:
         config_name (str): Tên môi trường config ('development', 'production', 'testing')
+        start_jobs (bool): Chạy các việc nền khi khởi động (False khi app được tạo
+            trong master trước khi fork worker, xem wsgi.py)
         
     Returns:
         Flask: Configured Flask application
@@ -37,6 +40,9 @@ def create_app(config_name='default'):
     db_manager = DatabaseManager(app.config.get('DATABASE_PATH'))
     db_manager.init_database()
     
+    if start_jobs:
+        start_background_jobs(app)
+    
     # Đăng ký Blueprint
     app.register_blueprint(main_bp)
     
@@ -58,3 +64,15 @@ def create_app(config_name='default'):
     app.logger.setLevel(logging.INFO if app.debug else logging.WARNING)
     
     return app
+
+def start_background_jobs(app):
+    """Chạy các việc nền khi khởi động: xử lý tiếp sách dang dở và tạo ảnh bìa thu nhỏ"""
+    db_manager = DatabaseManager(app.config.get('DATABASE_PATH'))
+    
+    # Tiếp tục xử lý nền các sách chưa xử lý xong
+    if app.config.get('INGESTION_RESUME_ON_STARTUP'):
+        IngestionService(db_manager).resume_unprocessed()
+    
+    # Tạo ảnh bìa thu nhỏ cho các sách có từ trước
+    if app.config.get('COVER_BACKFILL_ON_STARTUP'):
+        CoverService(db_manager).schedule_backfill()
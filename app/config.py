@@ -17,12 +17,24 @@ class Config:
     # Cấu hình database
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'ebook_library.db'
     DATABASE_TIMEOUT = 30.0  # 30 giây timeout cho SQLite
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 10)  # Số kết nối tối đa mỗi process
+    DATABASE_POOL_TIMEOUT = 10.0  # Số giây tối đa chờ mượn kết nối khi pool đã dùng hết
+    DATABASE_HEALTH_CHECK_INTERVAL = 30.0  # Kết nối rảnh lâu hơn (giây) được kiểm tra trước khi dùng lại
+    DATABASE_MMAP_SIZE = 256 * 1024 * 1024  # PRAGMA mmap_size (byte)
+    DATABASE_CACHE_SIZE_KB = 64 * 1024  # PRAGMA cache_size (KB) cho mỗi kết nối
     
     # Cấu hình upload file
     UPLOAD_FOLDER = 'static/uploads'
     COVERS_FOLDER = 'static/covers'
+    COVER_THUMBNAILS_FOLDER = 'static/covers/thumbs'  # Ảnh bìa thu nhỏ WebP (tạo khi xử lý nền)
+    EXTRACTED_TEXT_FOLDER = 'data/extracted_text'  # Nội dung PDF/EPUB đã trích xuất (không public)
     MAX_CONTENT_LENGTH = 200 * 1024 * 1024  # 200MB tối đa cho file upload
     
+    # Cấu hình upload nhiều phần (có thể tiếp tục sau khi mất kết nối)
+    UPLOAD_SESSIONS_FOLDER = 'data/upload_sessions'  # Các phần đã nhận (không public)
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB mỗi phần
+    UPLOAD_SESSION_MAX_AGE = 24 * 3600  # Phiên không có phần mới quá thời gian này (giây) bị xóa
+    
     # Các định dạng file được hỗ trợ
     ALLOWED_EXTENSIONS = {'.pdf', '.epub', '.txt'}
     
@@ -32,6 +44,61 @@ class Config:
     # Cấu hình đọc sách
     MAX_SEARCH_RESULTS = 20  # Giới hạn kết quả tìm kiếm trong sách
     DEFAULT_BOOKS_PER_PAGE = 8  # Số sách mặc định hiển thị trên trang chủ
+    SEARCH_BOOKS_PER_PAGE = 12  # Số sách mỗi trang kết quả tìm kiếm
+    MAX_SEARCH_BOOKS_PER_PAGE = 50  # Giới hạn tham số limit của trang tìm kiếm
+    SEARCH_SNIPPET_CHARS = 160  # Độ dài đoạn mô tả trích dẫn trong kết quả tìm kiếm
+    LIBRARY_BOOKS_PER_PAGE = 24  # Số sách mỗi trang thư viện cá nhân
+    NOTES_PER_PAGE = 20  # Số ghi chú mỗi trang chi tiết sách
+    READING_CHUNK_CHARS = 4000  # Số ký tự tối đa của một đoạn (một trang) khi đọc sách
+    
+    # Cấu hình lưu tiến độ đọc (ghi trễ theo lô)
+    # False: ghi ngay mỗi lần lưu; True: có thể mất tối đa PROGRESS_FLUSH_INTERVAL_MS tiến độ nếu process bị kill
+    PROGRESS_WRITE_BEHIND = (os.environ.get('PROGRESS_WRITE_BEHIND') or 'true').lower() not in ('0', 'false', 'no')
+    PROGRESS_FLUSH_INTERVAL_MS = int(os.environ.get('PROGRESS_FLUSH_INTERVAL_MS') or 1000)  # Chu kỳ ghi xuống database
+    PROGRESS_FLUSH_MAX_ENTRIES = 500  # Ghi sớm khi số vị trí đang chờ đạt ngưỡng này
+    
+    # Cấu hình thread pool cho các view async (lưu tiến độ, đọc và tìm kiếm trong sách)
+    # Qua WSGI, view async vẫn giữ thread của server trong lúc chờ thread pool: số việc nặng
+    # đang chạy và đang chờ bị giới hạn để luôn còn ASYNC_RESERVED_SERVER_THREADS thread cho request nhẹ
+    SERVER_THREADS = int(os.environ.get('GUNICORN_THREADS') or 4)  # Số thread mỗi worker gunicorn
+    ASYNC_RESERVED_SERVER_THREADS = 2
+    ASYNC_LIGHT_WORKERS = 4  # Việc nhẹ: đọc/ghi SQLite
+    ASYNC_LIGHT_MAX_PENDING = 256
+    ASYNC_HEAVY_WORKERS = 2  # Việc nặng: trích xuất và tìm kiếm nội dung sách
+    ASYNC_HEAVY_MAX_PENDING = 8  # Vượt quá (hoặc hết thread dành cho việc nặng) thì trả về 503 ngay
+    
+    # Cấu hình trích xuất PDF song song (nhiều process)
+    PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS') or os.cpu_count() or 1)
+    PDF_PARALLEL_MIN_PAGES = 200  # PDF ít trang hơn ngưỡng này được trích xuất trong 1 process
+    
+    # Cấu hình xử lý nền sau khi upload sách
+    INGESTION_WORKERS = 2  # Số thread xử lý nền
+    INGESTION_RESUME_ON_STARTUP = True  # Tiếp tục xử lý các sách còn dang dở khi khởi động
+    COVER_BACKFILL_ON_STARTUP = True  # Tạo ảnh bìa thu nhỏ cho các sách cũ chưa có khi khởi động
+    COVER_THUMBNAIL_WIDTHS = (160, 320, 640)  # Chiều rộng (px) các ảnh bìa thu nhỏ cho srcset
+    COVER_WEBP_QUALITY = 80
+    READING_WORDS_PER_MINUTE = 200  # Tốc độ đọc trung bình để ước tính thời gian đọc
+    
+    # Cấu hình cache nội dung sách (dùng chung cho mọi request trong process)
+    BOOK_CONTENT_CACHE_MAX_BYTES = int(os.environ.get('BOOK_CONTENT_CACHE_MAX_BYTES') or 256 * 1024 * 1024)  # 256MB
+    
+    # Cấu hình nạp sẵn cache khi chạy production (wsgi.py, trước khi fork worker)
+    WARMUP_ON_START = (os.environ.get('WARMUP_ON_START') or 'true').lower() not in ('0', 'false', 'no')
+    WARMUP_HOT_BOOKS = int(os.environ.get('WARMUP_HOT_BOOKS') or 20)  # Số sách đọc nhiều nhất được nạp nội dung
+    
+    # Cấu hình cache danh mục (sách mới, thể loại, kết quả tìm kiếm) trong mỗi process
+    CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL') or 60)  # Giây, cho thay đổi từ process khác
+    CATALOG_CACHE_MAX_ENTRIES = 1000  # Số kết quả tối đa được giữ (LRU)
+    
+    # Cấu hình nén response (gzip, brotli nếu đã cài thư viện brotli)
+    COMPRESS_MIN_BYTES = 500  # Response nhỏ hơn không nén
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5  # 0-11, mức vừa phải cho nén lúc chạy
+    COMPRESSED_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Cache bản nén của response có ETag (0: tắt)
+    
+    # Cấu hình đọc file TXT
+    TXT_ENCODING_SAMPLE_BYTES = 64 * 1024  # Số byte đầu file dùng để nhận diện encoding
+    TXT_FALLBACK_ENCODING = 'cp1252'  # Encoding dùng khi file không phải UTF-8
 
 class DevelopmentConfig(Config):
     """Cấu hình cho môi trường phát triển"""
@@ -46,6 +113,8 @@ class TestingConfig(Config):
     """Cấu hình cho môi trường testing"""
     TESTING = True
     DATABASE_PATH = ':memory:'  # Sử dụng SQLite in-memory cho testing
+    INGESTION_RESUME_ON_STARTUP = False
+    COVER_BACKFILL_ON_STARTUP = False
 
 # Dictionary để dễ dàng chọn config theo môi trường
 config = {
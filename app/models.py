@@ -3,7 +3,303 @@ Models và operations cho database SQLite
 """
 import sqlite3
 import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque, OrderedDict
 from .config import Config
+from .utils import TextNormalizer, BookSearcher, PaginationCursor
+
+logger = logging.getLogger(__name__)
+
+class PooledConnection(sqlite3.Connection):
+    """Kết nối SQLite thuộc một ConnectionPool, close() trả kết nối về pool thay vì đóng"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+        self.last_used = time.monotonic()
+    
+    def close(self):
+        if self.pool is None:
+            super().close()
+        elif self.checked_out:
+            self.pool.release(self)
+        # Kết nối đã được trả về pool: bỏ qua lệnh close() lặp lại
+    
+    def close_physical(self):
+        """Đóng hẳn kết nối"""
+        self.pool = None
+        super().close()
+
+class ConnectionPool:
+    """Pool kết nối SQLite dùng chung giữa các thread, giới hạn số kết nối mở cùng lúc
+    
+    Mỗi kết nối được cấu hình PRAGMA một lần khi tạo. Kết nối rảnh lâu hơn
+    DATABASE_HEALTH_CHECK_INTERVAL được kiểm tra lại trước khi cho mượn.
+    """
+    
+    def __init__(self, db_path, max_size=None, timeout=None):
+        self.db_path = db_path
+        self.max_size = max_size or Config.DATABASE_POOL_SIZE
+        self.timeout = timeout if timeout is not None else Config.DATABASE_POOL_TIMEOUT
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._size = 0  # Tổng số kết nối đang mở (rảnh + đang dùng)
+        self._condition = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0
+        }
+    
+    def _create_connection(self):
+        """Mở kết nối mới và áp dụng các PRAGMA tối ưu"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DATABASE_TIMEOUT,
+            check_same_thread=False,  # Kết nối được mượn lần lượt bởi nhiều thread
+            factory=PooledConnection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA mmap_size = {int(Config.DATABASE_MMAP_SIZE)}')
+        conn.execute(f'PRAGMA cache_size = -{int(Config.DATABASE_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(Config.DATABASE_TIMEOUT * 1000)}')
+        return conn
+    
+    def _is_healthy(self, conn):
+        """Kiểm tra kết nối rảnh lâu còn dùng được"""
+        if time.monotonic() - conn.last_used < Config.DATABASE_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def acquire(self):
+        """Mượn một kết nối, chờ tối đa self.timeout giây nếu pool đã dùng hết"""
+        started = None
+        with self._condition:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                
+                if started is None:
+                    started = time.monotonic()
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise TimeoutError("Hết thời gian chờ kết nối database")
+                self._condition.wait(remaining)
+            
+            if started is not None:
+                waited = time.monotonic() - started
+                self._stats['wait_seconds'] += waited
+                self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+            self._stats['checkouts'] += 1
+        
+        if conn is not None and not self._is_healthy(conn):
+            with self._condition:
+                self._stats['health_check_failures'] += 1
+            self._discard(conn, keep_slot=True)
+            conn = None
+        
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                self._release_slot()
+                raise
+            with self._condition:
+                self._stats['created'] += 1
+        
+        conn.pool = self
+        conn.checked_out = True
+        return conn
+    
+    def release(self, conn):
+        """Nhận lại kết nối, hủy transaction còn dở để kết nối sạch cho lần mượn sau"""
+        conn.checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        
+        conn.last_used = time.monotonic()
+        with self._condition:
+            self._idle.append(conn)
+            self._condition.notify()
+    
+    def _discard(self, conn, keep_slot=False):
+        """Đóng hẳn một kết nối hỏng"""
+        try:
+            conn.close_physical()
+        except sqlite3.Error:
+            pass
+        if not keep_slot:
+            self._release_slot()
+    
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+    
+    def close_all(self):
+        """Đóng các kết nối đang rảnh (kết nối đang được mượn sẽ được đóng khi trả về)"""
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close_physical()
+    
+    def stats(self):
+        """Thống kê sử dụng pool"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+        stats['avg_wait_ms'] = stats['wait_seconds'] * 1000 / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+# Pool dùng chung theo đường dẫn database (mọi DatabaseManager cùng file dùng chung pool)
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+def get_connection_pool(db_path):
+    """Lấy (hoặc tạo) pool kết nối cho một file database
+    
+    Pool được tạo lại sau khi fork để process con không dùng chung kết nối với process cha.
+    """
+    key = db_path if db_path == ':memory:' else os.path.abspath(db_path)
+    with _connection_pools_lock:
+        pool = _connection_pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = ConnectionPool(db_path)
+            _connection_pools[key] = pool
+        return pool
+
+class CatalogCache:
+    """Cache trong process cho các truy vấn danh mục giống nhau với mọi user
+    
+    (sách mới, danh sách thể loại, kết quả tìm kiếm phổ biến). Mỗi entry gắn
+    với generation của danh mục: khi sách/thể loại thay đổi, bump() tăng
+    generation và mọi entry cũ hết hiệu lực. TTL là lưới an toàn cho thay đổi
+    từ process khác (worker khác, script nhập sách), vốn không bump được
+    generation của process này. Số entry được giới hạn theo LRU.
+    """
+    
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = Config.CATALOG_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or Config.CATALOG_CACHE_MAX_ENTRIES
+        self.pid = os.getpid()
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (generation, hết hạn lúc, giá trị)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+    
+    def get_or_load(self, key, loader):
+        """Lấy giá trị còn hiệu lực trong cache, nếu không có thì gọi loader() và lưu lại
+        
+        Giá trị được dùng chung giữa các request nên không được sửa sau khi trả về.
+        Exception từ loader không được cache.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self.generation and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self.generation
+        
+        value = loader()
+        
+        with self._lock:
+            # Danh mục thay đổi trong lúc đang tải: không lưu kết quả có thể đã cũ
+            if generation == self.generation:
+                self._entries[key] = (generation, now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+    
+    def bump(self):
+        """Tăng generation khi danh mục thay đổi, bỏ toàn bộ entry cũ"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.invalidations += 1
+    
+    def copy_for_child(self):
+        """Tạo cache cho process con sau khi fork, giữ các entry đã nạp sẵn ở process cha
+        
+        Giá trị được dùng chung (không sao chép) nên vẫn nằm trên các trang
+        bộ nhớ copy-on-write của process cha.
+        """
+        catalog_cache = CatalogCache(self.ttl, self.max_entries)
+        catalog_cache.generation = self.generation
+        catalog_cache._entries = OrderedDict(self._entries)
+        return catalog_cache
+    
+    def stats(self):
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'generation': self.generation,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+# Cache danh mục dùng chung theo đường dẫn database
+_catalog_caches = {}
+_catalog_caches_lock = threading.Lock()
+
+def get_catalog_cache(db_path):
+    """Lấy (hoặc tạo) cache danh mục của một file database
+    
+    Sau khi fork, process con dùng cache mới nhưng giữ các entry process cha đã nạp.
+    """
+    key = db_path if db_path == ':memory:' else os.path.abspath(db_path)
+    with _catalog_caches_lock:
+        catalog_cache = _catalog_caches.get(key)
+        if catalog_cache is None:
+            catalog_cache = CatalogCache()
+            _catalog_caches[key] = catalog_cache
+        elif catalog_cache.pid != os.getpid():
+            catalog_cache = catalog_cache.copy_for_child()
+            _catalog_caches[key] = catalog_cache
+        return catalog_cache
 
 class DatabaseManager:
     """Quản lý kết nối và operations cho database"""
@@ -12,122 +308,436 @@ class DatabaseManager:
         self.db_path = db_path or Config.DATABASE_PATH
         
     def get_connection(self):
-        """Lấy kết nối database với cấu hình tối ưu"""
-        conn = sqlite3.connect(self.db_path, timeout=Config.DATABASE_TIMEOUT)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Mượn kết nối từ pool (đã cấu hình WAL, cache...), conn.close() sẽ trả kết nối về pool"""
+        return get_connection_pool(self.db_path).acquire()
+    
+    def get_pool_stats(self):
+        """Thống kê pool kết nối của database này"""
+        return get_connection_pool(self.db_path).stats()
+    
+    def close_connections(self):
+        """Đóng các kết nối đang rảnh của pool (gọi trước khi fork worker)"""
+        get_connection_pool(self.db_path).close_all()
+    
+    def get_catalog_cache(self):
+        """Cache danh mục (sách mới, thể loại, kết quả tìm kiếm) của database này"""
+        return get_catalog_cache(self.db_path)
+    
+    def invalidate_catalog(self):
+        """Báo danh mục đã thay đổi: các kết quả đang cache hết hiệu lực"""
+        get_catalog_cache(self.db_path).bump()
     
     def init_database(self):
-        """Khởi tạo database với tất cả bảng cần thiết"""
+        """Khởi tạo database và nâng cấp schema lên phiên bản mới nhất"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Tạo bảng Users (Người dùng)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    full_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Tạo bảng Authors (Tác giả)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS authors (
-                    author_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    author_name TEXT NOT NULL,
-                    birth_year INTEGER,
-                    nationality TEXT
-                )
-            ''')
-            
-            # Tạo bảng Publishers (Nhà xuất bản)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS publishers (
-                    publisher_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    publisher_name TEXT NOT NULL,
-                    address TEXT
-                )
-            ''')
-            
-            # Tạo bảng Genres (Thể loại)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS genres (
-                    genre_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    genre_name TEXT UNIQUE NOT NULL
-                )
-            ''')
+            SchemaMigrator(conn).migrate()
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def index_catalog_books(cursor, book_ids=None):
+        """Cập nhật chỉ mục danh mục cho các sách (tất cả sách nếu book_ids là None)
+        
+        Dùng cursor/connection của transaction hiện tại để chỉ mục luôn khớp
+        với dữ liệu vừa ghi. Không làm gì nếu database không có bảng books_fts.
+        """
+        sql = '''
+            SELECT b.book_id, b.title, a.author_name, p.publisher_name, b.description,
+                   (SELECT GROUP_CONCAT(g.genre_name, ' ')
+                    FROM book_genres bg JOIN genres g ON bg.genre_id = g.genre_id
+                    WHERE bg.book_id = b.book_id) AS genre_names
+            FROM books b
+            LEFT JOIN authors a ON b.author_id = a.author_id
+            LEFT JOIN publishers p ON b.publisher_id = p.publisher_id
+        '''
+        params = []
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            if not book_ids:
+                return
+            sql += f" WHERE b.book_id IN ({','.join('?' * len(book_ids))})"
+            params = book_ids
+        
+        if not cursor.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+        ).fetchone():
+            return
+        
+        if book_ids is not None:
+            cursor.execute(
+                f"DELETE FROM books_fts WHERE rowid IN ({','.join('?' * len(book_ids))})",
+                book_ids
+            )
+        
+        rows = cursor.connection.execute(sql, params)
+        cursor.executemany('''
+            INSERT INTO books_fts (rowid, title, author_name, publisher_name, description, genre_names)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (row[0],) + tuple(TextNormalizer.fold(value or '') for value in row[1:])
+            for row in rows
+        ))
+
+class SchemaMigrator:
+    """Nâng cấp schema database theo các bước migration có đánh số phiên bản
+    
+    Phiên bản đã áp dụng được lưu trong bảng schema_migrations. Mỗi bước chạy
+    trong một transaction riêng (BEGIN IMMEDIATE) nên nhiều process khởi động
+    cùng lúc không áp dụng trùng, và database đang dùng được nâng cấp tại chỗ.
+    Các bước đầu viết dạng "IF NOT EXISTS" để database tạo từ phiên bản cũ
+    (chưa có bảng schema_migrations) cũng nâng cấp được.
+    """
+    
+    # (phiên bản, tên bước) - tên bước là tên static method thực hiện migration
+    MIGRATIONS = [
+        (1, 'create_base_tables'),
+        (2, 'add_book_ingestion_columns'),
+        (3, 'create_book_search_index'),
+        (4, 'create_catalog_index'),
+        (5, 'add_hot_path_indexes'),
+        (6, 'add_book_content_hash'),
+        (7, 'add_book_cover_srcset'),
+        (8, 'make_book_content_hash_unique'),
+        (9, 'add_reading_position_unit'),
+    ]
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def current_version(self):
+        """Phiên bản schema hiện tại (0 nếu chưa áp dụng migration nào)"""
+        row = self.conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+        return row[0] or 0
+    
+    def migrate(self):
+        """Áp dụng các migration chưa chạy, sau đó cập nhật thống kê cho query planner
+        
+        Returns:
+            list: Các phiên bản vừa được áp dụng
+        """
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.conn.commit()
+        
+        current_version = self.current_version()
+        applied = []
+        for version, name in self.MIGRATIONS:
+            if version <= current_version:
+                continue
             
-            # Tạo bảng Books (Sách)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS books (
-                    book_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    author_id INTEGER,
-                    publisher_id INTEGER,
-                    description TEXT,
-                    cover_image_url TEXT,
-                    file_path TEXT,
-                    publication_year INTEGER,
-                    page_count INTEGER,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (author_id) REFERENCES authors (author_id),
-                    FOREIGN KEY (publisher_id) REFERENCES publishers (publisher_id)
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Process khác có thể vừa áp dụng bước này trong lúc chờ khóa
+                if self.conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                    self.conn.rollback()
+                    continue
+                
+                getattr(self, name)(self.conn.cursor())
+                self.conn.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+                    (version, name)
                 )
-            ''')
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise e
             
-            # Tạo bảng BookGenres (Liên kết sách và thể loại)
+            logger.info("Đã áp dụng migration %s: %s", version, name)
+            applied.append(version)
+        
+        if applied:
+            self.conn.execute('ANALYZE')
+            self.conn.commit()
+        return applied
+    
+    @staticmethod
+    def create_base_tables(cursor):
+        """Tạo các bảng cơ bản (schema ban đầu của ứng dụng)"""
+        # Tạo bảng Users (Người dùng)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                full_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Tạo bảng Authors (Tác giả)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS authors (
+                author_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                author_name TEXT NOT NULL,
+                birth_year INTEGER,
+                nationality TEXT
+            )
+        ''')
+        
+        # Tạo bảng Publishers (Nhà xuất bản)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS publishers (
+                publisher_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                publisher_name TEXT NOT NULL,
+                address TEXT
+            )
+        ''')
+        
+        # Tạo bảng Genres (Thể loại)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS genres (
+                genre_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                genre_name TEXT UNIQUE NOT NULL
+            )
+        ''')
+        
+        # Tạo bảng Books (Sách)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS books (
+                book_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                author_id INTEGER,
+                publisher_id INTEGER,
+                description TEXT,
+                cover_image_url TEXT,
+                file_path TEXT,
+                publication_year INTEGER,
+                page_count INTEGER,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (author_id) REFERENCES authors (author_id),
+                FOREIGN KEY (publisher_id) REFERENCES publishers (publisher_id)
+            )
+        ''')
+        
+        # Tạo bảng BookGenres (Liên kết sách và thể loại)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS book_genres (
+                book_id INTEGER,
+                genre_id INTEGER,
+                PRIMARY KEY (book_id, genre_id),
+                FOREIGN KEY (book_id) REFERENCES books (book_id),
+                FOREIGN KEY (genre_id) REFERENCES genres (genre_id)
+            )
+        ''')
+        
+        # Tạo bảng UserLibrary (Thư viện cá nhân)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_library (
+                user_library_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                book_id INTEGER,
+                is_favorite BOOLEAN DEFAULT FALSE,
+                last_read_position INTEGER DEFAULT 0,
+                reading_status TEXT DEFAULT 'not_started',
+                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id),
+                FOREIGN KEY (book_id) REFERENCES books (book_id)
+            )
+        ''')
+        
+        # Tạo bảng Notes (Ghi chú)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notes (
+                note_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                book_id INTEGER,
+                content TEXT NOT NULL,
+                location_in_book TEXT,
+                highlighted_text TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id),
+                FOREIGN KEY (book_id) REFERENCES books (book_id)
+            )
+        ''')
+    
+    @staticmethod
+    def create_catalog_index(cursor):
+        """Tạo bảng FTS5 cho tìm kiếm danh mục sách (rowid = book_id)
+        
+        Các cột chứa nội dung đã bỏ dấu. Khi bảng vừa được tạo trên database
+        đã có sách, toàn bộ sách được đưa vào chỉ mục.
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+        ).fetchone()
+        if exists:
+            return
+        
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS book_genres (
-                    book_id INTEGER,
-                    genre_id INTEGER,
-                    PRIMARY KEY (book_id, genre_id),
-                    FOREIGN KEY (book_id) REFERENCES books (book_id),
-                    FOREIGN KEY (genre_id) REFERENCES genres (genre_id)
+                CREATE VIRTUAL TABLE books_fts USING fts5(
+                    title,
+                    author_name,
+                    publisher_name,
+                    description,
+                    genre_names,
+                    tokenize = 'unicode61 remove_diacritics 2'
                 )
             ''')
-            
-            # Tạo bảng UserLibrary (Thư viện cá nhân)
+        except sqlite3.OperationalError:
+            # SQLite không hỗ trợ FTS5: tìm kiếm sách dùng LIKE
+            return
+        
+        DatabaseManager.index_catalog_books(cursor)
+    
+    @staticmethod
+    def create_book_search_index(cursor):
+        """Tạo bảng FTS5 chứa từng dòng nội dung sách và bảng trạng thái chỉ mục
+        
+        rowid của mỗi dòng = (book_id << 32) | số thứ tự dòng, nhờ vậy lọc theo
+        sách chỉ là một khoảng rowid. Cột folded_text là nội dung đã bỏ dấu để
+        tìm kiếm không phân biệt dấu tiếng Việt, line_text giữ nguyên văn để hiển thị.
+        """
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_library (
-                    user_library_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    book_id INTEGER,
-                    is_favorite BOOLEAN DEFAULT FALSE,
-                    last_read_position INTEGER DEFAULT 0,
-                    reading_status TEXT DEFAULT 'not_started',
-                    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (book_id) REFERENCES books (book_id)
+                CREATE VIRTUAL TABLE IF NOT EXISTS book_content_fts USING fts5(
+                    folded_text,
+                    char_offset UNINDEXED,
+                    line_text UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
                 )
             ''')
-            
-            # Tạo bảng Notes (Ghi chú)
+        except sqlite3.OperationalError:
+            # SQLite không hỗ trợ FTS5: tìm kiếm trong sách dùng cách quét tuần tự
+            return
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS book_search_index (
+                book_id INTEGER PRIMARY KEY,
+                source_version TEXT NOT NULL,
+                line_count INTEGER,
+                indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (book_id) REFERENCES books (book_id)
+            )
+        ''')
+    
+    @staticmethod
+    def add_missing_columns(cursor, table, columns):
+        """Thêm các cột còn thiếu vào bảng (ALTER TABLE ... ADD COLUMN)"""
+        existing = {row['name'] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()}
+        for column, definition in columns.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    @staticmethod
+    def add_book_ingestion_columns(cursor):
+        """Thêm các cột lưu kết quả xử lý nền vào bảng books"""
+        SchemaMigrator.add_missing_columns(cursor, 'books', {
+            'word_count': 'INTEGER',
+            'char_count': 'INTEGER',
+            'reading_time_minutes': 'INTEGER',
+            'ingestion_status': "TEXT DEFAULT 'pending'",
+            'ingestion_error': 'TEXT',
+            'ingested_at': 'TIMESTAMP'
+        })
+    
+    @staticmethod
+    def add_hot_path_indexes(cursor):
+        """Tạo index cho các truy vấn thường dùng
+        
+        Trước khi tạo UNIQUE index trên user_library(user_id, book_id), các dòng
+        trùng (do thêm sách đồng thời) được gộp lại.
+        """
+        SchemaMigrator._deduplicate_user_library(cursor)
+        
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_user_library_user_book ON user_library (user_id, book_id)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_library_user_added
+            ON user_library (user_id, added_date, user_library_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notes_user_book_created
+            ON notes (user_id, book_id, created_at, note_id)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_added_at ON books (added_at, book_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_ingestion_status ON books (ingestion_status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_genres_genre ON book_genres (genre_id, book_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_authors_name ON authors (author_name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_publishers_name ON publishers (publisher_name)')
+    
+    @staticmethod
+    def add_book_content_hash(cursor):
+        """Thêm cột mã băm SHA-256 nội dung file sách để nhận biết file đã nhập"""
+        SchemaMigrator.add_missing_columns(cursor, 'books', {'content_hash': 'TEXT'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_content_hash ON books (content_hash)')
+    
+    @staticmethod
+    def add_book_cover_srcset(cursor):
+        """Thêm cột srcset ảnh bìa thu nhỏ (NULL: chưa xử lý, rỗng: sách không có ảnh bìa)"""
+        SchemaMigrator.add_missing_columns(cursor, 'books', {'cover_srcset': 'TEXT'})
+    
+    @staticmethod
+    def make_book_content_hash_unique(cursor):
+        """Đổi index mã băm nội dung thành UNIQUE (bỏ qua sách chưa có mã băm)
+        
+        Các sách trùng nội dung đã tạo từ trước được giữ nguyên, chỉ sách tạo
+        sớm nhất giữ mã băm để các lần upload sau được gộp vào sách đó.
+        """
+        cursor.execute('''
+            UPDATE books SET content_hash = NULL
+            WHERE content_hash IS NOT NULL
+              AND book_id != (
+                  SELECT MIN(other.book_id) FROM books AS other
+                  WHERE other.content_hash = books.content_hash
+              )
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_books_content_hash')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_books_content_hash
+            ON books (content_hash) WHERE content_hash IS NOT NULL
+        ''')
+    
+    @staticmethod
+    def add_reading_position_unit(cursor):
+        """Thêm cột đơn vị của last_read_position
+        
+        Trình đọc cũ lưu vị trí theo số từ ('word'), trình đọc theo đoạn lưu offset
+        ký tự ('char'). Vị trí cũ được đổi sang offset ký tự ở lần mở sách tiếp theo.
+        """
+        SchemaMigrator.add_missing_columns(cursor, 'user_library', {
+            'last_read_position_unit': "TEXT NOT NULL DEFAULT 'char'"
+        })
+        cursor.execute('''
+            UPDATE user_library SET last_read_position_unit = 'word'
+            WHERE last_read_position > 0
+        ''')
+    
+    @staticmethod
+    def _deduplicate_user_library(cursor):
+        """Gộp các dòng user_library trùng (user_id, book_id) thành một dòng
+        
+        Giữ dòng có vị trí đọc xa nhất (trùng thì giữ dòng thêm trước), giữ
+        trạng thái yêu thích nếu một trong các dòng đã được đánh dấu.
+        """
+        duplicates = cursor.execute('''
+            SELECT user_id, book_id, MAX(is_favorite) AS is_favorite
+            FROM user_library
+            GROUP BY user_id, book_id
+            HAVING COUNT(*) > 1
+        ''').fetchall()
+        
+        for user_id, book_id, is_favorite in duplicates:
+            keep_id = cursor.execute('''
+                SELECT user_library_id FROM user_library
+                WHERE user_id = ? AND book_id = ?
+                ORDER BY last_read_position DESC, user_library_id
+                LIMIT 1
+            ''', (user_id, book_id)).fetchone()[0]
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notes (
-                    note_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    book_id INTEGER,
-                    content TEXT NOT NULL,
-                    location_in_book TEXT,
-                    highlighted_text TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (book_id) REFERENCES books (book_id)
-                )
-            ''')
-            
-            conn.commit()
-            
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+                DELETE FROM user_library
+                WHERE user_id = ? AND book_id = ? AND user_library_id != ?
+            ''', (user_id, book_id, keep_id))
+            cursor.execute(
+                'UPDATE user_library SET is_favorite = ? WHERE user_library_id = ?',
+                (is_favorite, keep_id)
+            )
 
 class UserModel:
     """Model cho thao tác với bảng users"""
@@ -255,36 +865,186 @@ class BookModel:
         finally:
             conn.close()
     
-    def search_books(self, query=None, genre=None):
-        """Tìm kiếm sách theo tiêu đề, tác giả hoặc thể loại"""
+    # Các cột user_library lấy kèm trong get_book_detail (alias có tiền tố ul_)
+    DETAIL_LIBRARY_COLUMNS = (
+        'user_library_id', 'user_id', 'book_id', 'is_favorite',
+        'last_read_position', 'reading_status', 'added_date'
+    )
+    
+    def get_book_detail(self, book_id, user_id, notes_limit=None, notes_cursor=None):
+        """Lấy mọi dữ liệu của trang chi tiết sách trên một kết nối
+        
+        Câu lệnh thứ nhất lấy sách, tác giả, NXB, danh sách thể loại (gộp bằng
+        json_group_array) và dòng user_library của user; câu lệnh thứ hai lấy
+        một trang ghi chú.
+        
+        Returns:
+            dict: book, genres, user_book (None nếu sách chưa có trong thư viện),
+                  notes, notes_next_cursor; None nếu không tìm thấy sách
+        """
+        library_columns = ', '.join(
+            f'ul.{column} AS ul_{column}' for column in self.DETAIL_LIBRARY_COLUMNS
+        )
+        notes_sql, notes_params, notes_limit = NoteModel.build_page_query(
+            user_id, book_id, notes_limit, notes_cursor
+        )
+        
         conn = self.db.get_connection()
         try:
-            sql = '''
-                SELECT DISTINCT b.*, a.author_name, p.publisher_name
+            row = conn.execute(f'''
+                SELECT b.*, a.author_name, p.publisher_name,
+                       (SELECT json_group_array(g.genre_name)
+                        FROM book_genres bg JOIN genres g ON g.genre_id = bg.genre_id
+                        WHERE bg.book_id = b.book_id) AS genre_names,
+                       {library_columns}
                 FROM books b
                 LEFT JOIN authors a ON b.author_id = a.author_id
                 LEFT JOIN publishers p ON b.publisher_id = p.publisher_id
-                LEFT JOIN book_genres bg ON b.book_id = bg.book_id
-                LEFT JOIN genres g ON bg.genre_id = g.genre_id
-                WHERE 1=1
-            '''
-            params = []
+                LEFT JOIN user_library ul ON ul.book_id = b.book_id AND ul.user_id = ?
+                WHERE b.book_id = ?
+            ''', (user_id, book_id)).fetchone()
+            if row is None:
+                return None
             
+            notes, notes_next_cursor = PaginationCursor.paginate(
+                conn.execute(notes_sql, notes_params).fetchall(), notes_limit, ('created_at', 'note_id')
+            )
+        finally:
+            conn.close()
+        
+        book = {}
+        user_book = {}
+        for key in row.keys():
+            if key.startswith('ul_'):
+                user_book[key[3:]] = row[key]
+            elif key != 'genre_names':
+                book[key] = row[key]
+        
+        if user_book['user_library_id'] is None:
+            user_book = None
+        else:
+            progress_buffer = get_progress_buffer(self.db.db_path, create=False)
+            if progress_buffer is not None:
+                user_book = progress_buffer.apply_pending(user_id, [user_book])[0]
+        
+        return {
+            'book': book,
+            'genres': [{'genre_name': name} for name in json.loads(row['genre_names'])],
+            'user_book': user_book,
+            'notes': notes,
+            'notes_next_cursor': notes_next_cursor
+        }
+    
+    # Trọng số BM25 cho các cột của books_fts: tiêu đề, tác giả, NXB, mô tả, thể loại
+    CATALOG_RANK_WEIGHTS = (10.0, 5.0, 2.0, 1.0, 3.0)
+    
+    # Các cột dùng cho danh sách sách (mô tả chỉ lấy phần đầu để làm đoạn trích)
+    LIST_COLUMNS = '''
+        b.book_id, b.title, b.cover_image_url, b.cover_srcset, b.publication_year, b.added_at,
+        SUBSTR(b.description, 1, 1000) AS description, a.author_name, p.publisher_name
+    '''
+    
+    def search_books(self, query=None, genre=None, page=1, per_page=None, cursor=None):
+        """Tìm kiếm sách theo tiêu đề, tác giả, NXB, mô tả hoặc thể loại
+        
+        Có từ khóa thì kết quả được xếp theo độ liên quan (BM25), không có thì
+        theo thời gian thêm sách mới nhất. Khi có cursor (lấy từ trang trước),
+        trang tiếp theo được lấy theo keyset và bỏ qua tham số page.
+        
+        Returns:
+            tuple: (danh sách sách của trang, tổng số sách khớp, cursor trang sau hoặc None)
+        """
+        per_page = per_page or Config.SEARCH_BOOKS_PER_PAGE
+        after = PaginationCursor.decode(cursor, 2)
+        offset = 0 if after else (max(page, 1) - 1) * per_page
+        
+        fts_query = BookSearcher.build_fts_query(query) if query else None
+        if query and not fts_query:
+            return [], 0, None
+        
+        genre_filter = '''
+            SELECT bg.book_id FROM book_genres bg JOIN genres g ON bg.genre_id = g.genre_id
+            WHERE g.genre_name = ?
+        '''
+        
+        conn = self.db.get_connection()
+        try:
+            if fts_query and self._has_catalog_index(conn):
+                # Xếp hạng và phân trang trên riêng bảng FTS, chỉ join các sách của trang
+                where = 'WHERE books_fts MATCH ?'
+                params = [fts_query]
+                if genre:
+                    where += f' AND books_fts.rowid IN ({genre_filter})'
+                    params.append(genre)
+                
+                total = conn.execute(f'SELECT COUNT(*) FROM books_fts {where}', params).fetchone()[0]
+                
+                weights = ', '.join(str(weight) for weight in self.CATALOG_RANK_WEIGHTS)
+                ranked = f'''
+                    SELECT rowid AS book_id, bm25(books_fts, {weights}) AS score
+                    FROM books_fts
+                    {where}
+                '''
+                if after:
+                    ranked = f'SELECT * FROM ({ranked}) WHERE (score, book_id) > (?, ?)'
+                    params += after
+                
+                rows = conn.execute(f'''
+                    SELECT {self.LIST_COLUMNS}, ranked.score
+                    FROM (
+                        {ranked}
+                        ORDER BY score, book_id
+                        LIMIT ? OFFSET ?
+                    ) ranked
+                    JOIN books b ON b.book_id = ranked.book_id
+                    LEFT JOIN authors a ON b.author_id = a.author_id
+                    LEFT JOIN publishers p ON b.publisher_id = p.publisher_id
+                    ORDER BY ranked.score, ranked.book_id
+                ''', params + [per_page + 1, offset]).fetchall()
+                books, next_cursor = PaginationCursor.paginate(rows, per_page, ('score', 'book_id'))
+                return books, total, next_cursor
+            
+            where = 'WHERE 1=1'
+            params = []
             if query:
-                sql += ' AND (b.title LIKE ? OR a.author_name LIKE ?)'
+                # SQLite không hỗ trợ FTS5
+                where += '''
+                    AND (b.title LIKE ? OR b.author_id IN (
+                        SELECT author_id FROM authors WHERE author_name LIKE ?
+                    ))
+                '''
                 params.extend([f'%{query}%', f'%{query}%'])
-            
             if genre:
-                sql += ' AND g.genre_name = ?'
+                where += f' AND b.book_id IN ({genre_filter})'
                 params.append(genre)
             
-            sql += ' ORDER BY b.added_at DESC'
+            total = conn.execute(f'SELECT COUNT(*) FROM books b {where}', params).fetchone()[0]
             
-            books = conn.execute(sql, params).fetchall()
-            return books
+            if after:
+                where += ' AND (b.added_at, b.book_id) < (?, ?)'
+                params += after
+            
+            rows = conn.execute(f'''
+                SELECT {self.LIST_COLUMNS}
+                FROM books b
+                LEFT JOIN authors a ON b.author_id = a.author_id
+                LEFT JOIN publishers p ON b.publisher_id = p.publisher_id
+                {where}
+                ORDER BY b.added_at DESC, b.book_id DESC
+                LIMIT ? OFFSET ?
+            ''', params + [per_page + 1, offset]).fetchall()
+            books, next_cursor = PaginationCursor.paginate(rows, per_page, ('added_at', 'book_id'))
+            return books, total, next_cursor
         finally:
             conn.close()
     
+    @staticmethod
+    def _has_catalog_index(conn):
+        """Kiểm tra database có bảng FTS5 books_fts hay không"""
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+        ).fetchone() is not None
+    
     def create_book(self, title, author_id, publisher_id, description, file_path, publication_year=None):
         """Tạo sách mới"""
         conn = self.db.get_connection()
@@ -293,7 +1053,9 @@ class BookModel:
                 INSERT INTO books (title, author_id, publisher_id, description, file_path, publication_year)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (title, author_id, publisher_id, description, file_path, publication_year))
+            DatabaseManager.index_catalog_books(cursor, [cursor.lastrowid])
             conn.commit()
+            self.db.invalidate_catalog()
             return cursor.lastrowid
         except Exception as e:
             conn.rollback()
@@ -357,6 +1119,7 @@ class BookModel:
             # Tạo thể loại mới
             cursor = conn.execute('INSERT INTO genres (genre_name) VALUES (?)', (genre_name,))
             conn.commit()
+            self.db.invalidate_catalog()
             return cursor.lastrowid
         except Exception as e:
             conn.rollback()
@@ -368,13 +1131,133 @@ class BookModel:
         """Liên kết sách với thể loại"""
         conn = self.db.get_connection()
         try:
-            conn.execute('INSERT INTO book_genres (book_id, genre_id) VALUES (?, ?)', (book_id, genre_id))
+            cursor = conn.execute('INSERT INTO book_genres (book_id, genre_id) VALUES (?, ?)', (book_id, genre_id))
+            DatabaseManager.index_catalog_books(cursor, [book_id])
+            conn.commit()
+            self.db.invalidate_catalog()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def update_ingestion_status(self, book_id, status, error=None):
+        """Cập nhật trạng thái xử lý nền của sách"""
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+                UPDATE books SET ingestion_status = ?, ingestion_error = ?
+                WHERE book_id = ?
+            ''', (status, error, book_id))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def save_ingestion_result(self, book_id, page_count, word_count, char_count, reading_time_minutes,
+                              content_hash=None):
+        """Lưu kết quả xử lý nền (số trang, số từ, thời gian đọc) và đánh dấu sẵn sàng
+        
+        content_hash chỉ được ghi khi sách chưa có mã băm và chưa có sách khác cùng
+        mã băm (mã băm là UNIQUE).
+        """
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+                UPDATE books
+                SET page_count = ?, word_count = ?, char_count = ?, reading_time_minutes = ?,
+                    content_hash = COALESCE(content_hash, (
+                        SELECT ? WHERE NOT EXISTS (SELECT 1 FROM books WHERE content_hash = ?)
+                    )),
+                    ingestion_status = 'ready', ingestion_error = NULL, ingested_at = CURRENT_TIMESTAMP
+                WHERE book_id = ?
+            ''', (page_count, word_count, char_count, reading_time_minutes, content_hash, content_hash, book_id))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def update_cover(self, book_id, cover_image_url, cover_srcset):
+        """Lưu URL ảnh bìa và srcset ảnh thu nhỏ của sách"""
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+                UPDATE books SET cover_image_url = ?, cover_srcset = ?
+                WHERE book_id = ?
+            ''', (cover_image_url, cover_srcset, book_id))
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
         finally:
             conn.close()
+        self.db.invalidate_catalog()
+    
+    def get_book_ids_without_cover_thumbnails(self):
+        """Lấy ID các sách chưa tạo ảnh bìa thu nhỏ (có ảnh bìa hoặc đã xử lý nền xong)"""
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT book_id FROM books
+                WHERE cover_srcset IS NULL
+                  AND (cover_image_url IS NOT NULL OR ingestion_status = 'ready')
+                ORDER BY book_id
+            ''').fetchall()
+            return [row['book_id'] for row in rows]
+        finally:
+            conn.close()
+    
+    def get_ingestion_status(self, book_id):
+        """Lấy trạng thái xử lý nền và các thông số của sách"""
+        conn = self.db.get_connection()
+        try:
+            status = conn.execute('''
+                SELECT book_id, ingestion_status, ingestion_error, page_count,
+                       word_count, char_count, reading_time_minutes
+                FROM books WHERE book_id = ?
+            ''', (book_id,)).fetchone()
+            return status
+        finally:
+            conn.close()
+    
+    def get_book_by_content_hash(self, content_hash):
+        """Lấy sách đầu tiên có cùng mã băm nội dung (dùng để tránh lưu trùng file)"""
+        conn = self.db.get_connection()
+        try:
+            return conn.execute('''
+                SELECT book_id, title, file_path FROM books
+                WHERE content_hash = ?
+                ORDER BY book_id
+                LIMIT 1
+            ''', (content_hash,)).fetchone()
+        finally:
+            conn.close()
+    
+    def get_content_hashes(self):
+        """Lấy tập mã băm nội dung của các sách đã có trong database"""
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('SELECT content_hash FROM books WHERE content_hash IS NOT NULL')
+            return {row[0] for row in rows}
+        finally:
+            conn.close()
+    
+    def get_unprocessed_book_ids(self):
+        """Lấy ID các sách chưa xử lý xong (đang chờ hoặc bị gián đoạn)"""
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT book_id FROM books
+                WHERE ingestion_status IS NULL OR ingestion_status IN ('pending', 'processing')
+                ORDER BY book_id
+            ''').fetchall()
+            return [row['book_id'] for row in rows]
+        finally:
+            conn.close()
     
     def get_book_genres(self, book_id):
         """Lấy danh sách thể loại của sách"""
@@ -390,6 +1273,22 @@ class BookModel:
         finally:
             conn.close()
     
+    def get_popular_books(self, limit=20):
+        """Lấy các sách được nhiều user đọc nhất (dùng để nạp sẵn nội dung vào cache)"""
+        conn = self.db.get_connection()
+        try:
+            return conn.execute('''
+                SELECT b.book_id, b.file_path, COUNT(*) AS reader_count
+                FROM user_library ul
+                JOIN books b ON b.book_id = ul.book_id
+                WHERE ul.reading_status = 'reading' AND b.file_path IS NOT NULL
+                GROUP BY b.book_id
+                ORDER BY reader_count DESC, b.book_id DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+        finally:
+            conn.close()
+    
     def get_all_genres(self):
         """Lấy tất cả thể loại"""
         conn = self.db.get_connection()
@@ -405,19 +1304,81 @@ class UserLibraryModel:
     def __init__(self, db_manager):
         self.db = db_manager
     
-    def get_user_books(self, user_id):
-        """Lấy danh sách sách trong thư viện user"""
+    # Điều kiện lọc thư viện theo trạng thái
+    # Vị trí đọc theo offset ký tự để hiển thị tiến độ: vị trí cũ lưu theo số từ được
+    # ước lượng theo tỉ lệ ký tự/từ của sách (đổi chính xác khi user mở lại sách)
+    ESTIMATED_CHAR_POSITION = '''
+        CASE WHEN ul.last_read_position_unit = 'word'
+             THEN ul.last_read_position * COALESCE(b.char_count, 0) / MAX(COALESCE(b.word_count, 0), 1)
+             ELSE ul.last_read_position END
+    '''
+    
+    LIBRARY_FILTERS = {
+        'reading': "ul.reading_status = 'reading'",
+        'completed': "ul.reading_status = 'completed'",
+        'favorite': 'ul.is_favorite = 1'
+    }
+    
+    def get_user_books(self, user_id, limit=None, cursor=None, status_filter=None):
+        """Lấy một trang sách trong thư viện user, mới thêm trước
+        
+        Phân trang theo keyset (added_date, user_library_id) nên không bị lặp
+        hay sót sách khi user thêm sách trong lúc đang xem.
+        
+        Returns:
+            tuple: (danh sách sách, cursor trang sau hoặc None)
+        """
+        limit = limit or Config.LIBRARY_BOOKS_PER_PAGE
+        sql = f'''
+            SELECT b.book_id, b.title, b.cover_image_url, b.cover_srcset, b.char_count, a.author_name,
+                   ul.user_library_id, ul.added_date, ul.is_favorite, ul.reading_status,
+                   {self.ESTIMATED_CHAR_POSITION} AS last_read_position
+            FROM user_library ul
+            JOIN books b ON b.book_id = ul.book_id
+            LEFT JOIN authors a ON b.author_id = a.author_id
+            WHERE ul.user_id = ?
+        '''
+        params = [user_id]
+        
+        if status_filter in self.LIBRARY_FILTERS:
+            sql += f' AND {self.LIBRARY_FILTERS[status_filter]}'
+        
+        after = PaginationCursor.decode(cursor, 2)
+        if after:
+            sql += ' AND (ul.added_date, ul.user_library_id) < (?, ?)'
+            params += after
+        
+        sql += ' ORDER BY ul.added_date DESC, ul.user_library_id DESC LIMIT ?'
+        params.append(limit + 1)
+        
         conn = self.db.get_connection()
         try:
-            books = conn.execute('''
-                SELECT b.*, a.author_name, ul.is_favorite, ul.reading_status, ul.last_read_position
-                FROM books b
-                LEFT JOIN authors a ON b.author_id = a.author_id
-                JOIN user_library ul ON b.book_id = ul.book_id
-                WHERE ul.user_id = ?
-                ORDER BY ul.added_date DESC
-            ''', (user_id,)).fetchall()
-            return books
+            rows = conn.execute(sql, params).fetchall()
+            books, next_cursor = PaginationCursor.paginate(rows, limit, ('added_date', 'user_library_id'))
+            return self._with_pending_progress(user_id, books), next_cursor
+        finally:
+            conn.close()
+    
+    def _with_pending_progress(self, user_id, rows):
+        """Thay last_read_position bằng vị trí mới hơn còn nằm trong bộ đệm ghi trễ"""
+        progress_buffer = get_progress_buffer(self.db.db_path, create=False)
+        if progress_buffer is None:
+            return rows
+        return progress_buffer.apply_pending(user_id, rows)
+    
+    def get_library_stats(self, user_id):
+        """Đếm số sách trong thư viện theo từng trạng thái"""
+        conn = self.db.get_connection()
+        try:
+            stats = conn.execute('''
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(reading_status = 'reading'), 0) AS reading,
+                       COALESCE(SUM(reading_status = 'completed'), 0) AS completed,
+                       COALESCE(SUM(is_favorite = 1), 0) AS favorite
+                FROM user_library
+                WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+            return dict(stats)
         finally:
             conn.close()
     
@@ -425,15 +1386,16 @@ class UserLibraryModel:
         """Lấy danh sách sách đang đọc"""
         conn = self.db.get_connection()
         try:
-            books = conn.execute('''
-                SELECT b.*, a.author_name, ul.last_read_position, ul.reading_status
+            books = conn.execute(f'''
+                SELECT b.*, a.author_name, {self.ESTIMATED_CHAR_POSITION} AS last_read_position,
+                       ul.reading_status
                 FROM books b
                 LEFT JOIN authors a ON b.author_id = a.author_id
                 JOIN user_library ul ON b.book_id = ul.book_id
                 WHERE ul.user_id = ? AND ul.reading_status = 'reading'
                 ORDER BY ul.added_date DESC
             ''', (user_id,)).fetchall()
-            return books
+            return self._with_pending_progress(user_id, books)
         finally:
             conn.close()
     
@@ -445,7 +1407,9 @@ class UserLibraryModel:
                 SELECT * FROM user_library 
                 WHERE user_id = ? AND book_id = ?
             ''', (user_id, book_id)).fetchone()
-            return user_book
+            if user_book is None:
+                return None
+            return self._with_pending_progress(user_id, [user_book])[0]
         finally:
             conn.close()
     
@@ -453,17 +1417,13 @@ class UserLibraryModel:
         """Thêm sách vào thư viện user"""
         conn = self.db.get_connection()
         try:
-            # Kiểm tra đã tồn tại chưa
-            existing = self.get_user_book(user_id, book_id)
-            if existing:
-                return False  # Đã tồn tại
-            
-            conn.execute('''
-                INSERT INTO user_library (user_id, book_id, reading_status)
+            # UNIQUE index (user_id, book_id) bỏ qua dòng trùng, kể cả khi thêm đồng thời
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO user_library (user_id, book_id, reading_status)
                 VALUES (?, ?, ?)
             ''', (user_id, book_id, reading_status))
             conn.commit()
-            return True
+            return cursor.rowcount == 1  # False nếu sách đã có trong thư viện
         except Exception as e:
             conn.rollback()
             raise e
@@ -487,13 +1447,40 @@ class UserLibraryModel:
             conn.close()
     
     def save_reading_progress(self, user_id, book_id, position):
-        """Lưu tiến độ đọc sách"""
+        """Lưu tiến độ đọc sách
+        
+        Khi bật PROGRESS_WRITE_BEHIND, vị trí được giữ trong ReadingProgressBuffer
+        và ghi xuống database theo lô; nếu tắt thì ghi ngay trong request.
+        """
+        if Config.PROGRESS_WRITE_BEHIND:
+            get_progress_buffer(self.db.db_path).put(user_id, book_id, position)
+        else:
+            self.save_reading_progress_batch([(user_id, book_id, position)])
+    
+    def save_reading_progress_batch(self, entries):
+        """Ghi tiến độ đọc của nhiều (user_id, book_id, position) trong một transaction"""
         conn = self.db.get_connection()
         try:
-            conn.execute('''
+            conn.executemany('''
                 UPDATE user_library 
-                SET last_read_position = ?
+                SET last_read_position = ?, last_read_position_unit = 'char'
                 WHERE user_id = ? AND book_id = ?
+            ''', [(position, user_id, book_id) for user_id, book_id, position in entries])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def convert_word_position(self, user_id, book_id, position):
+        """Lưu offset ký tự thay cho vị trí cũ theo số từ (bỏ qua nếu vị trí đã được lưu lại)"""
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+                UPDATE user_library
+                SET last_read_position = ?, last_read_position_unit = 'char'
+                WHERE user_id = ? AND book_id = ? AND last_read_position_unit = 'word'
             ''', (position, user_id, book_id))
             conn.commit()
         except Exception as e:
@@ -503,27 +1490,203 @@ class UserLibraryModel:
             conn.close()
     
     def toggle_favorite(self, user_id, book_id):
-        """Chuyển đổi trạng thái yêu thích"""
+        """Chuyển đổi trạng thái yêu thích
+        
+        Đổi và đọc lại trạng thái trên cùng một kết nối, trong cùng transaction: không
+        mượn thêm kết nối từ pool và hai lượt đổi đồng thời không ghi đè lên nhau.
+        """
         conn = self.db.get_connection()
         try:
-            user_book = self.get_user_book(user_id, book_id)
-            if not user_book:
-                return False
-            
-            new_favorite = not user_book['is_favorite']
             conn.execute('''
                 UPDATE user_library 
-                SET is_favorite = ?
+                SET is_favorite = NOT is_favorite
+                WHERE user_id = ? AND book_id = ?
+            ''', (user_id, book_id))
+            row = conn.execute('''
+                SELECT is_favorite FROM user_library
                 WHERE user_id = ? AND book_id = ?
-            ''', (new_favorite, user_id, book_id))
+            ''', (user_id, book_id)).fetchone()
             conn.commit()
-            return new_favorite
+            if row is None:
+                return False
+            return bool(row['is_favorite'])
         except Exception as e:
             conn.rollback()
             raise e
         finally:
             conn.close()
 
+class ReadingProgressBuffer:
+    """Bộ đệm ghi trễ (write-behind) cho tiến độ đọc sách
+    
+    Mỗi lần lật trang chỉ cập nhật vị trí mới nhất của (user, sách) trong bộ
+    nhớ; một thread nền ghi tất cả vị trí đang chờ trong một transaction sau mỗi
+    PROGRESS_FLUSH_INTERVAL_MS, hoặc sớm hơn khi có PROGRESS_FLUSH_MAX_ENTRIES
+    vị trí. Các lần lưu liên tiếp của cùng một cuốn sách được gộp thành một lần
+    ghi. Khi process thoát, các vị trí còn lại được ghi nốt (atexit).
+    """
+    
+    def __init__(self, db_path, flush_interval_ms=None, max_entries=None):
+        self.user_library = UserLibraryModel(DatabaseManager(db_path))
+        self.flush_interval = (flush_interval_ms or Config.PROGRESS_FLUSH_INTERVAL_MS) / 1000
+        self.max_entries = max_entries or Config.PROGRESS_FLUSH_MAX_ENTRIES
+        self.pid = os.getpid()
+        self._pending = {}  # (user_id, book_id) -> position
+        self._flushing = {}  # Các vị trí đang được ghi, vẫn dùng để đọc cho tới khi commit
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.saves = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+    
+    def put(self, user_id, book_id, position):
+        """Ghi nhận vị trí đọc mới nhất (ghi xuống database ở lần flush sau)"""
+        key = (int(user_id), int(book_id))
+        with self._lock:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                if key in self._pending:
+                    self.coalesced += 1
+                self._pending[key] = position
+                self.saves += 1
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='progress-writer', daemon=True
+                    )
+                    self._thread.start()
+                if len(self._pending) >= self.max_entries:
+                    self._wakeup.set()
+        
+        if closed:
+            # Đã đóng (process đang thoát): ghi thẳng để không mất vị trí
+            self.user_library.save_reading_progress_batch([key + (position,)])
+    
+    def get_pending(self, user_id, book_id):
+        """Vị trí chưa ghi xuống database của (user, sách), None nếu không có"""
+        key = (int(user_id), int(book_id))
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            return self._flushing.get(key)
+    
+    def apply_pending(self, user_id, rows):
+        """Trả về danh sách dòng user_library với last_read_position đã cập nhật theo bộ đệm"""
+        with self._lock:
+            if not self._pending and not self._flushing:
+                return rows
+            pending = {**self._flushing, **self._pending}
+        
+        result = []
+        for row in rows:
+            position = pending.get((int(user_id), row['book_id']))
+            if position is not None and position != row['last_read_position']:
+                row = dict(row)
+                row['last_read_position'] = position
+                if 'last_read_position_unit' in row:
+                    row['last_read_position_unit'] = 'char'
+            result.append(row)
+        return result
+    
+    def flush(self):
+        """Ghi tất cả vị trí đang chờ trong một transaction, trả về số dòng đã ghi"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                batch = self._flushing
+            
+            try:
+                self.user_library.save_reading_progress_batch(
+                    [key + (position,) for key, position in batch.items()]
+                )
+            except Exception:
+                with self._lock:
+                    # Giữ lại để ghi ở lần sau, trừ khi đã có vị trí mới hơn
+                    for key, position in batch.items():
+                        self._pending.setdefault(key, position)
+                    self._flushing = {}
+                    self.flush_errors += 1
+                raise
+            
+            with self._lock:
+                self._flushing = {}
+                self.flushes += 1
+                self.flushed_rows += len(batch)
+            return len(batch)
+    
+    def _run(self):
+        """Vòng lặp của thread nền: flush định kỳ hoặc khi bộ đệm đầy"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Không thể ghi tiến độ đọc xuống database")
+    
+    def close(self):
+        """Dừng thread nền và ghi nốt các vị trí còn lại"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+    
+    def stats(self):
+        """Thống kê số lần lưu, số lần gộp và số lần ghi xuống database"""
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'saves': self.saves,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'flushed_rows': self.flushed_rows,
+                'flush_errors': self.flush_errors
+            }
+
+# Bộ đệm tiến độ đọc dùng chung theo đường dẫn database
+_progress_buffers = {}
+_progress_buffers_lock = threading.Lock()
+
+def get_progress_buffer(db_path, create=True):
+    """Lấy (hoặc tạo) bộ đệm tiến độ đọc của một file database
+    
+    Với create=False trả về None nếu chưa có. Sau khi fork, process con dùng
+    bộ đệm mới (vị trí đang chờ của process cha do process cha ghi).
+    """
+    key = db_path if db_path == ':memory:' else os.path.abspath(db_path)
+    with _progress_buffers_lock:
+        progress_buffer = _progress_buffers.get(key)
+        if progress_buffer is None or progress_buffer.pid != os.getpid():
+            if not create:
+                return None
+            progress_buffer = ReadingProgressBuffer(db_path)
+            _progress_buffers[key] = progress_buffer
+        return progress_buffer
+
+def flush_progress_buffers():
+    """Đóng mọi bộ đệm tiến độ đọc của process này và ghi nốt dữ liệu còn lại"""
+    with _progress_buffers_lock:
+        buffers = [progress_buffer for progress_buffer in _progress_buffers.values()
+                   if progress_buffer.pid == os.getpid()]
+    for progress_buffer in buffers:
+        try:
+            progress_buffer.close()
+        except Exception:
+            logger.exception("Không thể ghi nốt tiến độ đọc khi tắt")
+
+atexit.register(flush_progress_buffers)
+
 class NoteModel:
     """Model cho thao tác với ghi chú"""
     
@@ -546,15 +1709,348 @@ class NoteModel:
         finally:
             conn.close()
     
-    def get_book_notes(self, user_id, book_id):
-        """Lấy danh sách ghi chú của sách"""
+    @staticmethod
+    def build_page_query(user_id, book_id, limit=None, cursor=None):
+        """Tạo câu lệnh lấy một trang ghi chú (lấy thừa một dòng để biết còn trang sau)
+        
+        Returns:
+            tuple: (sql, params, limit)
+        """
+        limit = limit or Config.NOTES_PER_PAGE
+        sql = '''
+            SELECT note_id, content, location_in_book, highlighted_text, created_at
+            FROM notes
+            WHERE user_id = ? AND book_id = ?
+        '''
+        params = [user_id, book_id]
+        
+        after = PaginationCursor.decode(cursor, 2)
+        if after:
+            sql += ' AND (created_at, note_id) < (?, ?)'
+            params += after
+        
+        sql += ' ORDER BY created_at DESC, note_id DESC LIMIT ?'
+        params.append(limit + 1)
+        return sql, params, limit
+    
+    def get_book_notes(self, user_id, book_id, limit=None, cursor=None):
+        """Lấy một trang ghi chú của sách, mới nhất trước (phân trang keyset)
+        
+        Returns:
+            tuple: (danh sách ghi chú, cursor trang sau hoặc None)
+        """
+        sql, params, limit = self.build_page_query(user_id, book_id, limit, cursor)
         conn = self.db.get_connection()
         try:
-            notes = conn.execute('''
-                SELECT * FROM notes 
-                WHERE user_id = ? AND book_id = ?
-                ORDER BY created_at DESC
-            ''', (user_id, book_id)).fetchall()
-            return notes
+            rows = conn.execute(sql, params).fetchall()
+            return PaginationCursor.paginate(rows, limit, ('created_at', 'note_id'))
+        finally:
+            conn.close()
+
+class BookSearchIndexModel:
+    """Model cho chỉ mục tìm kiếm toàn văn (FTS5) trong nội dung sách"""
+    
+    INSERT_BATCH_SIZE = 5000
+    
+    def __init__(self, db_manager):
+        self.db = db_manager
+    
+    @staticmethod
+    def _rowid_range(book_id):
+        """Khoảng rowid chứa các dòng của một cuốn sách"""
+        first_rowid = book_id << 32
+        return first_rowid, first_rowid + 0xFFFFFFFF
+    
+    def get_index_version(self, book_id):
+        """Lấy phiên bản file đã được đánh chỉ mục (None nếu chưa có hoặc không hỗ trợ FTS5)"""
+        conn = self.db.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT source_version FROM book_search_index WHERE book_id = ?',
+                (book_id,)
+            ).fetchone()
+            return row['source_version'] if row else None
+        except sqlite3.OperationalError:
+            return None
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+    
+    def rebuild_index(self, book_id, source_version, lines):
+        """Đánh chỉ mục lại toàn bộ nội dung một cuốn sách trong một transaction
+        
+        Args:
+            lines: iterable các tuple (line_index, char_offset, line_text, folded_text)
+        """
+        first_rowid, last_rowid = self._rowid_range(book_id)
+        conn = self.db.get_connection()
+        try:
+            conn.execute('DELETE FROM book_content_fts WHERE rowid BETWEEN ? AND ?', (first_rowid, last_rowid))
+            
+            line_count = 0
+            batch = []
+            for line_index, char_offset, line_text, folded_text in lines:
+                batch.append((first_rowid + line_index, folded_text, char_offset, line_text))
+                line_count += 1
+                if len(batch) >= self.INSERT_BATCH_SIZE:
+                    conn.executemany(
+                        'INSERT INTO book_content_fts (rowid, folded_text, char_offset, line_text) VALUES (?, ?, ?, ?)',
+                        batch
+                    )
+                    batch = []
+            if batch:
+                conn.executemany(
+                    'INSERT INTO book_content_fts (rowid, folded_text, char_offset, line_text) VALUES (?, ?, ?, ?)',
+                    batch
+                )
+            
+            conn.execute('''
+                INSERT OR REPLACE INTO book_search_index (book_id, source_version, line_count, indexed_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (book_id, source_version, line_count))
+            conn.commit()
+            return line_count
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def search(self, book_id, fts_query, limit):
+        """Tìm các dòng khớp truy vấn FTS5, trả về (danh sách dòng, tổng số dòng khớp)"""
+        first_rowid, last_rowid = self._rowid_range(book_id)
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT rowid - ? AS line_index, char_offset, line_text
+                FROM book_content_fts
+                WHERE book_content_fts MATCH ? AND rowid BETWEEN ? AND ?
+                ORDER BY rowid
+                LIMIT ?
+            ''', (first_rowid, fts_query, first_rowid, last_rowid, limit)).fetchall()
+            
+            if len(rows) < limit:
+                total = len(rows)
+            else:
+                total = conn.execute('''
+                    SELECT COUNT(*) FROM book_content_fts
+                    WHERE book_content_fts MATCH ? AND rowid BETWEEN ? AND ?
+                ''', (fts_query, first_rowid, last_rowid)).fetchone()[0]
+            return rows, total
+        finally:
+            conn.close()
+    
+    def get_lines(self, book_id, line_indexes):
+        """Lấy nội dung các dòng theo số thứ tự (dòng trống không có trong chỉ mục)"""
+        if not line_indexes:
+            return {}
+        first_rowid = book_id << 32
+        rowids = [first_rowid + line_index for line_index in line_indexes]
+        conn = self.db.get_connection()
+        try:
+            placeholders = ','.join('?' * len(rowids))
+            rows = conn.execute(
+                f'SELECT rowid - ? AS line_index, line_text FROM book_content_fts WHERE rowid IN ({placeholders})',
+                [first_rowid] + rowids
+            ).fetchall()
+            return {row['line_index']: row['line_text'] for row in rows}
+        finally:
+            conn.close()
+    
+    def delete_index(self, book_id):
+        """Xóa chỉ mục của một cuốn sách"""
+        first_rowid, last_rowid = self._rowid_range(book_id)
+        conn = self.db.get_connection()
+        try:
+            conn.execute('DELETE FROM book_content_fts WHERE rowid BETWEEN ? AND ?', (first_rowid, last_rowid))
+            conn.execute('DELETE FROM book_search_index WHERE book_id = ?', (book_id,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+
+# Cache tên -> id (tác giả, NXB, thể loại) dùng chung giữa các UnitOfWork, theo từng database
+_name_id_caches = {}
+_name_id_caches_lock = threading.Lock()
+
+class UnitOfWork:
+    """Gom nhiều thao tác ghi vào một transaction duy nhất
+    
+    Dùng với câu lệnh with: commit khi khối lệnh chạy xong, rollback nếu có
+    exception nên không bao giờ để lại dữ liệu ghi dở. Tên tác giả/NXB/thể
+    loại đã tra được cache trong bộ nhớ; id của dòng tạo trong transaction chỉ
+    được đưa vào cache dùng chung sau khi commit thành công.
+    
+    Ví dụ:
+        with UnitOfWork(db) as uow:
+            author_id = uow.get_or_create_author('Nguyễn Du')
+            book_id = uow.create_book('Truyện Kiều', author_id, None, '', file_path)
+            uow.link_book_genres(book_id, uow.get_or_create_genres(['Thơ']))
+    """
+    
+    NAME_CACHE_MAX_ENTRIES = 100000
+    
+    # Bảng, cột id, cột tên cho từng loại tên được cache
+    _NAME_TABLES = {
+        'author': ('authors', 'author_id', 'author_name'),
+        'publisher': ('publishers', 'publisher_id', 'publisher_name'),
+        'genre': ('genres', 'genre_id', 'genre_name')
+    }
+    
+    def __init__(self, db_manager):
+        self.db = db_manager
+        self.conn = None
+        self._pending_names = {}
+        self._books_to_index = set()
+        key = db_manager.db_path if db_manager.db_path == ':memory:' else os.path.abspath(db_manager.db_path)
+        with _name_id_caches_lock:
+            self._shared_names = _name_id_caches.setdefault(key, {})
+    
+    def __enter__(self):
+        self.conn = self.db.get_connection()
+        try:
+            # Giữ khóa ghi ngay từ đầu để tra cứu và tạo mới không bị xen giữa
+            self.conn.execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.conn.close()
+            raise
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                if self._books_to_index:
+                    DatabaseManager.index_catalog_books(self.conn.cursor(), sorted(self._books_to_index))
+                self.conn.commit()
+                if self._books_to_index or any(kind == 'genre' for kind, _ in self._pending_names):
+                    self.db.invalidate_catalog()
+                self._publish_names()
+            else:
+                self.conn.rollback()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.close()
+            self.conn = None
+        return False
+    
+    def _publish_names(self):
+        """Đưa các id đã commit vào cache dùng chung"""
+        with _name_id_caches_lock:
+            if len(self._shared_names) + len(self._pending_names) > self.NAME_CACHE_MAX_ENTRIES:
+                self._shared_names.clear()
+            self._shared_names.update(self._pending_names)
+        self._pending_names = {}
+    
+    def _cached_name_id(self, kind, name):
+        key = (kind, name)
+        if key in self._pending_names:
+            return self._pending_names[key]
+        return self._shared_names.get(key)
+    
+    def _get_or_create_name(self, kind, name):
+        """Lấy hoặc tạo dòng theo tên trong bảng authors/publishers/genres"""
+        if not name:
+            return None
+        
+        name_id = self._cached_name_id(kind, name)
+        if name_id is not None:
+            return name_id
+        
+        table, id_column, name_column = self._NAME_TABLES[kind]
+        row = self.conn.execute(
+            f'SELECT {id_column} FROM {table} WHERE {name_column} = ? LIMIT 1', (name,)
+        ).fetchone()
+        name_id = row[0] if row else self.conn.execute(
+            f'INSERT INTO {table} ({name_column}) VALUES (?)', (name,)
+        ).lastrowid
+        
+        self._pending_names[(kind, name)] = name_id
+        return name_id
+    
+    def get_or_create_author(self, author_name):
+        """Lấy hoặc tạo tác giả"""
+        return self._get_or_create_name('author', author_name)
+    
+    def get_or_create_publisher(self, publisher_name):
+        """Lấy hoặc tạo nhà xuất bản (None nếu không có tên)"""
+        return self._get_or_create_name('publisher', publisher_name)
+    
+    def get_or_create_genres(self, genre_names):
+        """Lấy hoặc tạo nhiều thể loại, trả về danh sách id theo thứ tự tên (bỏ tên trùng/rỗng)"""
+        names = list(dict.fromkeys(name.strip() for name in genre_names if name and name.strip()))
+        missing = [name for name in names if self._cached_name_id('genre', name) is None]
+        
+        if missing:
+            # genre_name là UNIQUE: tạo hàng loạt các thể loại chưa có rồi tra id một lần
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO genres (genre_name) VALUES (?)',
+                [(name,) for name in missing]
+            )
+            placeholders = ','.join('?' * len(missing))
+            for row in self.conn.execute(
+                f'SELECT genre_id, genre_name FROM genres WHERE genre_name IN ({placeholders})', missing
+            ):
+                self._pending_names[('genre', row['genre_name'])] = row['genre_id']
+        
+        return [self._cached_name_id('genre', name) for name in names]
+    
+    def get_book_by_content_hash(self, content_hash):
+        """Lấy sách có mã băm nội dung (tra trong transaction để không bị upload khác xen giữa)"""
+        return self.conn.execute(
+            'SELECT book_id, title, file_path FROM books WHERE content_hash = ?', (content_hash,)
+        ).fetchone()
+    
+    def is_file_referenced(self, file_path):
+        """Kiểm tra đã có sách nào dùng file này chưa"""
+        return self.conn.execute(
+            'SELECT 1 FROM books WHERE file_path = ? LIMIT 1', (file_path,)
+        ).fetchone() is not None
+    
+    def create_book(self, title, author_id, publisher_id, description, file_path,
+                    publication_year=None, content_hash=None):
+        """Tạo sách mới (chỉ mục tìm kiếm danh mục được cập nhật lúc commit)"""
+        book_id = self.conn.execute('''
+            INSERT INTO books (title, author_id, publisher_id, description, file_path,
+                               publication_year, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (title, author_id, publisher_id, description, file_path,
+              publication_year, content_hash)).lastrowid
+        self._books_to_index.add(book_id)
+        return book_id
+    
+    def save_ingestion_result(self, book_id, page_count, word_count, char_count, reading_time_minutes):
+        """Lưu thông số sách đã tính sẵn và đánh dấu sẵn sàng (không cần xử lý nền)"""
+        self.conn.execute('''
+            UPDATE books
+            SET page_count = ?, word_count = ?, char_count = ?, reading_time_minutes = ?,
+                ingestion_status = 'ready', ingestion_error = NULL, ingested_at = CURRENT_TIMESTAMP
+            WHERE book_id = ?
+        ''', (page_count, word_count, char_count, reading_time_minutes, book_id))
+    
+    def set_book_cover(self, book_id, cover_image_url, cover_srcset):
+        """Lưu URL ảnh bìa và srcset ảnh thu nhỏ của sách"""
+        self.conn.execute(
+            'UPDATE books SET cover_image_url = ?, cover_srcset = ? WHERE book_id = ?',
+            (cover_image_url, cover_srcset, book_id)
+        )
+        self._books_to_index.add(book_id)
+    
+    def link_book_genres(self, book_id, genre_ids):
+        """Liên kết sách với nhiều thể loại bằng một lệnh executemany"""
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO book_genres (book_id, genre_id) VALUES (?, ?)',
+            [(book_id, genre_id) for genre_id in genre_ids]
+        )
+        self._books_to_index.add(book_id)
+    
+    def add_to_library(self, user_id, book_id, reading_status='not_started'):
+        """Thêm sách vào thư viện user, trả về False nếu sách đã có"""
+        cursor = self.conn.execute('''
+            INSERT OR IGNORE INTO user_library (user_id, book_id, reading_status)
+            VALUES (?, ?, ?)
+        ''', (user_id, book_id, reading_status))
+        return cursor.rowcount == 1
@@ -1,11 +1,79 @@
 """
 Business logic services cho ứng dụng EBook Reader
 """
+import os
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
-from .models import DatabaseManager, UserModel, BookModel, UserLibraryModel, NoteModel
-from .utils import BookContentReader, BookSearcher, FileProcessor, ValidationHelper
+import sqlite3
+from .models import DatabaseManager, UserModel, BookModel, UserLibraryModel, NoteModel, BookSearchIndexModel, UnitOfWork
+from .utils import BookContentReader, BookSearcher, FileProcessor, ValidationHelper, TextNormalizer, DirectoryHelper, CoverImageProcessor, ChunkedUploadStore, BoundedExecutor
 from .config import Config
 
+logger = logging.getLogger(__name__)
+
+# Thread pool xử lý nền sau upload, chỉ được tạo khi lần đầu cần đến
+_ingestion_executor = None
+_ingestion_executor_lock = threading.Lock()
+
+def _get_ingestion_executor():
+    """Lấy (hoặc tạo) thread pool dùng chung cho xử lý nền"""
+    global _ingestion_executor
+    with _ingestion_executor_lock:
+        if _ingestion_executor is None:
+            _ingestion_executor = ThreadPoolExecutor(
+                max_workers=Config.INGESTION_WORKERS,
+                thread_name_prefix='ingestion'
+            )
+        return _ingestion_executor
+
+# Thread pool cho các API async: việc nhẹ (SQLite) và việc nặng (nội dung sách) tách riêng
+_api_executors = {}
+_api_executors_lock = threading.Lock()
+
+def _heavy_executor_limits():
+    """Số việc nặng chạy cùng lúc và số việc được chờ, theo số thread của server
+    
+    Mỗi việc nặng đang chạy hoặc đang chờ giữ một thread của server, nên tổng số
+    luôn nhỏ hơn SERVER_THREADS để request nhẹ không phải chờ sau request nặng.
+    """
+    slots = max(1, Config.SERVER_THREADS - Config.ASYNC_RESERVED_SERVER_THREADS)
+    workers = min(Config.ASYNC_HEAVY_WORKERS, slots)
+    return workers, min(Config.ASYNC_HEAVY_MAX_PENDING, slots - workers)
+
+def _get_api_executor(kind):
+    """Lấy (hoặc tạo) thread pool 'light' hoặc 'heavy' dùng chung cho các API async"""
+    with _api_executors_lock:
+        if kind not in _api_executors:
+            if kind == 'heavy':
+                _api_executors[kind] = BoundedExecutor(*_heavy_executor_limits(), 'api-heavy')
+            else:
+                _api_executors[kind] = BoundedExecutor(
+                    Config.ASYNC_LIGHT_WORKERS, Config.ASYNC_LIGHT_MAX_PENDING, 'api-light'
+                )
+        return _api_executors[kind]
+
+# Khóa đánh chỉ mục tìm kiếm theo từng cuốn sách: book_id -> [lock, số thread đang dùng]
+# (chỉ các request cùng một cuốn sách chờ nhau, sách khác không bị chặn)
+_search_index_locks = {}
+_search_index_locks_lock = threading.Lock()
+
+def _reset_executors_after_fork():
+    """Thread của process cha không tồn tại trong process con: tạo lại thread pool và khóa khi cần"""
+    global _ingestion_executor, _ingestion_executor_lock, _api_executors, _api_executors_lock
+    global _search_index_locks, _search_index_locks_lock
+    _ingestion_executor = None
+    _ingestion_executor_lock = threading.Lock()
+    _api_executors = {}
+    _api_executors_lock = threading.Lock()
+    _search_index_locks = {}
+    _search_index_locks_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_executors_after_fork)
+
 class UserService:
     """Service xử lý logic liên quan đến người dùng"""
     
@@ -104,7 +172,7 @@ class BookService:
         """Lấy dữ liệu cho trang chủ"""
         limit = limit or Config.DEFAULT_BOOKS_PER_PAGE
         try:
-            recent_books = self.book_model.get_recent_books(limit)
+            recent_books = self.get_recent_books(limit)
             
             # Lấy sách đang đọc của user
             user_library = UserLibraryModel(self.db)
@@ -121,46 +189,53 @@ class BookService:
                 'error': f"Lỗi khi lấy dữ liệu: {str(e)}"
             }
     
-    def get_book_detail(self, book_id, user_id):
+    def get_recent_books(self, limit=None):
+        """Lấy sách mới nhất (giống nhau với mọi user nên lấy từ cache danh mục)"""
+        limit = limit or Config.DEFAULT_BOOKS_PER_PAGE
+        return self.db.get_catalog_cache().get_or_load(
+            ('recent_books', limit), lambda: self.book_model.get_recent_books(limit)
+        )
+    
+    def get_genres(self):
+        """Lấy danh sách thể loại từ cache danh mục"""
+        return self.db.get_catalog_cache().get_or_load(('genres',), self.book_model.get_all_genres)
+    
+    def get_book_detail(self, book_id, user_id, notes_cursor=None):
         """Lấy chi tiết sách và thông tin liên quan"""
         try:
-            # Lấy thông tin sách
-            book = self.book_model.get_book_by_id(book_id)
-            if not book:
+            # Sách, thể loại, thông tin trong thư viện user và ghi chú lấy trên cùng một kết nối
+            detail = self.book_model.get_book_detail(book_id, user_id, notes_cursor=notes_cursor)
+            if not detail:
                 return None, "Không tìm thấy sách"
             
-            # Lấy thể loại
-            genres = self.book_model.get_book_genres(book_id)
-            
-            # Lấy thông tin trong thư viện user
-            user_library = UserLibraryModel(self.db)
-            user_book = user_library.get_user_book(user_id, book_id)
-            
-            # Lấy ghi chú
-            note_model = NoteModel(self.db)
-            notes = note_model.get_book_notes(user_id, book_id)
-            
-            return {
-                'book': book,
-                'genres': genres,
-                'user_book': user_book,
-                'notes': notes
-            }, None
+            return detail, None
             
         except Exception as e:
             return None, f"Lỗi khi lấy thông tin sách: {str(e)}"
     
-    def search_books(self, query=None, genre=None):
-        """Tìm kiếm sách"""
+    def search_books(self, query=None, genre=None, page=1, per_page=None, cursor=None):
+        """Tìm kiếm sách, có phân trang và đoạn trích đánh dấu từ khóa"""
+        per_page = min(max(per_page or Config.SEARCH_BOOKS_PER_PAGE, 1), Config.MAX_SEARCH_BOOKS_PER_PAGE)
+        page = max(page or 1, 1)
         try:
-            books = self.book_model.search_books(query, genre)
-            genres = self.book_model.get_all_genres()
+            catalog_cache = self.db.get_catalog_cache()
+            # Kết quả (kể cả đoạn trích đã đánh dấu) chỉ phụ thuộc tham số tìm kiếm
+            results, total, next_cursor = catalog_cache.get_or_load(
+                ('search', query, genre, page, per_page, cursor),
+                lambda: self._load_search_results(query, genre, page, per_page, cursor)
+            )
+            genres = self.get_genres()
             
             return {
-                'books': books,
+                'books': results,
                 'genres': genres,
                 'query': query,
-                'selected_genre': genre
+                'selected_genre': genre,
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': max(math.ceil(total / per_page), 1),
+                'next_cursor': next_cursor
             }
         except Exception as e:
             return {
@@ -168,9 +243,29 @@ class BookService:
                 'genres': [],
                 'query': query,
                 'selected_genre': genre,
+                'total': 0,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': 1,
+                'next_cursor': None,
                 'error': f"Lỗi tìm kiếm: {str(e)}"
             }
     
+    def _load_search_results(self, query, genre, page, per_page, cursor):
+        """Tìm kiếm trong database và tạo đoạn trích đánh dấu từ khóa cho từng sách"""
+        books, total, next_cursor = self.book_model.search_books(query, genre, page, per_page, cursor)
+        
+        results = []
+        for book in books:
+            book = dict(book)
+            book['title_snippet'] = BookSearcher.highlight(book['title'], query)
+            book['author_snippet'] = BookSearcher.highlight(book['author_name'], query)
+            book['description_snippet'] = BookSearcher.highlight(
+                book['description'], query, Config.SEARCH_SNIPPET_CHARS
+            )
+            results.append(book)
+        return results, total, next_cursor
+    
     def upload_book(self, file, title, author_name, publisher_name="", description="", 
                    publication_year=None, genre_names=None, user_id=None):
         """Upload và xử lý sách mới"""
@@ -182,40 +277,400 @@ class BookService:
         if missing_fields:
             return False, f"Thiếu thông tin: {', '.join(missing_fields)}"
         
+        file_path = None
+        file_created = False
         try:
-            # Lưu file
-            file_path = FileProcessor.save_uploaded_file(file, Config.UPLOAD_FOLDER)
-            if not file_path:
+            # Lưu file theo mã băm nội dung
+            stored_file = FileProcessor.save_uploaded_file(file, Config.UPLOAD_FOLDER)
+            if not stored_file:
                 return False, "Lỗi khi lưu file"
+            file_path, content_hash, file_created = stored_file
+            
+            try:
+                book_id, created = self._create_or_reuse_book(
+                    file_path, content_hash, file_created, title, author_name, publisher_name,
+                    description, publication_year, genre_names, user_id
+                )
+            except sqlite3.IntegrityError:
+                # Sách cùng mã băm vừa được tạo ngoài transaction này: dùng lại sách đó
+                existing_book = self.book_model.get_book_by_content_hash(content_hash)
+                if not existing_book:
+                    raise
+                if user_id:
+                    UserLibraryModel(self.db).add_to_library(user_id, existing_book['book_id'])
+                book_id, created = existing_book['book_id'], False
             
-            # Lấy hoặc tạo author
-            author_id = self.book_model.get_or_create_author(author_name)
+            if created:
+                # Trích xuất nội dung và tính thông số sách chạy nền, không chờ
+                IngestionService(self.db).enqueue(book_id)
+            
+            return True, book_id
+            
+        except ValueError as e:
+            return False, str(e)
+        except Exception as e:
+            # Transaction đã rollback, xóa file vừa lưu để không còn dữ liệu dở dang
+            # (không xóa nếu cùng nội dung đã được lưu từ trước hoặc sách khác đang dùng)
+            if file_path and file_created:
+                self._discard_stored_file(file_path)
+            return False, f"Lỗi khi upload sách: {str(e)}"
+    
+    def _create_or_reuse_book(self, file_path, content_hash, file_created, title, author_name,
+                              publisher_name, description, publication_year, genre_names, user_id):
+        """Tạo sách mới, hoặc dùng lại sách có nội dung giống hệt đã tồn tại
+        
+        Tra mã băm và tạo sách trong cùng một transaction (BEGIN IMMEDIATE) nên hai
+        lượt upload cùng nội dung không thể cùng tạo sách.
+        
+        Returns:
+            tuple: (book_id, True nếu sách vừa được tạo)
+        """
+        with UnitOfWork(self.db) as uow:
+            existing_book = uow.get_book_by_content_hash(content_hash)
+            if existing_book:
+                if (file_created and file_path != existing_book['file_path']
+                        and not uow.is_file_referenced(file_path)):
+                    DirectoryHelper.delete_file_safe(file_path)
+                if user_id:
+                    uow.add_to_library(user_id, existing_book['book_id'])
+                return existing_book['book_id'], False
             
-            # Lấy hoặc tạo publisher
-            publisher_id = self.book_model.get_or_create_publisher(publisher_name) if publisher_name else None
+            # Lượt upload cùng nội dung bị lỗi có thể vừa xóa file dùng chung
+            if not os.path.exists(file_path):
+                raise ValueError("Lỗi khi lưu file, vui lòng thử lại")
+            
+            # Lấy hoặc tạo author, publisher
+            author_id = uow.get_or_create_author(author_name)
+            publisher_id = uow.get_or_create_publisher(publisher_name) if publisher_name else None
             
             # Tạo sách
-            book_id = self.book_model.create_book(
-                title, author_id, publisher_id, description, file_path, publication_year
+            book_id = uow.create_book(
+                title, author_id, publisher_id, description, file_path, publication_year,
+                content_hash=content_hash
             )
             
             # Thêm thể loại
-            for genre_name in genre_names:
-                if genre_name.strip():
-                    genre_id = self.book_model.get_or_create_genre(genre_name.strip())
-                    self.book_model.link_book_genre(book_id, genre_id)
+            uow.link_book_genres(book_id, uow.get_or_create_genres(genre_names))
             
             # Thêm vào thư viện của user upload (nếu có user_id)
             if user_id:
-                user_library = UserLibraryModel(self.db)
-                user_library.add_to_library(user_id, book_id)
+                uow.add_to_library(user_id, book_id)
+        
+        return book_id, True
+    
+    def _discard_stored_file(self, file_path):
+        """Xóa file vừa lưu khi upload lỗi, trừ khi đã có sách dùng file đó
+        
+        Kiểm tra và xóa trong lúc giữ khóa ghi nên không xen giữa lúc upload khác
+        cùng nội dung đang tạo sách trỏ tới file này.
+        """
+        try:
+            with UnitOfWork(self.db) as uow:
+                if not uow.is_file_referenced(file_path):
+                    DirectoryHelper.delete_file_safe(file_path)
+        except Exception:
+            logger.warning("Không thể dọn file upload lỗi %s", file_path, exc_info=True)
+
+class UploadService:
+    """Service upload sách nhiều phần: khởi tạo, nhận từng phần, xem tiến độ, hoàn tất
+    
+    Client gửi lại được các phần bị lỗi mà không phải upload lại từ đầu. Phần đầu
+    tiên phải được gửi trước để kiểm tra định dạng file trước khi nhận phần còn lại.
+    """
+    
+    def __init__(self, db_manager=None, store=None):
+        self.db = db_manager or DatabaseManager()
+        self.store = store or ChunkedUploadStore()
+    
+    def start_upload(self, user_id, filename, total_size):
+        """Tạo phiên upload mới"""
+        if not FileProcessor.is_allowed_file(filename):
+            return None, "Định dạng file không được hỗ trợ"
+        if not isinstance(total_size, int) or isinstance(total_size, bool) or total_size <= 0:
+            return None, "Kích thước file không hợp lệ"
+        if total_size > Config.MAX_CONTENT_LENGTH:
+            return None, "File quá lớn"
+        
+        try:
+            self.store.cleanup_expired(Config.UPLOAD_SESSION_MAX_AGE)
+            upload = self.store.create(user_id, filename, total_size, Config.UPLOAD_CHUNK_SIZE)
+            return self._describe(upload, []), None
+        except Exception as e:
+            return None, f"Lỗi khi tạo phiên upload: {str(e)}"
+    
+    def get_upload_status(self, user_id, upload_id):
+        """Lấy các phần và khoảng byte đã nhận của phiên upload"""
+        upload = self._get_upload(user_id, upload_id)
+        if not upload:
+            return None, "Không tìm thấy phiên upload"
+        return self._describe(upload, self.store.get_received_chunks(upload)), None
+    
+    def save_chunk(self, user_id, upload_id, chunk_index, stream):
+        """Lưu một phần của file (gửi lại phần đã có sẽ ghi đè phần cũ)"""
+        upload = self._get_upload(user_id, upload_id)
+        if not upload:
+            return None, "Không tìm thấy phiên upload"
+        if not 0 <= chunk_index < upload['chunk_count']:
+            return None, "Số thứ tự phần không hợp lệ"
+        if chunk_index > 0 and 0 not in self.store.get_received_chunks(upload):
+            return None, "Cần gửi phần đầu tiên trước"
+        
+        try:
+            self.store.write_chunk(upload, chunk_index, stream)
             
-            return True, book_id
+            if chunk_index == 0:
+                header = self.store.read_header(upload, FileProcessor.SIGNATURE_SAMPLE_BYTES)
+                if not FileProcessor.has_valid_signature(upload['filename'], header):
+                    self.store.delete(upload_id)
+                    return None, "Nội dung file không đúng định dạng"
             
+            return self._describe(upload, self.store.get_received_chunks(upload)), None
         except ValueError as e:
-            return False, str(e)
+            return None, str(e)
         except Exception as e:
-            return False, f"Lỗi khi upload sách: {str(e)}"
+            return None, f"Lỗi khi lưu phần {chunk_index}: {str(e)}"
+    
+    def complete_upload(self, user_id, upload_id, title, author_name, publisher_name="",
+                        description="", publication_year=None, genre_names=None):
+        """Ghép các phần và tạo sách qua BookService.upload_book"""
+        upload = self._get_upload(user_id, upload_id)
+        if not upload:
+            return None, "Không tìm thấy phiên upload"
+        
+        missing_count = upload['chunk_count'] - len(self.store.get_received_chunks(upload))
+        if missing_count:
+            return None, f"Còn thiếu {missing_count} phần chưa upload"
+        
+        file = self.store.open_file(upload)
+        try:
+            success, result = BookService(self.db).upload_book(
+                file, title, author_name, publisher_name, description,
+                publication_year, genre_names, user_id
+            )
+        finally:
+            file.close()
+        
+        if not success:
+            # Giữ lại phiên upload để client sửa thông tin và hoàn tất lại
+            return None, result
+        
+        self.store.delete(upload_id)
+        return result, None
+    
+    def cancel_upload(self, user_id, upload_id):
+        """Hủy phiên upload và xóa các phần đã nhận"""
+        if not self._get_upload(user_id, upload_id):
+            return False, "Không tìm thấy phiên upload"
+        self.store.delete(upload_id)
+        return True, "Đã hủy upload"
+    
+    def _get_upload(self, user_id, upload_id):
+        """Đọc phiên upload, chỉ user đã tạo phiên mới được dùng"""
+        upload = self.store.load(upload_id)
+        if not upload or upload['user_id'] != user_id:
+            return None
+        return upload
+    
+    def _describe(self, upload, received_chunks):
+        """Thông tin phiên upload trả về cho client"""
+        received_ranges = ChunkedUploadStore.get_received_ranges(upload, received_chunks)
+        return {
+            'upload_id': upload['upload_id'],
+            'filename': upload['filename'],
+            'total_size': upload['total_size'],
+            'chunk_size': upload['chunk_size'],
+            'chunk_count': upload['chunk_count'],
+            'received_chunks': received_chunks,
+            'received_ranges': received_ranges,
+            'received_bytes': sum(end - start for start, end in received_ranges),
+            'complete': len(received_chunks) == upload['chunk_count']
+        }
+
+class IngestionService:
+    """Service xử lý nền sau khi upload: trích xuất nội dung và tính thông số sách"""
+    
+    def __init__(self, db_manager=None):
+        self.db = db_manager or DatabaseManager()
+        self.book_model = BookModel(self.db)
+    
+    def enqueue(self, book_id):
+        """Đưa sách vào hàng đợi xử lý nền"""
+        _get_ingestion_executor().submit(self._ingest_in_background, book_id)
+    
+    def resume_unprocessed(self):
+        """Đưa lại vào hàng đợi các sách chưa xử lý xong (ví dụ do server tắt giữa chừng)"""
+        book_ids = self.book_model.get_unprocessed_book_ids()
+        for book_id in book_ids:
+            self.enqueue(book_id)
+        return len(book_ids)
+    
+    def ingest_book(self, book_id):
+        """Trích xuất nội dung một lần và lưu số trang, số từ, thời gian đọc"""
+        book = self.book_model.get_book_by_id(book_id)
+        if not book:
+            return False, "Không tìm thấy sách"
+        
+        try:
+            self.book_model.update_ingestion_status(book_id, 'processing')
+            
+            if not book['file_path'] or not os.path.exists(book['file_path']):
+                raise FileNotFoundError("File sách không tồn tại")
+            
+            stats = BookContentReader.get_book_statistics(book['file_path'])
+            reading_time_minutes = math.ceil(stats['word_count'] / Config.READING_WORDS_PER_MINUTE)
+            
+            # Sách upload trước khi lưu theo mã băm: tính bổ sung để dùng cho chống trùng
+            content_hash = None
+            if not book['content_hash']:
+                content_hash = FileProcessor.compute_file_hash(book['file_path'])
+            
+            try:
+                ReadingService(self.db).index_book_content(book_id, book['file_path'])
+            except Exception:
+                # Chỉ mục sẽ được tạo lại ở lần tìm kiếm đầu tiên
+                logger.exception("Không thể đánh chỉ mục tìm kiếm cho sách %s", book_id)
+            
+            try:
+                CoverService(self.db).process_book_cover(book)
+            except Exception:
+                # Thiếu ảnh bìa không làm hỏng việc xử lý sách
+                logger.exception("Không thể tạo ảnh bìa cho sách %s", book_id)
+            
+            self.book_model.save_ingestion_result(
+                book_id, stats['page_count'], stats['word_count'],
+                stats['char_count'], reading_time_minutes, content_hash
+            )
+            return True, stats
+            
+        except Exception as e:
+            self.book_model.update_ingestion_status(book_id, 'failed', str(e))
+            return False, f"Lỗi xử lý sách: {str(e)}"
+    
+    def get_status(self, book_id):
+        """Lấy trạng thái xử lý nền của sách"""
+        try:
+            status = self.book_model.get_ingestion_status(book_id)
+            if not status:
+                return None, "Không tìm thấy sách"
+            return dict(status), None
+        except Exception as e:
+            return None, f"Lỗi khi lấy trạng thái: {str(e)}"
+    
+    def _ingest_in_background(self, book_id):
+        """Chạy ingest_book trong thread nền, ghi log thay vì để exception bị nuốt"""
+        try:
+            success, result = self.ingest_book(book_id)
+            if not success:
+                logger.warning("Xử lý nền sách %s thất bại: %s", book_id, result)
+        except Exception:
+            logger.exception("Lỗi không mong muốn khi xử lý nền sách %s", book_id)
+
+class CoverService:
+    """Service tạo ảnh bìa và các ảnh bìa thu nhỏ (srcset) cho sách"""
+    
+    def __init__(self, db_manager=None):
+        self.db = db_manager or DatabaseManager()
+        self.book_model = BookModel(self.db)
+    
+    def process_book_cover(self, book):
+        """Tạo ảnh thu nhỏ từ ảnh bìa sẵn có, hoặc từ ảnh bìa nhúng trong file sách
+        
+        Returns:
+            bool: True nếu sách có ảnh bìa thu nhỏ sau khi xử lý
+        """
+        if not CoverImageProcessor.is_available():
+            return False
+        
+        cover_url = book['cover_image_url']
+        image_data = None
+        if cover_url:
+            cover_path = CoverImageProcessor.url_to_path(cover_url)
+            if cover_path and os.path.exists(cover_path):
+                with open(cover_path, 'rb') as cover_file:
+                    image_data = cover_file.read()
+        elif book['file_path'] and os.path.exists(book['file_path']):
+            image_data = CoverImageProcessor.extract_cover(book['file_path'])
+        
+        if not image_data:
+            # Chuỗi rỗng: đã xử lý, không có ảnh để tạo ảnh thu nhỏ
+            self.book_model.update_cover(book['book_id'], cover_url, '')
+            return False
+        
+        try:
+            largest_url, srcset = CoverImageProcessor.create_thumbnails(image_data)
+        except Exception as e:
+            # Ảnh hỏng: đánh dấu đã xử lý để không thử lại ở mỗi lần khởi động
+            logger.warning("Ảnh bìa của sách %s không hợp lệ: %s", book['book_id'], e)
+            self.book_model.update_cover(book['book_id'], cover_url, '')
+            return False
+        
+        self.book_model.update_cover(book['book_id'], cover_url or largest_url, srcset)
+        return True
+    
+    def backfill_thumbnails(self):
+        """Tạo ảnh thu nhỏ cho các sách cũ chưa có, trả về số sách đã xử lý"""
+        book_ids = self.book_model.get_book_ids_without_cover_thumbnails()
+        for book_id in book_ids:
+            try:
+                book = self.book_model.get_book_by_id(book_id)
+                if book:
+                    self.process_book_cover(book)
+            except Exception:
+                logger.exception("Không thể tạo ảnh bìa cho sách %s", book_id)
+        return len(book_ids)
+    
+    def schedule_backfill(self):
+        """Chạy backfill_thumbnails trong thread pool xử lý nền"""
+        if CoverImageProcessor.is_available():
+            _get_ingestion_executor().submit(self.backfill_thumbnails)
+
+class WarmupService:
+    """Service nạp sẵn các cache dùng chung trước khi fork worker
+    
+    Worker được fork sau khi nạp dùng chung dữ liệu đã nạp theo copy-on-write
+    thay vì mỗi worker tự tải lại từ đầu.
+    """
+    
+    def __init__(self, db_manager=None):
+        self.db = db_manager or DatabaseManager()
+        self.book_model = BookModel(self.db)
+    
+    def warm_caches(self, hot_books=None):
+        """Nạp sách mới, thể loại, trang tìm kiếm mặc định và nội dung các sách đang được đọc nhiều
+        
+        PDF chưa có nội dung đã trích xuất được bỏ qua: trích xuất trong master sẽ
+        tạo process pool trích xuất, pool này không dùng được trong worker sau khi fork.
+        
+        Returns:
+            dict: Số sách đã nạp nội dung, số sách bỏ qua, số sách lỗi và thời gian nạp (giây)
+        """
+        hot_books = Config.WARMUP_HOT_BOOKS if hot_books is None else hot_books
+        started = time.perf_counter()
+        
+        book_service = BookService(self.db)
+        book_service.get_recent_books()
+        book_service.get_genres()
+        book_service.search_books()
+        
+        warmed, skipped, failed = 0, 0, 0
+        for book in self.book_model.get_popular_books(hot_books) if hot_books else []:
+            if BookContentReader.needs_pdf_extraction(book['file_path']):
+                skipped += 1
+                continue
+            try:
+                # Đọc đoạn đầu tiên tạo sẵn nội dung đã trích xuất và chỉ mục đoạn trong cache
+                BookContentReader.read_chunk(book['file_path'], 0)
+                warmed += 1
+            except Exception:
+                failed += 1
+                logger.warning("Không thể nạp sẵn nội dung sách %s", book['book_id'], exc_info=True)
+        
+        return {
+            'books_warmed': warmed,
+            'books_skipped': skipped,
+            'books_failed': failed,
+            'seconds': time.perf_counter() - started
+        }
 
 class ReadingService:
     """Service xử lý logic liên quan đến việc đọc sách"""
@@ -224,6 +679,7 @@ class ReadingService:
         self.db = db_manager or DatabaseManager()
         self.book_model = BookModel(self.db)
         self.user_library = UserLibraryModel(self.db)
+        self.search_index = BookSearchIndexModel(self.db)
     
     def prepare_reading_session(self, book_id, user_id):
         """Chuẩn bị session đọc sách"""
@@ -241,24 +697,62 @@ class ReadingService:
                 last_position = 0
             else:
                 last_position = user_book['last_read_position']
+                if user_book['last_read_position_unit'] == 'word' and book['file_path']:
+                    # Vị trí do trình đọc cũ lưu theo số từ: đổi sang offset ký tự một lần
+                    last_position = BookContentReader.word_index_to_offset(book['file_path'], last_position)
+                    self.user_library.convert_word_position(user_id, book_id, last_position)
                 # Cập nhật trạng thái thành đang đọc
                 self.user_library.update_reading_status(user_id, book_id, 'reading')
             
-            # Đọc nội dung sách
+            # Chỉ lấy đoạn chứa vị trí đọc gần nhất, các đoạn khác được tải qua API
+            chunk = None
+            content_version = None
             if book['file_path']:
-                book_content = BookContentReader.read_book_content(book['file_path'])
-            else:
-                book_content = "Nội dung sách không có sẵn."
+                chunk = BookContentReader.read_chunk(book['file_path'], offset=last_position)
+                content_version = self._content_version(book)
             
             return {
                 'book': book,
                 'last_position': last_position,
-                'book_content': book_content
+                'chunk': chunk,
+                'content_version': content_version
             }, None
             
         except Exception as e:
             return None, f"Lỗi khi chuẩn bị đọc sách: {str(e)}"
     
+    @staticmethod
+    def _content_version(book):
+        """Phiên bản nội dung file sách: mã băm nội dung nếu có, nếu không thì mtime-kích thước
+        (kèm phiên bản cách trích xuất của định dạng)"""
+        return BookContentReader.get_source_version(book['file_path'], book['content_hash'])
+    
+    def get_content_version(self, book_id):
+        """Lấy phiên bản nội dung sách để tạo ETag mà không cần đọc nội dung"""
+        try:
+            book = self.book_model.get_book_by_id(book_id)
+            if not book or not book['file_path'] or not os.path.exists(book['file_path']):
+                return None, "Không tìm thấy sách hoặc file không tồn tại"
+            return self._content_version(book), None
+        except Exception as e:
+            return None, f"Lỗi khi đọc thông tin sách: {str(e)}"
+    
+    def get_reading_chunk(self, book_id, chunk_number=None, offset=0):
+        """Lấy một đoạn nội dung sách theo số thứ tự đoạn hoặc offset ký tự"""
+        try:
+            book = self.book_model.get_book_by_id(book_id)
+            if not book or not book['file_path']:
+                return None, "Không tìm thấy sách hoặc file không tồn tại"
+            
+            chunk = BookContentReader.read_chunk(book['file_path'], chunk_number, offset)
+            if not chunk:
+                return None, "Đoạn nội dung không tồn tại"
+            
+            return chunk, None
+            
+        except Exception as e:
+            return None, f"Lỗi khi đọc nội dung: {str(e)}"
+    
     def save_reading_progress(self, user_id, book_id, position):
         """Lưu tiến độ đọc"""
         try:
@@ -267,21 +761,145 @@ class ReadingService:
         except Exception as e:
             return False, f"Lỗi lưu tiến độ: {str(e)}"
     
+    async def save_reading_progress_async(self, user_id, book_id, position):
+        """Lưu tiến độ đọc trong thread pool việc nhẹ (dùng cho view async)
+        
+        Raises:
+            ExecutorBusyError: Thread pool đã đầy
+        """
+        return await _get_api_executor('light').run(
+            self.save_reading_progress, user_id, book_id, position
+        )
+    
+    async def get_content_version_async(self, book_id):
+        """Lấy phiên bản nội dung sách trong thread pool việc nhẹ (dùng cho view async)"""
+        return await _get_api_executor('light').run(self.get_content_version, book_id)
+    
+    async def prepare_reading_session_async(self, book_id, user_id):
+        """Chuẩn bị phiên đọc trong thread pool việc nặng (dùng cho view async)
+        
+        Raises:
+            ExecutorBusyError: Đã có quá nhiều lượt trích xuất nội dung đang chạy và đang chờ
+        """
+        return await _get_api_executor('heavy').run(self.prepare_reading_session, book_id, user_id)
+    
+    async def get_reading_chunk_async(self, book_id, chunk_number=None, offset=0):
+        """Lấy một đoạn nội dung trong thread pool việc nặng (dùng cho view async)
+        
+        Raises:
+            ExecutorBusyError: Đã có quá nhiều lượt trích xuất nội dung đang chạy và đang chờ
+        """
+        return await _get_api_executor('heavy').run(self.get_reading_chunk, book_id, chunk_number, offset)
+    
+    async def search_in_book_async(self, book_id, query):
+        """Tìm kiếm trong sách trong thread pool việc nặng (dùng cho view async)
+        
+        Raises:
+            ExecutorBusyError: Đã có quá nhiều lượt tìm kiếm đang chạy và đang chờ
+        """
+        return await _get_api_executor('heavy').run(self.search_in_book, book_id, query)
+    
+    def index_book_content(self, book_id, file_path):
+        """Đánh chỉ mục toàn văn nội dung sách nếu chỉ mục chưa có hoặc đã cũ
+        
+        Returns:
+            bool: False nếu SQLite không hỗ trợ FTS5
+        """
+        source_version = BookContentReader.get_source_version(file_path)
+        # Chỉ mục đã mới (trường hợp thường gặp): không cần khóa
+        if self.search_index.get_index_version(book_id) == source_version:
+            return True
+        
+        with _search_index_locks_lock:
+            lock_entry = _search_index_locks.setdefault(book_id, [threading.Lock(), 0])
+            lock_entry[1] += 1
+        try:
+            with lock_entry[0]:
+                # Thread khác có thể đã đánh chỉ mục xong trong lúc chờ
+                if self.search_index.get_index_version(book_id) == source_version:
+                    return True
+                
+                # Dòng trống không được đưa vào chỉ mục
+                lines = (
+                    (line_index, char_offset, line, TextNormalizer.fold(line))
+                    for line_index, char_offset, line in BookContentReader.iter_book_lines(file_path)
+                    if line.strip()
+                )
+                try:
+                    self.search_index.rebuild_index(book_id, source_version, lines)
+                except sqlite3.OperationalError as e:
+                    if 'book_content_fts' not in str(e):
+                        raise
+                    return False
+                return True
+        finally:
+            with _search_index_locks_lock:
+                lock_entry[1] -= 1
+                if not lock_entry[1]:
+                    _search_index_locks.pop(book_id, None)
+    
     def search_in_book(self, book_id, query):
-        """Tìm kiếm trong nội dung sách"""
+        """Tìm kiếm trong nội dung sách
+        
+        Returns:
+            tuple: ({'results': [...], 'total': tổng số dòng khớp}, error)
+        """
         try:
             book = self.book_model.get_book_by_id(book_id)
             if not book or not book['file_path']:
-                return [], "Không tìm thấy sách hoặc file không tồn tại"
+                return {'results': [], 'total': 0}, "Không tìm thấy sách hoặc file không tồn tại"
+            
+            fts_query = BookSearcher.build_fts_query(query)
+            if not fts_query:
+                return {'results': [], 'total': 0}, None
             
-            # Đọc nội dung và tìm kiếm
-            content = BookContentReader.read_book_content(book['file_path'])
-            results = BookSearcher.search_in_content(content, query)
+            file_path = book['file_path']
+            if self.index_book_content(book_id, file_path):
+                return self._search_in_index(book_id, query, fts_query), None
+            
+            # SQLite không hỗ trợ FTS5: quét tuần tự nội dung sách
+            if file_path.lower().endswith('.pdf') and not BookContentReader.is_content_cached(file_path):
+                # PDF chưa được trích xuất: quét từng trang và dừng khi đủ kết quả
+                results = BookSearcher.search_in_blocks(BookContentReader.iter_pdf_blocks(file_path), query)
+            else:
+                # Đọc nội dung (đã tách dòng, có cache) và tìm kiếm
+                lines = BookContentReader.read_book_lines(file_path)
+                results = BookSearcher.search_in_lines(lines, query)
             
-            return results, None
+            return {'results': results, 'total': len(results)}, None
             
         except Exception as e:
-            return [], f"Lỗi tìm kiếm: {str(e)}"
+            return {'results': [], 'total': 0}, f"Lỗi tìm kiếm: {str(e)}"
+    
+    def _search_in_index(self, book_id, query, fts_query):
+        """Tìm kiếm trên chỉ mục FTS5, kèm vị trí khớp và dòng xung quanh"""
+        rows, total = self.search_index.search(book_id, fts_query, Config.MAX_SEARCH_RESULTS)
+        
+        context_indexes = set()
+        for row in rows:
+            context_indexes.update((row['line_index'] - 1, row['line_index'] + 1))
+        context_lines = self.search_index.get_lines(book_id, sorted(context_indexes))
+        
+        results = []
+        for row in rows:
+            line_index = row['line_index']
+            line = row['line_text']
+            match = BookSearcher.find_match(line, query) or (0, 0)
+            context = [
+                context_lines.get(line_index - 1, ''),
+                line,
+                context_lines.get(line_index + 1, '')
+            ]
+            results.append({
+                'line_number': line_index + 1,
+                'char_offset': row['char_offset'],
+                'match_offset': row['char_offset'] + match[0],
+                'match_length': match[1] - match[0],
+                'content': line.strip(),
+                'context': ' '.join(text.strip() for text in context if text.strip())
+            })
+        
+        return {'results': results, 'total': total}
 
 class LibraryService:
     """Service xử lý logic liên quan đến thư viện cá nhân"""
@@ -290,13 +908,24 @@ class LibraryService:
         self.db = db_manager or DatabaseManager()
         self.user_library = UserLibraryModel(self.db)
     
-    def get_user_library(self, user_id):
-        """Lấy thư viện của user"""
+    def get_user_library(self, user_id, cursor=None, status_filter=None):
+        """Lấy một trang thư viện của user kèm thống kê theo trạng thái"""
         try:
-            books = self.user_library.get_user_books(user_id)
-            return books, None
+            books, next_cursor = self.user_library.get_user_books(
+                user_id, cursor=cursor, status_filter=status_filter
+            )
+            stats = self.user_library.get_library_stats(user_id)
+            return {
+                'books': books,
+                'next_cursor': next_cursor,
+                'stats': stats
+            }, None
         except Exception as e:
-            return [], f"Lỗi khi lấy thư viện: {str(e)}"
+            return {
+                'books': [],
+                'next_cursor': None,
+                'stats': {'total': 0, 'reading': 0, 'completed': 0, 'favorite': 0}
+            }, f"Lỗi khi lấy thư viện: {str(e)}"
     
     def add_to_library(self, user_id, book_id):
         """Thêm sách vào thư viện"""
@@ -342,10 +971,10 @@ class NoteService:
         except Exception as e:
             return False, f"Lỗi khi thêm ghi chú: {str(e)}"
     
-    def get_book_notes(self, user_id, book_id):
-        """Lấy danh sách ghi chú của sách"""
+    def get_book_notes(self, user_id, book_id, cursor=None):
+        """Lấy một trang ghi chú của sách"""
         try:
-            notes = self.note_model.get_book_notes(user_id, book_id)
-            return notes, None
+            notes, next_cursor = self.note_model.get_book_notes(user_id, book_id, cursor=cursor)
+            return {'notes': notes, 'next_cursor': next_cursor}, None
         except Exception as e:
-            return [], f"Lỗi khi lấy ghi chú: {str(e)}"
\ No newline at end of file
+            return {'notes': [], 'next_cursor': None}, f"Lỗi khi lấy ghi chú: {str(e)}"
\ No newline at end of file
@@ -1,17 +1,58 @@
 """
 Các utility functions cho ứng dụng EBook Reader
 """
+import io
 import os
+import re
+import sys
+import html
+import gzip
+import json
+import base64
+import math
+import shutil
+import hashlib
+import tempfile
+import zipfile
+import posixpath
+import mmap
+import codecs
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+import unicodedata
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
 import PyPDF2
-import ebooklib
-from ebooklib import epub
-import html2text
+from urllib.parse import unquote
+from markupsafe import Markup, escape
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Không có Pillow thì bỏ qua bước tạo ảnh bìa
+    Image = None
+try:
+    import brotli
+except ImportError:  # Không có brotli thì chỉ nén gzip
+    brotli = None
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
 from .config import Config
 
+logger = logging.getLogger(__name__)
+
 class FileProcessor:
     """Class xử lý các file sách"""
     
+    # Số byte đầu file dùng để kiểm tra chữ ký định dạng
+    SIGNATURE_SAMPLE_BYTES = 1024
+    
     @staticmethod
     def is_allowed_file(filename):
         """Kiểm tra định dạng file có được hỗ trợ không"""
@@ -26,8 +67,34 @@ class FileProcessor:
         return secure_filename(filename)
     
     @staticmethod
-    def save_uploaded_file(file, upload_folder):
-        """Lưu file upload và trả về đường dẫn"""
+    def has_valid_signature(filename, header):
+        """Kiểm tra các byte đầu file có khớp với định dạng theo đuôi file không
+        
+        Dùng để từ chối file bị đổi đuôi ngay từ phần dữ liệu đầu tiên.
+        """
+        file_extension = os.path.splitext(filename)[1].lower()
+        if file_extension == '.pdf':
+            # Chuẩn PDF cho phép có byte thừa trước %PDF- trong 1024 byte đầu
+            return b'%PDF-' in header[:1024]
+        if file_extension == '.epub':
+            # EPUB là file ZIP
+            return header.startswith(b'PK\x03\x04')
+        if file_extension == '.txt':
+            # Văn bản không chứa byte NUL. Nhờ đó file UTF-16/UTF-32 (kể cả có BOM) cũng bị
+            # từ chối: MappedTextFile chỉ đọc được UTF-8 hoặc mã hóa 1 byte (cp1252)
+            return b'\x00' not in header
+        return False
+    
+    @staticmethod
+    def save_uploaded_file(file, upload_folder, chunk_size=1024 * 1024):
+        """Lưu file upload theo mã băm nội dung, ghi từng khối và tính SHA-256 cùng lúc
+        
+        File được lưu tại <upload_folder>/<sha256><đuôi file>: hai sách trùng tên
+        không ghi đè nhau, còn hai file giống hệt nhau chỉ được lưu một lần.
+        
+        Returns:
+            tuple: (đường dẫn file, mã băm, True nếu file vừa được tạo), hoặc None nếu không có file
+        """
         if not file or file.filename == '':
             return None
         
@@ -37,17 +104,603 @@ class FileProcessor:
         # Tạo thư mục nếu chưa có
         os.makedirs(upload_folder, exist_ok=True)
         
-        # Tạo tên file an toàn
-        filename = FileProcessor.get_safe_filename(file.filename)
-        file_path = os.path.join(upload_folder, filename)
+        # Ghi vào file tạm cùng thư mục để os.replace là thao tác nguyên tử
+        digest = hashlib.sha256()
+        temp_fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+        try:
+            with os.fdopen(temp_fd, 'wb') as output:
+                # Kiểm tra chữ ký định dạng trước khi ghi phần còn lại của file
+                header = file.stream.read(FileProcessor.SIGNATURE_SAMPLE_BYTES)
+                if not FileProcessor.has_valid_signature(file.filename, header):
+                    raise ValueError("Nội dung file không đúng định dạng")
+                digest.update(header)
+                output.write(header)
+                
+                for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                    digest.update(chunk)
+                    output.write(chunk)
+            
+            content_hash = digest.hexdigest()
+            file_extension = os.path.splitext(file.filename)[1].lower()
+            file_path = os.path.join(upload_folder, content_hash + file_extension)
+            if os.path.exists(file_path):
+                # Nội dung đã được lưu trước đó
+                os.remove(temp_path)
+                return file_path, content_hash, False
+            
+            os.replace(temp_path, file_path)
+            return file_path, content_hash, True
+        except BaseException:
+            DirectoryHelper.delete_file_safe(temp_path)
+            raise
+    
+    @staticmethod
+    def compute_file_hash(file_path, chunk_size=1024 * 1024):
+        """Tính mã băm SHA-256 nội dung file (đọc từng khối, không nạp cả file)"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+class ChunkedUploadReader(io.RawIOBase):
+    """Đọc nối tiếp các phần của một phiên upload như một file duy nhất"""
+    
+    def __init__(self, chunk_paths):
+        super().__init__()
+        self._chunk_paths = iter(chunk_paths)
+        self._current = None
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                chunk_path = next(self._chunk_paths, None)
+                if chunk_path is None:
+                    return 0
+                self._current = open(chunk_path, 'rb')
+            
+            bytes_read = self._current.readinto(buffer)
+            if bytes_read:
+                return bytes_read
+            self._current.close()
+            self._current = None
+    
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
+
+class ChunkedUploadStore:
+    """Lưu các phiên upload nhiều phần trên đĩa, dùng chung giữa các worker process
+    
+    Mỗi phiên là thư mục <UPLOAD_SESSIONS_FOLDER>/<upload_id> chứa session.json
+    và các file <số thứ tự>.part. Mỗi phần được ghi vào file tạm rồi os.replace,
+    nên một phần chỉ được tính là đã nhận khi có đủ dữ liệu và client có thể gửi
+    lại bất kỳ phần nào sau khi mất kết nối.
+    """
+    
+    SESSION_FILE = 'session.json'
+    UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    
+    def __init__(self, root_folder=None):
+        self.root_folder = root_folder or Config.UPLOAD_SESSIONS_FOLDER
+    
+    def _session_folder(self, upload_id):
+        return os.path.join(self.root_folder, upload_id)
+    
+    def _chunk_path(self, upload_id, chunk_index):
+        return os.path.join(self._session_folder(upload_id), f'{chunk_index:06d}.part')
+    
+    def create(self, user_id, filename, total_size, chunk_size):
+        """Tạo phiên upload mới"""
+        upload = {
+            'upload_id': os.urandom(16).hex(),
+            'user_id': user_id,
+            'filename': filename,
+            'total_size': total_size,
+            'chunk_size': chunk_size,
+            'chunk_count': max(1, math.ceil(total_size / chunk_size)),
+            'created_at': time.time()
+        }
+        session_folder = self._session_folder(upload['upload_id'])
+        os.makedirs(session_folder)
+        
+        temp_path = os.path.join(session_folder, self.SESSION_FILE + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(upload, file)
+        os.replace(temp_path, os.path.join(session_folder, self.SESSION_FILE))
+        return upload
+    
+    def load(self, upload_id):
+        """Đọc thông tin phiên upload, None nếu không tồn tại"""
+        if not upload_id or not self.UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        try:
+            with open(os.path.join(self._session_folder(upload_id), self.SESSION_FILE), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def get_chunk_size(upload, chunk_index):
+        """Số byte của một phần (phần cuối có thể ngắn hơn)"""
+        start = chunk_index * upload['chunk_size']
+        return min(upload['chunk_size'], upload['total_size'] - start)
+    
+    def write_chunk(self, upload, chunk_index, stream, block_size=1024 * 1024):
+        """Ghi một phần từ stream, phải có đúng số byte của phần đó"""
+        expected_size = self.get_chunk_size(upload, chunk_index)
+        chunk_path = self._chunk_path(upload['upload_id'], chunk_index)
+        temp_fd, temp_path = tempfile.mkstemp(dir=self._session_folder(upload['upload_id']), suffix='.tmp')
+        try:
+            written = 0
+            with os.fdopen(temp_fd, 'wb') as output:
+                # Đọc nhiều hơn 1 byte so với dự kiến để phát hiện phần quá dài
+                while written <= expected_size:
+                    block = stream.read(min(block_size, expected_size + 1 - written))
+                    if not block:
+                        break
+                    output.write(block)
+                    written += len(block)
+            
+            if written != expected_size:
+                raise ValueError(f"Phần {chunk_index} phải có {expected_size} byte, đã nhận {written} byte")
+            os.replace(temp_path, chunk_path)
+        except BaseException:
+            DirectoryHelper.delete_file_safe(temp_path)
+            raise
+    
+    def read_header(self, upload, size):
+        """Đọc các byte đầu file từ phần đầu tiên"""
+        with open(self._chunk_path(upload['upload_id'], 0), 'rb') as file:
+            return file.read(size)
+    
+    def get_received_chunks(self, upload):
+        """Danh sách số thứ tự các phần đã nhận đủ dữ liệu"""
+        received = []
+        for chunk_index in range(upload['chunk_count']):
+            chunk_path = self._chunk_path(upload['upload_id'], chunk_index)
+            if os.path.isfile(chunk_path) and \
+                    os.path.getsize(chunk_path) == self.get_chunk_size(upload, chunk_index):
+                received.append(chunk_index)
+        return received
+    
+    @staticmethod
+    def get_received_ranges(upload, received_chunks):
+        """Gộp các phần đã nhận thành các khoảng byte liên tiếp [start, end)"""
+        ranges = []
+        for chunk_index in received_chunks:
+            start = chunk_index * upload['chunk_size']
+            end = start + ChunkedUploadStore.get_chunk_size(upload, chunk_index)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+    
+    def open_file(self, upload):
+        """Mở toàn bộ các phần dưới dạng FileStorage để lưu như file upload thông thường"""
+        chunk_paths = [
+            self._chunk_path(upload['upload_id'], chunk_index)
+            for chunk_index in range(upload['chunk_count'])
+        ]
+        return FileStorage(stream=ChunkedUploadReader(chunk_paths), filename=upload['filename'])
+    
+    def delete(self, upload_id):
+        """Xóa phiên upload và các phần đã nhận"""
+        if upload_id and self.UPLOAD_ID_PATTERN.match(upload_id):
+            shutil.rmtree(self._session_folder(upload_id), ignore_errors=True)
+    
+    def cleanup_expired(self, max_age_seconds):
+        """Xóa các phiên upload không có phần mới trong max_age_seconds giây"""
+        if not os.path.isdir(self.root_folder):
+            return 0
+        
+        removed = 0
+        expires_before = time.time() - max_age_seconds
+        for upload_id in os.listdir(self.root_folder):
+            session_folder = self._session_folder(upload_id)
+            try:
+                # Thư mục được cập nhật mtime mỗi khi có phần mới được ghi
+                if os.path.getmtime(session_folder) < expires_before:
+                    self.delete(upload_id)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+class MappedTextFile:
+    """Đọc file TXT qua mmap với chỉ mục dòng theo byte offset và ký tự
+    
+    Chỉ mục được tạo một lần (hai array số nguyên: byte bắt đầu và ký tự bắt
+    đầu của từng dòng), sau đó mỗi lần đọc chỉ giải mã các dòng nằm trong
+    khoảng được yêu cầu thay vì cả file. Xuống dòng kiểu Windows (CRLF) được
+    tính là một ký tự xuống dòng, giống khi đọc file ở chế độ text.
+    """
+    
+    def __init__(self, file_path, sample_size=None):
+        self.file_path = file_path
+        self.file_size = os.path.getsize(file_path)
+        self.encoding, self.data_start = self.detect_encoding(file_path, sample_size)
+        
+        # Dùng số nguyên 4 byte nếu file đủ nhỏ để chỉ mục gọn hơn
+        typecode = 'I' if self.file_size < 2 ** 32 else 'Q'
+        self.line_byte_offsets = array(typecode)
+        self.line_char_offsets = array(typecode)
+        self.char_count = 0
+        self._build_index()
+    
+    @staticmethod
+    def detect_encoding(file_path, sample_size=None):
+        """Nhận diện encoding từ một đoạn đầu file có giới hạn kích thước
+        
+        Returns:
+            tuple: (encoding, số byte BOM cần bỏ qua ở đầu file)
+        """
+        sample_size = sample_size or Config.TXT_ENCODING_SAMPLE_BYTES
+        with open(file_path, 'rb') as file:
+            sample = file.read(sample_size)
         
-        # Lưu file
-        file.save(file_path)
-        return file_path
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8', len(codecs.BOM_UTF8)
+        
+        try:
+            # final=False: chuỗi byte bị cắt dở ở cuối mẫu không bị coi là lỗi
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            return 'utf-8', 0
+        except UnicodeDecodeError:
+            return Config.TXT_FALLBACK_ENCODING, 0
+    
+    def _open_map(self):
+        """Mở file và mmap chỉ để đọc (gọi close() trên cả hai khi dùng xong)"""
+        file = open(self.file_path, 'rb')
+        try:
+            return file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            file.close()
+            raise
+    
+    def _build_index(self):
+        """Quét file một lần để ghi lại vị trí bắt đầu của từng dòng"""
+        if self.file_size <= self.data_start:
+            return
+        
+        file, mapped = self._open_map()
+        try:
+            position = self.data_start
+            char_position = 0
+            while position < self.file_size:
+                self.line_byte_offsets.append(position)
+                self.line_char_offsets.append(char_position)
+                
+                newline = mapped.find(b'\n', position)
+                line_end = newline if newline != -1 else self.file_size
+                line = mapped[position:line_end]
+                
+                # Đếm đúng như khi giải mã để đọc (errors='replace'): encoding chỉ được
+                # nhận diện từ đoạn đầu file, phần sau có thể lẫn byte không hợp lệ
+                # mà mỗi byte lỗi thành một ký tự U+FFFD
+                line_chars = len(line) if line.isascii() else len(line.decode(self.encoding, errors='replace'))
+                if line.endswith(b'\r') and newline != -1:
+                    line_chars -= 1  # '\r\n' được tính là một ký tự '\n'
+                char_position += line_chars + (1 if newline != -1 else 0)
+                position = line_end + 1
+        finally:
+            mapped.close()
+            file.close()
+        
+        self.char_count = char_position
+    
+    @property
+    def line_count(self):
+        """Số dòng của file"""
+        return len(self.line_byte_offsets)
+    
+    def _decode_lines(self, mapped, first_line, last_line):
+        """Giải mã các dòng từ first_line đến last_line (tính cả hai đầu)"""
+        start_byte = self.line_byte_offsets[first_line]
+        end_byte = self.line_byte_offsets[last_line + 1] if last_line + 1 < self.line_count else self.file_size
+        text = mapped[start_byte:end_byte].decode(self.encoding, errors='replace')
+        return text.replace('\r\n', '\n')
+    
+    def read_chars(self, start, end):
+        """Đọc khoảng ký tự [start, end) mà không giải mã toàn bộ file"""
+        with self.open_reader() as read_range:
+            return read_range(start, end)
+    
+    @contextmanager
+    def open_reader(self):
+        """Mở file một lần cho nhiều lần đọc liên tiếp
+        
+        Yields:
+            callable: Hàm read_range(start, end) đọc khoảng ký tự [start, end)
+        """
+        if self.char_count == 0:
+            yield lambda start, end: ''
+            return
+        
+        file, mapped = self._open_map()
+        try:
+            yield lambda start, end: self._read_chars(mapped, start, end)
+        finally:
+            mapped.close()
+            file.close()
+    
+    def _read_chars(self, mapped, start, end):
+        """Đọc khoảng ký tự [start, end) từ mmap đang mở"""
+        start = max(0, start)
+        end = min(end, self.char_count)
+        if start >= end:
+            return ''
+        
+        first_line = bisect_right(self.line_char_offsets, start) - 1
+        last_line = bisect_right(self.line_char_offsets, end - 1) - 1
+        text = self._decode_lines(mapped, first_line, last_line)
+        
+        base = self.line_char_offsets[first_line]
+        return text[start - base:end - base]
+    
+    def get_lines(self, start_line, end_line=None):
+        """Lấy các dòng [start_line, end_line) (đánh số từ 0), không kèm ký tự xuống dòng"""
+        end_line = min(end_line if end_line is not None else self.line_count, self.line_count)
+        start_line = max(0, start_line)
+        if start_line >= end_line:
+            return []
+        
+        file, mapped = self._open_map()
+        try:
+            text = self._decode_lines(mapped, start_line, end_line - 1)
+        finally:
+            mapped.close()
+            file.close()
+        
+        lines = text.split('\n')
+        return lines[:end_line - start_line]
+    
+    def iter_lines(self, batch_lines=10000):
+        """Duyệt lần lượt từng dòng, mỗi lần chỉ giải mã một nhóm dòng"""
+        for start_line in range(0, self.line_count, batch_lines):
+            yield from self.get_lines(start_line, start_line + batch_lines)
+    
+    def read_all(self):
+        """Đọc toàn bộ nội dung file"""
+        return self.read_chars(0, self.char_count)
+    
+    def __sizeof__(self):
+        # Để cache tính đúng bộ nhớ của chỉ mục
+        return object.__sizeof__(self) + sys.getsizeof(self.line_byte_offsets) + sys.getsizeof(self.line_char_offsets)
+
+class BookContentCache:
+    """Cache LRU giới hạn theo dung lượng cho nội dung sách đã trích xuất
+
+    Mỗi entry được khóa theo (đường dẫn tuyệt đối, mtime, kích thước file) nên
+    khi file thay đổi thì entry cũ tự động không còn được dùng. Một entry có thể
+    chứa nhiều dạng dữ liệu dẫn xuất (ví dụ 'content', 'lines').
+    """
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = Config.BOOK_CONTENT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._entries = OrderedDict()  # key -> {'values': {...}, 'size': int}
+        self._keys_by_path = {}
+        self._loading_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+    
+    @staticmethod
+    def make_key(file_path):
+        """Tạo khóa cache từ đường dẫn, mtime và kích thước file"""
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    
+    @staticmethod
+    def estimate_size(value):
+        """Ước lượng số byte bộ nhớ mà một giá trị chiếm"""
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        return sys.getsizeof(value)
+    
+    def get_or_load(self, file_path, name, loader):
+        """Lấy giá trị từ cache, nếu chưa có thì gọi loader() và lưu lại
+        
+        Chỉ một thread được chạy loader cho cùng một (key, name), các thread
+        khác chờ và dùng lại kết quả. Exception từ loader không được cache.
+        """
+        key = self.make_key(file_path)
+        value, found = self._lookup(key, name)
+        if found:
+            return value
+        
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault((key, name), threading.Lock())
+        
+        with loading_lock:
+            # Thread khác có thể đã nạp xong trong lúc chờ
+            value, found = self._lookup(key, name, count_stats=False)
+            if found:
+                return value
+            try:
+                value = loader()
+                self._store(key, name, value)
+                return value
+            finally:
+                with self._lock:
+                    self._loading_locks.pop((key, name), None)
+    
+    def contains(self, file_path, name):
+        """Kiểm tra dữ liệu của file đã có trong cache chưa (không tính vào thống kê)"""
+        try:
+            key = self.make_key(file_path)
+        except OSError:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and name in entry['values']
+    
+    def _lookup(self, key, name, count_stats=True):
+        """Tìm giá trị trong cache, trả về (value, found)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry['values']:
+                self._entries.move_to_end(key)
+                if count_stats:
+                    self.hits += 1
+                return entry['values'][name], True
+            if count_stats:
+                self.misses += 1
+            return None, False
+    
+    def _store(self, key, name, value):
+        """Lưu giá trị vào cache và loại bỏ entry cũ nếu vượt ngân sách"""
+        size = self.estimate_size(value)
+        with self._lock:
+            path = key[0]
+            # Bỏ entry ứng với phiên bản cũ của cùng file
+            old_key = self._keys_by_path.get(path)
+            if old_key is not None and old_key != key:
+                self._remove(old_key)
+            
+            entry = self._entries.get(key)
+            entry_size = (entry['size'] if entry else 0) + size
+            if entry_size > self.max_bytes:
+                # Giá trị quá lớn so với ngân sách: không cache
+                return
+            
+            if entry is None:
+                entry = {'values': {}, 'size': 0}
+                self._entries[key] = entry
+                self._keys_by_path[path] = key
+            entry['values'][name] = value
+            entry['size'] += size
+            self.current_bytes += size
+            self._entries.move_to_end(key)
+            
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def _remove(self, key):
+        """Xóa một entry (phải gọi khi đang giữ lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.current_bytes -= entry['size']
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+    
+    def invalidate(self, file_path):
+        """Xóa mọi dữ liệu cache của một file"""
+        with self._lock:
+            key = self._keys_by_path.get(os.path.abspath(file_path))
+            if key is not None:
+                self._remove(key)
+    
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+    
+    def stats(self):
+        """Thống kê hoạt động của cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'evictions': self.evictions,
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+# Cache dùng chung cho toàn bộ process
+book_content_cache = BookContentCache()
+
+# Process pool trích xuất PDF, chỉ được tạo khi lần đầu cần đến
+_pdf_process_pool = None
+_pdf_process_pool_lock = threading.Lock()
+
+def _get_pdf_process_pool():
+    """Lấy (hoặc tạo) process pool dùng chung để trích xuất PDF"""
+    global _pdf_process_pool
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is None:
+            # Dùng 'spawn' để an toàn khi process cha đang chạy nhiều thread
+            _pdf_process_pool = ProcessPoolExecutor(
+                max_workers=Config.PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pdf_process_pool
+
+def _discard_pdf_process_pool(pool):
+    """Bỏ process pool đã hỏng (worker bị kill, hết bộ nhớ...) để lần sau tạo pool mới"""
+    global _pdf_process_pool
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is pool:
+            _pdf_process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _reset_pdf_process_pool():
+    """Process con sau khi fork không dùng lại process pool của process cha"""
+    global _pdf_process_pool, _pdf_process_pool_lock
+    _pdf_process_pool = None
+    _pdf_process_pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pdf_process_pool)
+
+def _extract_pdf_page_range(file_path, start_page, end_page):
+    """Trích xuất một khoảng trang PDF trong process con
+    
+    Returns:
+        list: Các tuple (page_number, text, seconds)
+    """
+    pages = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_number in range(start_page, end_page + 1):
+            started = time.perf_counter()
+            page_text = pdf_reader.pages[page_number - 1].extract_text() or ""
+            pages.append((page_number, page_text, time.perf_counter() - started))
+    return pages
 
 class BookContentReader:
     """Class đọc nội dung sách từ các định dạng khác nhau"""
     
+    SUPPORTED_EXTENSIONS = ('.pdf', '.epub', '.txt')
+    
+    # Phiên bản cách chuyển từng định dạng thành văn bản (mặc định 1): tăng khi cách
+    # trích xuất thay đổi để nội dung đã lưu, chỉ mục tìm kiếm và ETag được tạo lại
+    TEXT_FORMAT_VERSIONS = {'.epub': 2}
+    
+    # Các chương EPUB được nối với nhau bằng chuỗi này trong toàn bộ nội dung
+    EPUB_CHAPTER_SEPARATOR = '\n\n'
+    
+    _OPF_NAMESPACE = '{http://www.idpf.org/2007/opf}'
+    _NCX_NAMESPACE = '{http://www.daisy.org/z3986/2005/ncx/}'
+    _XHTML_NAMESPACE = '{http://www.w3.org/1999/xhtml}'
+    _OPS_NAMESPACE = '{http://www.idpf.org/2007/ops}'
+    
+    # Chuyển HTML chương sách thành văn bản: bỏ phần không hiển thị, tách đoạn theo tag khối
+    _HTML_SKIP_PATTERN = re.compile(r'(?is)<(head|script|style|svg)\b.*?</\1\s*>|<!--.*?-->')
+    _HTML_BLOCK_PATTERN = re.compile(
+        r'(?i)</?(?:p|div|h[1-6]|li|ul|ol|dl|dt|dd|blockquote|section|article|header|footer|aside|nav|'
+        r'table|tr|pre|figure|figcaption|hr|body)\b[^>]*>'
+    )
+    _HTML_BREAK_PATTERN = re.compile(r'(?i)<br\b[^>]*>')
+    _HTML_TAG_PATTERN = re.compile(r'<[^>]*>')
+    _WORD_PATTERN = re.compile(r'\S+')
+    _WHITESPACE_PATTERN = re.compile(r'\s+')
+    
     @staticmethod
     def read_book_content(file_path):
         """Đọc nội dung sách từ file PDF, EPUB hoặc TXT"""
@@ -55,47 +708,457 @@ class BookContentReader:
             return "File không tồn tại."
         
         file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension not in BookContentReader.SUPPORTED_EXTENSIONS:
+            return "Định dạng file không được hỗ trợ."
         
         try:
-            if file_extension == '.pdf':
-                return BookContentReader._read_pdf_content(file_path)
-            elif file_extension == '.epub':
-                return BookContentReader._read_epub_content(file_path)
-            elif file_extension == '.txt':
-                return BookContentReader._read_txt_content(file_path)
-            else:
-                return "Định dạng file không được hỗ trợ."
+            return BookContentReader._load_cached_content(file_path)
         except Exception as e:
             return f"Lỗi khi đọc file: {str(e)}"
     
     @staticmethod
-    def _read_pdf_content(file_path):
-        """Đọc nội dung từ file PDF"""
-        content = ""
+    def is_content_cached(file_path):
+        """Kiểm tra nội dung sách đã được trích xuất và cache chưa"""
+        return book_content_cache.contains(file_path, 'content')
+    
+    @staticmethod
+    def read_book_lines(file_path):
+        """Lấy nội dung sách đã tách dòng (dùng cho tìm kiếm), có cache
+        
+        Khác với read_book_content, hàm này raise exception khi không đọc được file.
+        """
+        return book_content_cache.get_or_load(
+            file_path, 'lines',
+            lambda: BookContentReader._load_cached_content(file_path).split('\n')
+        )
+    
+    @staticmethod
+    def get_source_version(file_path, content_hash=None):
+        """Chuỗi định danh phiên bản nội dung sách, đổi khi file bị thay thế hoặc cách trích xuất đổi
+        
+        Gồm mã băm nội dung (nếu có, nếu không thì mtime + kích thước file) và
+        phiên bản cách trích xuất của định dạng (khi khác 1).
+        """
+        if content_hash:
+            version = content_hash
+        else:
+            _, mtime_ns, size = BookContentCache.make_key(file_path)
+            version = f"{mtime_ns}-{size}"
+        format_version = BookContentReader.get_text_format_version(file_path)
+        return version if format_version == 1 else f"{version}-v{format_version}"
+    
+    @staticmethod
+    def get_text_format_version(file_path):
+        """Phiên bản cách chuyển định dạng của file thành văn bản"""
+        return BookContentReader.TEXT_FORMAT_VERSIONS.get(os.path.splitext(file_path)[1].lower(), 1)
+    
+    @staticmethod
+    def iter_book_lines(file_path):
+        """Duyệt từng dòng của sách, sinh tuple (số thứ tự dòng, offset ký tự, nội dung dòng)
+        
+        Số dòng và offset khớp với content.split('\\n') của read_book_content
+        (với TXT, dòng rỗng sau ký tự xuống dòng cuối file được bỏ qua).
+        File TXT được duyệt qua mmap theo từng nhóm dòng, các định dạng khác
+        dùng nội dung đã trích xuất (có cache).
+        """
+        if os.path.splitext(file_path)[1].lower() == '.txt':
+            text_file = BookContentReader.get_txt_file(file_path)
+            for line_index, line in enumerate(text_file.iter_lines()):
+                yield line_index, text_file.line_char_offsets[line_index], line
+            return
+        
+        content = BookContentReader._load_cached_content(file_path)
+        line_index = 0
+        start = 0
+        while True:
+            end = content.find('\n', start)
+            if end == -1:
+                yield line_index, start, content[start:]
+                return
+            yield line_index, start, content[start:end]
+            line_index += 1
+            start = end + 1
+    
+    @staticmethod
+    def get_chunk_index(file_path, chunk_size=None):
+        """Lấy danh sách offset ký tự bắt đầu của từng đoạn đọc, có cache"""
+        chunk_size = chunk_size or Config.READING_CHUNK_CHARS
+        
+        def build_index():
+            file_extension = os.path.splitext(file_path)[1].lower()
+            if file_extension == '.txt':
+                text_file = BookContentReader.get_txt_file(file_path)
+                with text_file.open_reader() as read_range:
+                    return BookContentReader._build_chunk_index(text_file.char_count, read_range, chunk_size)
+            if file_extension == '.epub':
+                return BookContentReader._build_epub_chunk_index(file_path, chunk_size)
+            
+            total_chars, read_range = BookContentReader._get_text_reader(file_path)
+            return BookContentReader._build_chunk_index(total_chars, read_range, chunk_size)
+        
+        return book_content_cache.get_or_load(file_path, f'chunks:{chunk_size}', build_index)
+    
+    @staticmethod
+    def word_index_to_offset(file_path, word_index, block_chars=1024 * 1024):
+        """Offset ký tự bắt đầu của từ thứ word_index (đếm từ 0, tách theo khoảng trắng
+        như trình đọc cũ), hoặc tổng số ký tự nếu sách có ít từ hơn
+        """
+        total_chars, read_range = BookContentReader._get_text_reader(file_path)
+        words = 0
+        in_word = False
+        for block_start in range(0, total_chars, block_chars):
+            text = read_range(block_start, min(block_start + block_chars, total_chars))
+            for match in BookContentReader._WORD_PATTERN.finditer(text):
+                # Từ bị cắt ở ranh giới khối đã được đếm ở khối trước
+                if match.start() == 0 and in_word:
+                    continue
+                if words == word_index:
+                    return block_start + match.start()
+                words += 1
+            in_word = bool(text) and not text[-1].isspace()
+        return total_chars
+    
+    @staticmethod
+    def read_chunk(file_path, chunk_number=None, offset=0, chunk_size=None):
+        """Đọc một đoạn nội dung sách theo số thứ tự đoạn hoặc theo offset ký tự
+        
+        Returns:
+            dict: Thông tin đoạn (index, start, end, text, total_chunks, total_chars)
+                  hoặc None nếu số thứ tự đoạn không hợp lệ
+        """
+        total_chars, read_range = BookContentReader._get_text_reader(file_path)
+        starts = BookContentReader.get_chunk_index(file_path, chunk_size)
+        
+        if chunk_number is None:
+            offset = min(max(0, offset or 0), total_chars)
+            chunk_number = bisect_right(starts, offset) - 1
+        
+        if chunk_number < 0 or chunk_number >= len(starts):
+            return None
+        
+        start = starts[chunk_number]
+        end = starts[chunk_number + 1] if chunk_number + 1 < len(starts) else total_chars
+        return {
+            'index': chunk_number,
+            'start': start,
+            'end': end,
+            'text': read_range(start, end),
+            'total_chunks': len(starts),
+            'total_chars': total_chars
+        }
+    
+    @staticmethod
+    def _get_text_reader(file_path):
+        """Lấy (tổng số ký tự, hàm đọc khoảng ký tự [start, end)) của sách
+        
+        File TXT được đọc trực tiếp qua mmap nên không cần nạp cả file vào bộ nhớ,
+        EPUB chỉ chuyển đổi các chương chứa khoảng cần đọc, PDF dùng nội dung đã
+        trích xuất trong cache.
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension == '.txt':
+            text_file = BookContentReader.get_txt_file(file_path)
+            return text_file.char_count, text_file.read_chars
+        if file_extension == '.epub':
+            return BookContentReader._get_epub_text_reader(file_path)
+        
+        content = BookContentReader._load_cached_content(file_path)
+        return len(content), lambda start, end: content[start:end]
+    
+    @staticmethod
+    def _build_chunk_index(total_chars, read_range, chunk_size):
+        """Chia nội dung thành các đoạn, ưu tiên cắt tại xuống dòng hoặc khoảng trắng"""
+        starts = array('Q', [0])
+        position = 0
+        
+        while total_chars - position > chunk_size:
+            end = position + chunk_size
+            min_end = position + chunk_size // 2
+            window = read_range(min_end, end)
+            cut = window.rfind('\n')
+            if cut == -1:
+                cut = window.rfind(' ')
+            position = min_end + cut + 1 if cut != -1 else end
+            starts.append(position)
+        
+        return starts
+    
+    @staticmethod
+    def _load_cached_content(file_path):
+        """Lấy nội dung sách từ cache hoặc trích xuất từ file"""
+        return book_content_cache.get_or_load(
+            file_path, 'content',
+            lambda: BookContentReader._extract_content(file_path)
+        )
+    
+    @staticmethod
+    def get_book_statistics(file_path):
+        """Tính các thông số của sách: số trang, số từ, số ký tự
+        
+        Với PDF số trang là số trang gốc, với EPUB/TXT là số đoạn (trang) khi đọc.
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension == '.txt':
+            # Đếm theo từng nhóm dòng, không nạp cả file vào bộ nhớ
+            text_file = BookContentReader.get_txt_file(file_path)
+            word_count = sum(len(line.split()) for line in text_file.iter_lines())
+            char_count = text_file.char_count
+        else:
+            content = BookContentReader._load_cached_content(file_path)
+            word_count = len(content.split())
+            char_count = len(content)
+        
+        if file_extension == '.pdf':
+            page_count = BookContentReader.get_pdf_page_count(file_path)
+        else:
+            page_count = len(BookContentReader.get_chunk_index(file_path))
+        
+        return {
+            'page_count': page_count,
+            'word_count': word_count,
+            'char_count': char_count
+        }
+    
+    @staticmethod
+    def _extract_content(file_path):
+        """Trích xuất nội dung từ file theo định dạng (không qua cache)
+        
+        Nội dung PDF/EPUB sau khi trích xuất được lưu ra file text riêng để các
+        lần đọc sau (kể cả sau khi khởi động lại) không phải trích xuất lại.
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension == '.txt':
+            return BookContentReader._read_txt_content(file_path)
+        if file_extension not in ('.pdf', '.epub'):
+            raise ValueError("Định dạng file không được hỗ trợ.")
+        
+        text_path = BookContentReader._extracted_text_path(file_path)
+        if os.path.exists(text_path):
+            with open(text_path, 'r', encoding='utf-8', newline='') as file:
+                return file.read()
+        
+        if file_extension == '.pdf':
+            content = BookContentReader._read_pdf_content(file_path)
+        else:
+            content = BookContentReader._read_epub_content(file_path)
+        
+        BookContentReader._save_extracted_text(text_path, content)
+        return content
+    
+    @staticmethod
+    def needs_pdf_extraction(file_path):
+        """File PDF chưa có nội dung đã trích xuất lưu sẵn (đọc lần đầu sẽ phải trích xuất,
+        có thể dùng process pool)"""
+        if os.path.splitext(file_path)[1].lower() != '.pdf':
+            return False
+        try:
+            return not os.path.exists(BookContentReader._extracted_text_path(file_path))
+        except OSError:
+            return False
+    
+    @staticmethod
+    def _extracted_text_path(file_path, suffix='.txt'):
+        """Đường dẫn file lưu nội dung đã trích xuất (hoặc chỉ mục chương), gắn với phiên bản
+        hiện tại của file gốc và phiên bản cách trích xuất"""
+        stat = os.stat(file_path)
+        digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        format_version = BookContentReader.get_text_format_version(file_path)
+        version = f"-v{format_version}" if format_version != 1 else ''
+        return os.path.join(
+            Config.EXTRACTED_TEXT_FOLDER, f"{digest}-{stat.st_mtime_ns}-{stat.st_size}{version}{suffix}"
+        )
+    
+    @staticmethod
+    def _save_extracted_text(text_path, content):
+        """Ghi nội dung đã trích xuất ra file (ghi file tạm rồi đổi tên để tránh file dở dang)"""
+        try:
+            os.makedirs(os.path.dirname(text_path), exist_ok=True)
+            temp_path = f"{text_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8', newline='') as file:
+                file.write(content)
+            os.replace(temp_path, text_path)
+        except OSError as e:
+            # Không lưu được thì lần sau trích xuất lại, không ảnh hưởng việc đọc
+            logger.warning("Không thể lưu nội dung đã trích xuất %s: %s", text_path, e)
+    
+    @staticmethod
+    def get_pdf_page_count(file_path):
+        """Lấy tổng số trang của file PDF"""
+        try:
+            with open(file_path, 'rb') as file:
+                return len(PyPDF2.PdfReader(file).pages)
+        except Exception as e:
+            raise Exception(f"Lỗi đọc file PDF: {str(e)}")
+    
+    @staticmethod
+    def iter_pdf_pages(file_path, start_page=1, end_page=None):
+        """Trích xuất lần lượt từng trang PDF (generator)
+        
+        Chỉ trang nào được duyệt tới mới được trích xuất, nên caller có thể
+        dừng sớm hoặc chỉ lấy một khoảng trang.
+        
+        Yields:
+            tuple: (page_number, text) với page_number bắt đầu từ 1
+        """
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 total_pages = len(pdf_reader.pages)
+                last_page = min(end_page or total_pages, total_pages)
                 
-                # Thêm cảnh báo về chất lượng đọc PDF
-                content += "=" * 80 + "\n"
-                content += "LƯU Ý: Nội dung PDF được trích xuất tự động có thể không chính xác 100%.\n"
-                content += "Nếu văn bản hiển thị lỗi, vui lòng sử dụng file EPUB hoặc TXT.\n"
-                content += f"Tổng số trang: {total_pages}\n"
-                content += "=" * 80 + "\n\n"
-                
-                for page_num in range(total_pages):
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text()
-                    
-                    if page_text.strip():  # Chỉ thêm nếu có nội dung
-                        content += f"--- Trang {page_num + 1} ---\n"
-                        content += page_text + "\n\n"
-                    else:
-                        content += f"--- Trang {page_num + 1} (Không thể trích xuất text - có thể là ảnh) ---\n\n"
-                        
+                for page_number in range(max(1, start_page), last_page + 1):
+                    page_text = pdf_reader.pages[page_number - 1].extract_text() or ""
+                    yield page_number, page_text
         except Exception as e:
             raise Exception(f"Lỗi đọc file PDF: {str(e)}")
+    
+    @staticmethod
+    def extract_pdf_pages_parallel(file_path, workers=None, total_pages=None):
+        """Trích xuất toàn bộ trang PDF song song trên nhiều process
+        
+        Các trang được chia thành nhiều khoảng liên tiếp, mỗi khoảng do một
+        process xử lý, sau đó ghép lại theo đúng thứ tự trang. Nếu process pool
+        dùng chung bị hỏng giữa chừng thì bỏ pool đó và thử lại một lần với pool mới.
+        
+        Returns:
+            dict: pages (các tuple (page_number, text) theo thứ tự trang),
+                  page_timings (các tuple (page_number, seconds)), workers, seconds
+                  (thời gian thực), page_seconds (tổng thời gian các trang) và
+                  slowest_page ((page_number, seconds) hoặc None)
+        """
+        workers = workers or Config.PDF_EXTRACT_WORKERS
+        if total_pages is None:
+            total_pages = BookContentReader.get_pdf_page_count(file_path)
+        
+        started = time.perf_counter()
+        pages = BookContentReader._extract_pdf_pages_in_pool(file_path, workers, total_pages) if total_pages else []
+        page_timings = [(page_number, seconds) for page_number, _, seconds in pages]
+        
+        return {
+            'pages': [(page_number, page_text) for page_number, page_text, _ in pages],
+            'page_timings': page_timings,
+            'workers': workers,
+            'seconds': time.perf_counter() - started,
+            'page_seconds': sum(seconds for _, seconds in page_timings),
+            'slowest_page': max(page_timings, key=lambda timing: timing[1]) if page_timings else None
+        }
+    
+    @staticmethod
+    def _extract_pdf_pages_in_pool(file_path, workers, total_pages):
+        """Chia khoảng trang cho process pool và ghép kết quả (page_number, text, seconds) theo thứ tự"""
+        # Chia nhỏ hơn số worker để cân bằng tải giữa các trang nặng/nhẹ
+        range_size = max(1, -(-total_pages // (workers * 4)))
+        ranges = [
+            (start, min(start + range_size - 1, total_pages))
+            for start in range(1, total_pages + 1, range_size)
+        ]
+        
+        if workers == Config.PDF_EXTRACT_WORKERS:
+            for attempt in range(2):
+                pool = _get_pdf_process_pool()
+                try:
+                    futures = [pool.submit(_extract_pdf_page_range, file_path, start, end) for start, end in ranges]
+                    page_groups = [future.result() for future in futures]
+                    break
+                except BrokenProcessPool:
+                    _discard_pdf_process_pool(pool)
+                    if attempt:
+                        raise
+                    logger.warning("Process pool trích xuất PDF bị hỏng, tạo pool mới và thử lại: %s", file_path)
+        else:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(_extract_pdf_page_range, file_path, start, end) for start, end in ranges]
+                page_groups = [future.result() for future in futures]
+        
+        return [page for group in page_groups for page in group]
+    
+    @staticmethod
+    def _should_extract_pdf_in_parallel(total_pages):
+        """PDF đủ lớn và có nhiều hơn một worker thì mới trích xuất song song"""
+        return Config.PDF_EXTRACT_WORKERS > 1 and total_pages >= Config.PDF_PARALLEL_MIN_PAGES
+    
+    @staticmethod
+    def _read_pdf_blocks_parallel(file_path, total_pages):
+        """Trích xuất song song và trả về các khối văn bản giống iter_pdf_blocks"""
+        result = BookContentReader.extract_pdf_pages_parallel(file_path, total_pages=total_pages)
+        
+        if result['slowest_page']:
+            logger.info(
+                "Trích xuất PDF song song %s: %d trang, %d worker, %.2fs (tổng thời gian các trang %.2fs, "
+                "trang chậm nhất %d: %.3fs)",
+                file_path, total_pages, result['workers'], result['seconds'],
+                result['page_seconds'], *result['slowest_page']
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Thời gian trích xuất từng trang %s: %s", file_path,
+                    ', '.join(f"{page_number}: {seconds:.3f}s" for page_number, seconds in result['page_timings'])
+                )
+        
+        blocks = [BookContentReader._format_pdf_header(total_pages)]
+        blocks.extend(
+            BookContentReader._format_pdf_page(page_number, page_text)
+            for page_number, page_text in result['pages']
+        )
+        return blocks
+    
+    @staticmethod
+    def read_pdf_pages(file_path, start_page, end_page=None):
+        """Trích xuất một khoảng trang PDF (tính cả hai đầu), đã định dạng như khi đọc cả file"""
+        end_page = end_page or start_page
+        return ''.join(
+            BookContentReader._format_pdf_page(page_number, page_text)
+            for page_number, page_text in BookContentReader.iter_pdf_pages(file_path, start_page, end_page)
+        )
+    
+    @staticmethod
+    def iter_pdf_blocks(file_path):
+        """Sinh lần lượt các khối văn bản tạo nên nội dung PDF đầy đủ
+        
+        Khối đầu tiên là phần cảnh báo, mỗi khối tiếp theo là một trang. Nối
+        tất cả các khối lại sẽ được đúng nội dung của _read_pdf_content.
+        """
+        total_pages = BookContentReader.get_pdf_page_count(file_path)
+        yield BookContentReader._format_pdf_header(total_pages)
+        for page_number, page_text in BookContentReader.iter_pdf_pages(file_path):
+            yield BookContentReader._format_pdf_page(page_number, page_text)
+    
+    @staticmethod
+    def _format_pdf_header(total_pages):
+        """Tạo phần cảnh báo về chất lượng đọc PDF"""
+        return (
+            "=" * 80 + "\n"
+            "LƯU Ý: Nội dung PDF được trích xuất tự động có thể không chính xác 100%.\n"
+            "Nếu văn bản hiển thị lỗi, vui lòng sử dụng file EPUB hoặc TXT.\n"
+            f"Tổng số trang: {total_pages}\n"
+            + "=" * 80 + "\n\n"
+        )
+    
+    @staticmethod
+    def _format_pdf_page(page_number, page_text):
+        """Định dạng nội dung một trang PDF"""
+        if page_text.strip():  # Chỉ thêm nếu có nội dung
+            return f"--- Trang {page_number} ---\n{page_text}\n\n"
+        return f"--- Trang {page_number} (Không thể trích xuất text - có thể là ảnh) ---\n\n"
+    
+    @staticmethod
+    def _read_pdf_content(file_path):
+        """Đọc nội dung từ file PDF"""
+        total_pages = BookContentReader.get_pdf_page_count(file_path)
+        blocks = None
+        if BookContentReader._should_extract_pdf_in_parallel(total_pages):
+            try:
+                blocks = BookContentReader._read_pdf_blocks_parallel(file_path, total_pages)
+            except Exception as e:
+                # Process pool lỗi thì quay về trích xuất tuần tự
+                logger.warning("Trích xuất PDF song song thất bại, chuyển sang tuần tự: %s", e)
+        
+        if blocks is None:
+            blocks = BookContentReader.iter_pdf_blocks(file_path)
+        
+        # Gom các khối vào list rồi join một lần thay vì cộng chuỗi liên tục
+        content = ''.join(blocks)
         
         if not content.strip():
             return "Không thể trích xuất nội dung từ file PDF này. File có thể chứa toàn bộ hình ảnh hoặc được bảo vệ."
@@ -103,66 +1166,670 @@ class BookContentReader:
         return content
     
     @staticmethod
-    def _read_epub_content(file_path):
-        """Đọc nội dung từ file EPUB"""
-        try:
-            book = epub.read_epub(file_path)
-            content = ""
+    def get_epub_chapters(file_path):
+        """Lấy danh sách chương của EPUB theo thứ tự spine, có cache
+        
+        Returns:
+            list: Mỗi chương là dict gồm index, title (lấy từ mục lục), zip_path,
+                  start (offset ký tự của chương trong toàn bộ nội dung), text_length
+                  và chunk_starts (offset bắt đầu các đoạn đọc của chương)
+        """
+        return BookContentReader._get_epub_index(file_path)['chapters']
+    
+    @staticmethod
+    def read_epub_chapter(file_path, chapter_index):
+        """Trích xuất nội dung một chương EPUB (chỉ đọc đúng file của chương đó), có cache"""
+        chapters = BookContentReader.get_epub_chapters(file_path)
+        if chapter_index < 0 or chapter_index >= len(chapters):
+            return None
+        
+        def load_chapter():
+            with zipfile.ZipFile(file_path) as archive:
+                return BookContentReader._extract_epub_chapter(archive, chapters[chapter_index]['zip_path'])
+        
+        return book_content_cache.get_or_load(file_path, f'epub_chapter:{chapter_index}', load_chapter)
+    
+    @staticmethod
+    def _get_epub_index(file_path):
+        """Lấy chỉ mục chương EPUB từ cache, từ file đã lưu trên đĩa hoặc tạo mới (rồi lưu lại)"""
+        def load_index():
+            index_path = BookContentReader._extracted_text_path(file_path, '.chapters.json')
+            try:
+                with open(index_path, 'r', encoding='utf-8') as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                pass
+            
+            index = BookContentReader._build_epub_index(file_path)
+            BookContentReader._save_extracted_text(index_path, json.dumps(index, ensure_ascii=False))
+            return index
+        
+        return book_content_cache.get_or_load(file_path, 'epub_index', load_index)
+    
+    @staticmethod
+    def _get_epub_text_reader(file_path):
+        """Lấy (tổng số ký tự, hàm đọc khoảng ký tự) của EPUB
+        
+        Offset của từng chương trong chỉ mục cho biết khoảng ký tự cần đọc nằm
+        trong chương nào, nên mỗi lần đọc chỉ chuyển đổi các chương đó.
+        """
+        chapters = BookContentReader.get_epub_chapters(file_path)
+        chapter_starts = [chapter['start'] for chapter in chapters]
+        separator = BookContentReader.EPUB_CHAPTER_SEPARATOR
+        total_chars = chapters[-1]['start'] + chapters[-1]['text_length'] + len(separator) if chapters else 0
+        
+        def read_range(start, end):
+            start, end = max(0, start), min(end, total_chars)
+            if start >= end:
+                return ''
+            
+            parts = []
+            chapter_index = bisect_right(chapter_starts, start) - 1
+            while chapter_index < len(chapters) and chapters[chapter_index]['start'] < end:
+                chapter_start = chapters[chapter_index]['start']
+                text = BookContentReader.read_epub_chapter(file_path, chapter_index) + separator
+                parts.append(text[max(0, start - chapter_start):end - chapter_start])
+                chapter_index += 1
+            return ''.join(parts)
+        
+        return total_chars, read_range
+    
+    @staticmethod
+    def _build_epub_chunk_index(file_path, chunk_size):
+        """Ghép các đoạn đọc của từng chương EPUB (một đoạn không kéo dài qua hai chương)"""
+        index = BookContentReader._get_epub_index(file_path)
+        starts = array('Q', [0])
+        for chapter in index['chapters']:
+            if index['chunk_size'] == chunk_size:
+                chapter_starts = chapter['chunk_starts']
+            else:
+                chapter_text = BookContentReader.read_epub_chapter(file_path, chapter['index'])
+                chapter_starts = BookContentReader._get_chapter_chunk_starts(chapter['start'], chapter_text, chunk_size)
             
-            for item in book.get_items():
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    soup_content = item.get_body_content().decode('utf-8')
-                    # Chuyển HTML thành text
-                    h = html2text.HTML2Text()
-                    h.ignore_links = True
-                    h.ignore_images = True
-                    text_content = h.handle(soup_content)
-                    content += text_content + "\n\n"
+            # Chương trống (ví dụ trang chỉ có ảnh bìa) được gộp vào đoạn trước đó
+            starts.extend(start for start in chapter_starts if start > starts[-1])
+        return starts
+    
+    @staticmethod
+    def _get_chapter_chunk_starts(chapter_start, chapter_text, chunk_size):
+        """Offset (trong toàn bộ nội dung) bắt đầu các đoạn đọc của một chương"""
+        if not chapter_text.strip():
+            return []
+        
+        text = chapter_text + BookContentReader.EPUB_CHAPTER_SEPARATOR
+        local_starts = BookContentReader._build_chunk_index(len(text), lambda start, end: text[start:end], chunk_size)
+        return [chapter_start + start for start in local_starts]
+    
+    @staticmethod
+    def _build_epub_index(file_path, chunk_size=None):
+        """Đọc spine và mục lục từ OPF/NCX (chỉ phân tích XML trong file zip), sau đó
+        chuyển lần lượt từng chương thành văn bản một lần để biết chính xác độ dài
+        và vị trí các đoạn đọc của chương (không giữ nội dung cả cuốn trong bộ nhớ)
+        """
+        chunk_size = chunk_size or Config.READING_CHUNK_CHARS
+        opf_namespace = BookContentReader._OPF_NAMESPACE
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                opf_path, opf = BookMetadataExtractor.read_epub_opf(archive)
+                opf_dir = posixpath.dirname(opf_path)
+                
+                manifest = {item.get('id'): item for item in opf.iter(f'{opf_namespace}item')}
+                spine = opf.find(f'{opf_namespace}spine')
+                documents = []
+                if spine is not None:
+                    for itemref in spine.iter(f'{opf_namespace}itemref'):
+                        item = manifest.get(itemref.get('idref'))
+                        if item is not None and BookContentReader._is_epub_document(item):
+                            documents.append(item)
+                
+                # EPUB lỗi không có spine thì dùng thứ tự trong manifest
+                if not documents:
+                    documents = [item for item in manifest.values() if BookContentReader._is_epub_document(item)]
+                
+                toc_titles = BookContentReader._read_epub_toc_titles(archive, opf_dir, manifest, spine)
+                
+                chapters = []
+                position = 0
+                for item in documents:
+                    zip_path = posixpath.join(opf_dir, item.get('href'))
+                    text = BookContentReader._extract_epub_chapter(archive, zip_path)
+                    chapters.append({
+                        'index': len(chapters),
+                        'title': toc_titles.get(BookContentReader._normalize_epub_path(zip_path))
+                                 or f"Chương {len(chapters) + 1}",
+                        'zip_path': zip_path,
+                        'start': position,
+                        'text_length': len(text),
+                        'chunk_starts': BookContentReader._get_chapter_chunk_starts(position, text, chunk_size)
+                    })
+                    position += len(text) + len(BookContentReader.EPUB_CHAPTER_SEPARATOR)
+                
+                return {'chunk_size': chunk_size, 'chapters': chapters}
         except Exception as e:
             raise Exception(f"Lỗi đọc file EPUB: {str(e)}")
-        return content
     
     @staticmethod
-    def _read_txt_content(file_path):
-        """Đọc nội dung từ file TXT"""
+    def _is_epub_document(item):
+        """Mục trong manifest là trang nội dung (XHTML/HTML) và không phải trang mục lục EPUB 3"""
+        return (item.get('media-type') in ('application/xhtml+xml', 'text/html')
+                and 'nav' not in (item.get('properties') or '').split())
+    
+    @staticmethod
+    def _normalize_epub_path(path):
+        """Chuẩn hóa đường dẫn trong EPUB (bỏ #fragment, giải mã %xx) để so khớp mục lục với chương"""
+        return posixpath.normpath(unquote(path.split('#')[0]))
+    
+    @staticmethod
+    def _read_epub_toc_titles(archive, opf_dir, manifest, spine):
+        """Đọc mục lục (nav của EPUB 3 và NCX của EPUB 2)
+        
+        Returns:
+            dict: Đường dẫn file chương trong zip -> tiêu đề đầu tiên trỏ tới file đó
+        """
+        titles = {}
+        nav_item = next(
+            (item for item in manifest.values() if 'nav' in (item.get('properties') or '').split()), None
+        )
+        ncx_item = manifest.get(spine.get('toc')) if spine is not None else None
+        if ncx_item is None:
+            ncx_item = next(
+                (item for item in manifest.values() if item.get('media-type') == 'application/x-dtbncx+xml'), None
+            )
+        
+        for item, is_nav in ((nav_item, True), (ncx_item, False)):
+            if item is None:
+                continue
+            toc_path = posixpath.join(opf_dir, item.get('href'))
+            try:
+                root = ElementTree.fromstring(BookContentReader._read_epub_entry(archive, toc_path))
+            except (KeyError, ElementTree.ParseError):
+                # Mục lục lỗi chỉ làm mất tiêu đề chương, không làm hỏng việc đọc
+                continue
+            
+            toc_dir = posixpath.dirname(toc_path)
+            if is_nav:
+                entries = (
+                    (link.get('href'), ''.join(link.itertext()))
+                    for nav in root.iter(f'{BookContentReader._XHTML_NAMESPACE}nav')
+                    if nav.get(f'{BookContentReader._OPS_NAMESPACE}type', 'toc') == 'toc'
+                    for link in nav.iter(f'{BookContentReader._XHTML_NAMESPACE}a')
+                )
+            else:
+                ncx = BookContentReader._NCX_NAMESPACE
+                entries = (
+                    (content.get('src'), ''.join(label.itertext()))
+                    for nav_point in root.iter(f'{ncx}navPoint')
+                    for content, label in [(nav_point.find(f'{ncx}content'), nav_point.find(f'{ncx}navLabel'))]
+                    if content is not None and label is not None
+                )
+            
+            for href, title in entries:
+                title = ' '.join(title.split())
+                if href and title:
+                    titles.setdefault(BookContentReader._normalize_epub_path(posixpath.join(toc_dir, href)), title)
+        return titles
+    
+    @staticmethod
+    def _read_epub_entry(archive, zip_path):
+        """Đọc một file trong EPUB (đường dẫn trong OPF có thể được mã hóa %xx)"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except UnicodeDecodeError:
-            # Thử với encoding khác nếu UTF-8 fail
+            return archive.read(zip_path)
+        except KeyError:
+            return archive.read(unquote(zip_path))
+    
+    @staticmethod
+    def _extract_epub_chapter(archive, zip_path):
+        """Đọc một file chương trong EPUB và chuyển HTML thành text"""
+        return BookContentReader._html_to_text(BookContentReader._read_epub_entry(archive, zip_path))
+    
+    @staticmethod
+    def _html_to_text(raw_html):
+        """Chuyển HTML của một chương thành văn bản thuần
+        
+        Mỗi khối (đoạn văn, tiêu đề, mục danh sách...) thành một đoạn cách nhau
+        bởi một dòng trống, <br> thành xuống dòng, khoảng trắng thừa được gộp.
+        """
+        text = raw_html.decode('utf-8', errors='replace') if isinstance(raw_html, bytes) else raw_html
+        text = BookContentReader._HTML_SKIP_PATTERN.sub(' ', text)
+        text = BookContentReader._WHITESPACE_PATTERN.sub(' ', text)
+        text = BookContentReader._HTML_BREAK_PATTERN.sub('\n', text)
+        text = BookContentReader._HTML_BLOCK_PATTERN.sub('\n\n', text)
+        text = html.unescape(BookContentReader._HTML_TAG_PATTERN.sub('', text))
+        
+        paragraphs = []
+        for block in text.split('\n\n'):
+            lines = (' '.join(line.split()) for line in block.split('\n'))
+            paragraph = '\n'.join(line for line in lines if line)
+            if paragraph:
+                paragraphs.append(paragraph)
+        return '\n\n'.join(paragraphs)
+    
+    @staticmethod
+    def _read_epub_content(file_path):
+        """Đọc nội dung từ file EPUB theo thứ tự spine (các chương nối bằng EPUB_CHAPTER_SEPARATOR)"""
+        chapters = BookContentReader.get_epub_chapters(file_path)
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                return ''.join(
+                    BookContentReader._extract_epub_chapter(archive, chapter['zip_path'])
+                    + BookContentReader.EPUB_CHAPTER_SEPARATOR
+                    for chapter in chapters
+                )
+        except Exception as e:
+            raise Exception(f"Lỗi đọc file EPUB: {str(e)}")
+    
+    @staticmethod
+    def get_txt_file(file_path):
+        """Lấy đối tượng MappedTextFile (đã có chỉ mục dòng) của file TXT, có cache"""
+        def build_index():
             try:
-                with open(file_path, 'r', encoding='cp1252') as file:
-                    return file.read()
+                return MappedTextFile(file_path)
             except Exception as e:
                 raise Exception(f"Lỗi đọc file TXT: {str(e)}")
+        
+        return book_content_cache.get_or_load(file_path, 'txt_index', build_index)
+    
+    @staticmethod
+    def _read_txt_content(file_path):
+        """Đọc nội dung từ file TXT"""
+        text_file = BookContentReader.get_txt_file(file_path)
+        try:
+            return text_file.read_all()
         except Exception as e:
             raise Exception(f"Lỗi đọc file TXT: {str(e)}")
 
+class BookMetadataExtractor:
+    """Class đọc metadata (tiêu đề, tác giả, ...) nhúng trong file sách"""
+    
+    _DC_NAMESPACE = '{http://purl.org/dc/elements/1.1/}'
+    _CONTAINER_NAMESPACE = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+    
+    @staticmethod
+    def extract(file_path, original_filename=None):
+        """Lấy metadata của sách, nếu file không có tiêu đề thì lấy từ tên file
+        
+        Args:
+            file_path (str): Đường dẫn file sách
+            original_filename (str): Tên file gốc (khi file đã được lưu dưới tên khác)
+        
+        Returns:
+            dict: title, author, publisher, description, publication_year, genres
+        """
+        metadata = {
+            'title': None,
+            'author': None,
+            'publisher': None,
+            'description': None,
+            'publication_year': None,
+            'genres': []
+        }
+        
+        file_extension = os.path.splitext(file_path)[1].lower()
+        try:
+            if file_extension == '.epub':
+                metadata.update(BookMetadataExtractor._read_epub_metadata(file_path))
+            elif file_extension == '.pdf':
+                metadata.update(BookMetadataExtractor._read_pdf_metadata(file_path))
+        except Exception as e:
+            # Metadata hỏng không làm hỏng việc nhập sách
+            logger.warning("Không đọc được metadata của %s: %s", file_path, e)
+        
+        if not metadata['title']:
+            file_stem = os.path.splitext(os.path.basename(original_filename or file_path))[0]
+            metadata['title'] = re.sub(r'[_\s]+', ' ', file_stem).strip() or file_stem
+        return metadata
+    
+    @staticmethod
+    def read_epub_opf(archive):
+        """Tìm và đọc file OPF của EPUB đang mở, trả về (đường dẫn trong zip, cây XML)"""
+        container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+        rootfile = container.find(f'.//{BookMetadataExtractor._CONTAINER_NAMESPACE}rootfile')
+        opf_path = rootfile.get('full-path')
+        return opf_path, ElementTree.fromstring(archive.read(opf_path))
+    
+    @staticmethod
+    def _read_epub_metadata(file_path):
+        """Đọc metadata Dublin Core trong file OPF của EPUB (không nạp nội dung chương)"""
+        dc = BookMetadataExtractor._DC_NAMESPACE
+        with zipfile.ZipFile(file_path) as archive:
+            opf = BookMetadataExtractor.read_epub_opf(archive)[1]
+        
+        def first_text(tag):
+            for element in opf.iter(f'{dc}{tag}'):
+                if element.text and element.text.strip():
+                    return element.text.strip()
+            return None
+        
+        description = first_text('description')
+        if description:
+            description = html.unescape(re.sub(r'<[^>]+>', ' ', description))
+            description = re.sub(r'\s+', ' ', description).strip()
+        
+        date = first_text('date')
+        year = re.match(r'\d{4}', date) if date else None
+        
+        return {
+            'title': first_text('title'),
+            'author': first_text('creator'),
+            'publisher': first_text('publisher'),
+            'description': description,
+            'publication_year': int(year.group()) if year else None,
+            'genres': [element.text.strip() for element in opf.iter(f'{dc}subject')
+                       if element.text and element.text.strip()]
+        }
+    
+    @staticmethod
+    def _read_pdf_metadata(file_path):
+        """Đọc tiêu đề, tác giả, năm tạo trong document info của PDF"""
+        with open(file_path, 'rb') as file:
+            info = PyPDF2.PdfReader(file).metadata or {}
+            
+            def text(key):
+                value = info.get(key)
+                return (str(value).strip() or None) if value else None
+            
+            created = text('/CreationDate')
+            year = re.match(r'(?:D:)?(\d{4})', created) if created else None
+            return {
+                'title': text('/Title'),
+                'author': text('/Author'),
+                'publication_year': int(year.group(1)) if year else None
+            }
+
+class CoverImageProcessor:
+    """Class lấy ảnh bìa từ file sách và tạo ảnh thu nhỏ WebP nhiều kích thước"""
+    
+    _OPF_NAMESPACE = '{http://www.idpf.org/2007/opf}'
+    
+    @staticmethod
+    def is_available():
+        """Pillow đã được cài đặt hay chưa"""
+        return Image is not None
+    
+    @staticmethod
+    def extract_cover(file_path):
+        """Lấy dữ liệu ảnh bìa nhúng trong file sách (None nếu không có)
+        
+        EPUB: ảnh được khai báo là ảnh bìa trong OPF. PDF: ảnh lớn nhất nhúng
+        trong trang đầu (PyPDF2 không vẽ được trang PDF thành ảnh).
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+        try:
+            if file_extension == '.epub':
+                return CoverImageProcessor._extract_epub_cover(file_path)
+            if file_extension == '.pdf':
+                return CoverImageProcessor._extract_pdf_cover(file_path)
+        except Exception as e:
+            logger.warning("Không lấy được ảnh bìa của %s: %s", file_path, e)
+        return None
+    
+    @staticmethod
+    def _extract_epub_cover(file_path):
+        """Tìm ảnh bìa EPUB: properties="cover-image" (EPUB 3), <meta name="cover"> (EPUB 2)
+        hoặc ảnh có chữ cover trong id/tên file"""
+        opf_ns = CoverImageProcessor._OPF_NAMESPACE
+        with zipfile.ZipFile(file_path) as archive:
+            opf_path, opf = BookMetadataExtractor.read_epub_opf(archive)
+            
+            cover_id = None
+            for meta in opf.iter(f'{opf_ns}meta'):
+                if meta.get('name') == 'cover':
+                    cover_id = meta.get('content')
+            
+            images = [item for item in opf.iter(f'{opf_ns}item')
+                      if (item.get('media-type') or '').startswith('image/')]
+            candidates = (
+                [item for item in images if 'cover-image' in (item.get('properties') or '').split()]
+                + [item for item in images if cover_id and item.get('id') == cover_id]
+                + [item for item in images
+                   if 'cover' in (item.get('id') or '').lower() or 'cover' in (item.get('href') or '').lower()]
+            )
+            if not candidates:
+                return None
+            
+            href = unquote(candidates[0].get('href'))
+            return archive.read(posixpath.normpath(posixpath.join(posixpath.dirname(opf_path), href)))
+    
+    @staticmethod
+    def _extract_pdf_cover(file_path):
+        """Lấy ảnh lớn nhất trong trang đầu của PDF"""
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            if not pdf_reader.pages:
+                return None
+            images = pdf_reader.pages[0].images
+            if not images:
+                return None
+            return max(images, key=lambda image: len(image.data)).data
+    
+    @staticmethod
+    def path_to_url(file_path):
+        """Đường dẫn file trong thư mục static sang URL (ví dụ /static/covers/a.webp)"""
+        return '/' + os.path.normpath(file_path).replace(os.sep, '/').lstrip('/')
+    
+    @staticmethod
+    def url_to_path(url):
+        """URL ảnh bìa cục bộ (/static/...) sang đường dẫn file, None nếu là URL bên ngoài"""
+        if not url or not url.startswith('/static/'):
+            return None
+        return os.path.normpath(unquote(url).lstrip('/'))
+    
+    @staticmethod
+    def create_thumbnails(image_data, output_folder=None, widths=None):
+        """Tạo ảnh thu nhỏ WebP theo từng chiều rộng (không phóng to ảnh nhỏ)
+        
+        Tên file đặt theo mã băm dữ liệu ảnh nên ảnh giống nhau dùng chung file
+        và URL không bao giờ trỏ tới nội dung khác (cache lâu dài được).
+        
+        Returns:
+            tuple: (URL ảnh lớn nhất, chuỗi srcset "url 160w, url 320w, ...")
+        """
+        output_folder = output_folder or Config.COVER_THUMBNAILS_FOLDER
+        widths = widths or Config.COVER_THUMBNAIL_WIDTHS
+        os.makedirs(output_folder, exist_ok=True)
+        name = hashlib.sha256(image_data).hexdigest()[:16]
+        
+        with Image.open(io.BytesIO(image_data)) as source:
+            # JPEG lớn được giải mã ở độ phân giải thấp hơn ngay từ đầu
+            source.draft('RGB', (max(widths), max(widths) * 4))
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'PA', 'P') else 'RGB')
+            
+            entries = []
+            for width in sorted({min(width, image.width) for width in widths}):
+                file_path = os.path.join(output_folder, f'{name}-{width}w.webp')
+                if not os.path.exists(file_path):
+                    height = max(1, round(image.height * width / image.width))
+                    thumbnail = image.resize((width, height), Image.LANCZOS)
+                    temp_path = f'{file_path}.{os.getpid()}.tmp'
+                    thumbnail.save(temp_path, 'WEBP', quality=Config.COVER_WEBP_QUALITY, method=4)
+                    os.replace(temp_path, file_path)
+                entries.append(f'{CoverImageProcessor.path_to_url(file_path)} {width}w')
+        
+        return entries[-1].rsplit(' ', 1)[0], ', '.join(entries)
+
+def _build_fold_table():
+    """Bảng chuyển ký tự sang dạng chữ thường, không dấu (mỗi ký tự thành đúng một ký tự)"""
+    table = {ord('đ'): 'd', ord('Đ'): 'd'}
+    for code_point in list(range(0x41, 0x5B)) + list(range(0xC0, 0x250)) + list(range(0x1E00, 0x1F00)):
+        char = chr(code_point)
+        if ord(char) in table:
+            continue
+        base = unicodedata.normalize('NFD', char)[0].lower()
+        if len(base) == 1 and base != char:
+            table[code_point] = base
+    return table
+
+class TextNormalizer:
+    """Class chuẩn hóa văn bản để tìm kiếm không phân biệt hoa thường và dấu tiếng Việt"""
+    
+    _FOLD_TABLE = _build_fold_table()
+    
+    @staticmethod
+    def fold(text):
+        """Chuyển văn bản sang chữ thường, bỏ dấu ("Đường" -> "duong")
+        
+        Độ dài kết quả luôn bằng độ dài đầu vào nên vị trí tìm thấy trên văn bản
+        đã chuẩn hóa cũng là vị trí trên văn bản gốc.
+        """
+        return text.translate(TextNormalizer._FOLD_TABLE)
+    
+    @staticmethod
+    def tokenize(text):
+        """Tách văn bản đã chuẩn hóa thành các từ"""
+        return re.findall(r'\w+', TextNormalizer.fold(text))
+
 class BookSearcher:
     """Class tìm kiếm trong nội dung sách"""
     
+    @staticmethod
+    def build_fts_query(query):
+        """Tạo câu truy vấn FTS5 từ từ khóa người dùng nhập
+        
+        Từ khóa đặt trong dấu nháy kép được tìm theo cụm từ chính xác, ngược lại
+        dòng phải chứa tất cả các từ (từ cuối cùng được tìm theo tiền tố).
+        
+        Returns:
+            str hoặc None nếu từ khóa không có từ nào
+        """
+        tokens = TextNormalizer.tokenize(query or '')
+        if not tokens:
+            return None
+        
+        query = query.strip()
+        if len(query) > 1 and query.startswith('"') and query.endswith('"'):
+            return '"' + ' '.join(tokens) + '"'
+        
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+    
+    @staticmethod
+    def find_match(line, query):
+        """Tìm vị trí (start, end) khớp đầu tiên của từ khóa trong dòng, không phân biệt dấu"""
+        matches = BookSearcher.find_matches(line, query)
+        return matches[0] if matches else None
+    
+    @staticmethod
+    def find_matches(text, query):
+        """Tìm tất cả vị trí (start, end) khớp từ khóa trong văn bản, không phân biệt dấu
+        
+        Cụm từ trong dấu nháy kép được tìm nguyên cụm (các từ cách nhau bởi
+        ký tự bất kỳ không phải chữ), ngược lại mỗi từ được tìm riêng.
+        """
+        tokens = TextNormalizer.tokenize(query or '')
+        if not tokens or not text:
+            return []
+        
+        folded_text = TextNormalizer.fold(text)
+        query = query.strip()
+        if len(query) > 1 and query.startswith('"') and query.endswith('"'):
+            pattern = r'\b' + r'\W+'.join(re.escape(token) for token in tokens) + r'\b'
+        else:
+            # \w* để đánh dấu trọn từ khi từ khóa chỉ khớp phần đầu của từ
+            pattern = r'\b(?:' + '|'.join(re.escape(token) for token in tokens) + r')\w*'
+        
+        return [match.span() for match in re.finditer(pattern, folded_text)]
+    
+    @staticmethod
+    def highlight(text, query, max_chars=None):
+        """Tạo đoạn HTML (đã escape) với các vị trí khớp từ khóa được bọc trong <mark>
+        
+        Nếu có max_chars, chỉ lấy một đoạn khoảng max_chars ký tự quanh vị trí
+        khớp đầu tiên (thêm "..." ở phần bị cắt).
+        """
+        if not text:
+            return Markup('')
+        
+        matches = BookSearcher.find_matches(text, query)
+        start, end = 0, len(text)
+        if max_chars and len(text) > max_chars:
+            first_match = matches[0][0] if matches else 0
+            start = max(0, min(first_match - max_chars // 4, len(text) - max_chars))
+            end = start + max_chars
+        
+        parts = [Markup('...')] if start > 0 else []
+        position = start
+        for match_start, match_end in matches:
+            if match_end <= start or match_start >= end:
+                continue
+            match_start, match_end = max(match_start, position), min(match_end, end)
+            parts.append(escape(text[position:match_start]))
+            parts.append(Markup('<mark>%s</mark>') % text[match_start:match_end])
+            position = match_end
+        parts.append(escape(text[position:end]))
+        if end < len(text):
+            parts.append(Markup('...'))
+        return Markup('').join(parts)
+    
     @staticmethod
     def search_in_content(content, query, max_results=None):
         """Tìm kiếm trong nội dung sách"""
         if not query or not content:
             return []
         
+        return BookSearcher.search_in_lines(content.split('\n'), query, max_results)
+    
+    @staticmethod
+    def search_in_lines(lines, query, max_results=None):
+        """Tìm kiếm trong nội dung sách đã được tách dòng"""
+        if not query or not lines:
+            return []
+        
         max_results = max_results or Config.MAX_SEARCH_RESULTS
-        lines = content.split('\n')
         results = []
         
         query_lower = query.lower()
+        char_offset = 0
         
         for i, line in enumerate(lines):
             if query_lower in line.lower():
                 results.append({
                     'line_number': i + 1,
+                    'char_offset': char_offset,
                     'content': line.strip(),
                     'context': BookSearcher._get_line_context(lines, i)
                 })
                 
                 if len(results) >= max_results:
                     break
+            
+            char_offset += len(line) + 1  # +1 cho ký tự xuống dòng
+        
+        return results
+    
+    @staticmethod
+    def search_in_blocks(blocks, query, max_results=None):
+        """Tìm kiếm trên các khối văn bản được sinh dần (ví dụ từng trang PDF)
+        
+        Mỗi khối phải kết thúc bằng ký tự xuống dòng. Việc duyệt dừng ngay khi
+        đủ kết quả; số dòng và offset ký tự được tính như khi tìm trên nội dung
+        đã nối đầy đủ.
+        """
+        if not query:
+            return []
+        
+        max_results = max_results or Config.MAX_SEARCH_RESULTS
+        results = []
+        line_offset = 0
+        char_offset = 0
+        
+        for block in blocks:
+            lines = block.split('\n')
+            if block.endswith('\n'):
+                lines.pop()  # Phần rỗng phía sau ký tự xuống dòng cuối cùng
+            
+            for result in BookSearcher.search_in_lines(lines, query, max_results - len(results)):
+                result['line_number'] += line_offset
+                result['char_offset'] += char_offset
+                results.append(result)
+            
+            if len(results) >= max_results:
+                break
+            
+            line_offset += len(lines)
+            char_offset += len(block)
         
         return results
     
@@ -174,6 +1841,222 @@ class BookSearcher:
         context_lines = lines[start:end]
         return ' '.join(line.strip() for line in context_lines if line.strip())
 
+class PaginationCursor:
+    """Class mã hóa cursor cho phân trang keyset (theo giá trị khóa của dòng cuối trang)"""
+    
+    @staticmethod
+    def encode(values):
+        """Mã hóa danh sách giá trị khóa thành chuỗi an toàn cho URL"""
+        data = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode(cursor, size):
+        """Giải mã cursor, trả về None nếu cursor rỗng hoặc không hợp lệ"""
+        if not cursor:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not isinstance(values, list) or len(values) != size:
+            return None
+        return values
+    
+    @staticmethod
+    def paginate(rows, limit, key_columns):
+        """Cắt danh sách (đã lấy dư 1 dòng) theo limit và tạo cursor cho trang sau
+        
+        Returns:
+            tuple: (các dòng của trang, cursor trang sau hoặc None nếu là trang cuối)
+        """
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        last_row = rows[-1]
+        return rows, PaginationCursor.encode(last_row[column] for column in key_columns)
+
+class HttpCacheHelper:
+    """Class tạo ETag và xử lý request có điều kiện (If-None-Match -> 304)"""
+    
+    @staticmethod
+    def make_etag(*parts):
+        """Tạo ETag mạnh từ các giá trị quyết định nội dung response"""
+        digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8'))
+        return digest.hexdigest()[:32]
+    
+    @staticmethod
+    def get_source_version(*folders):
+        """Phiên bản mã nguồn/template: mtime mới nhất của các file trong thư mục
+        
+        Đưa vào ETag của trang HTML để cập nhật giao diện làm ETag cũ hết hiệu lực.
+        Giống nhau giữa các worker process vì chỉ phụ thuộc file trên đĩa.
+        """
+        latest = 0
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [name for name in dirs if name != '__pycache__']
+                for filename in files:
+                    latest = max(latest, os.stat(os.path.join(root, filename)).st_mtime_ns)
+        return latest
+    
+    @staticmethod
+    def is_not_modified(request, etag):
+        """Client đã có đúng phiên bản này (so sánh cả ETag của bản nén -gzip/-br)"""
+        if_none_match = request.if_none_match
+        if not if_none_match:
+            return False
+        return any(
+            if_none_match.contains_weak(etag + suffix)
+            for suffix in ('', *(f'-{encoding}' for encoding in ResponseCompressor.ENCODINGS))
+        )
+    
+    @staticmethod
+    def set_etag(response, etag):
+        """Gắn ETag; trình duyệt luôn hỏi lại server (no-cache) và không lưu vào cache dùng chung"""
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    
+    @staticmethod
+    def not_modified(response_class, etag):
+        """Tạo response 304 Not Modified"""
+        return HttpCacheHelper.set_etag(response_class(status=304), etag)
+
+class CompressedResponseCache:
+    """Cache LRU (giới hạn theo dung lượng) cho body đã nén của response có ETag mạnh
+    
+    ETag mạnh xác định duy nhất nội dung nên bản nén theo (ETag, encoding) dùng
+    lại được cho mọi request sau mà không phải nén lại.
+    """
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = Config.COMPRESSED_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old_value = self._entries.pop(key, None)
+            if old_value is not None:
+                self.current_bytes -= len(old_value)
+            self._entries[key] = value
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+compressed_response_cache = CompressedResponseCache()
+
+class ResponseCompressor:
+    """Class nén response (brotli nếu có thư viện, gzip) theo Accept-Encoding của request"""
+    
+    ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+    COMPRESSIBLE_MIMETYPES = {
+        'text/html', 'text/plain', 'text/css', 'text/javascript',
+        'application/javascript', 'application/json', 'image/svg+xml'
+    }
+    
+    @staticmethod
+    def compress(data, encoding):
+        """Nén dữ liệu bằng encoding đã chọn"""
+        if encoding == 'br':
+            return brotli.compress(data, quality=Config.COMPRESS_BROTLI_QUALITY)
+        # mtime=0 để cùng nội dung luôn cho cùng bản nén
+        return gzip.compress(data, compresslevel=Config.COMPRESS_GZIP_LEVEL, mtime=0)
+    
+    @staticmethod
+    def compress_response(request, response):
+        """Nén body của response nếu client hỗ trợ và nội dung đáng nén"""
+        if (request.method == 'HEAD'
+                or response.status_code != 200
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in ResponseCompressor.COMPRESSIBLE_MIMETYPES):
+            return response
+        
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(ResponseCompressor.ENCODINGS)
+        if not encoding:
+            return response
+        
+        data = response.get_data()
+        if len(data) < Config.COMPRESS_MIN_BYTES:
+            return response
+        
+        etag, is_weak = response.get_etag()
+        cache_key = (etag, encoding) if etag and not is_weak else None
+        compressed = compressed_response_cache.get(cache_key) if cache_key else None
+        if compressed is None:
+            compressed = ResponseCompressor.compress(data, encoding)
+            if cache_key:
+                compressed_response_cache.put(cache_key, compressed)
+        
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag and not is_weak:
+            # Mỗi bản nén là một biểu diễn khác nên cần ETag mạnh riêng
+            response.set_etag(f'{etag}-{encoding}')
+        return response
+
+class ExecutorBusyError(RuntimeError):
+    """Executor đã đủ số việc đang chạy và đang chờ, việc mới bị từ chối"""
+
+class BoundedExecutor:
+    """Thread pool có giới hạn số việc đang chờ, dùng cho các view async
+    
+    Khi đã có max_workers việc đang chạy và max_pending việc đang chờ, việc mới
+    bị từ chối ngay (ExecutorBusyError) thay vì xếp hàng, nên request nặng
+    không giữ worker của server quá lâu và không làm chậm các request nhẹ.
+    """
+    
+    def __init__(self, max_workers, max_pending, thread_name_prefix=''):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+    
+    async def run(self, func, *args, **kwargs):
+        """Chạy func trong thread pool và chờ kết quả mà không chặn event loop"""
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusyError("Máy chủ đang bận, vui lòng thử lại sau")
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Trả slot khi việc thực sự kết thúc (kể cả khi request bị hủy giữa chừng)
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+    
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
 class ValidationHelper:
     """Class helper cho validation"""
     
@@ -236,7 +2119,10 @@ class DirectoryHelper:
         """Đảm bảo các thư mục cần thiết tồn tại"""
         directories = [
             Config.UPLOAD_FOLDER,
-            Config.COVERS_FOLDER
+            Config.COVERS_FOLDER,
+            Config.COVER_THUMBNAILS_FOLDER,
+            Config.EXTRACTED_TEXT_FOLDER,
+            Config.UPLOAD_SESSIONS_FOLDER
         ]
         
         for directory in directories:
@@ -1,9 +1,11 @@
 """
 Views/Routes cho ứng dụng EBook Reader
 """
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from .services import UserService, BookService, ReadingService, LibraryService, NoteService
-from .utils import DirectoryHelper
+import os
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, make_response, current_app
+from .services import UserService, BookService, ReadingService, LibraryService, NoteService, IngestionService, UploadService
+from .utils import DirectoryHelper, HttpCacheHelper, ResponseCompressor, ExecutorBusyError
+from .config import Config
 
 # Tạo Blueprint cho main routes
 main_bp = Blueprint('main', __name__)
@@ -14,6 +16,19 @@ book_service = BookService()
 reading_service = ReadingService()
 library_service = LibraryService()
 note_service = NoteService()
+ingestion_service = IngestionService()
+upload_service = UploadService()
+
+# Phiên bản template và mã nguồn, đưa vào ETag của trang HTML
+_APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+_PAGE_SOURCE_VERSION = HttpCacheHelper.get_source_version(
+    _APP_FOLDER, os.path.join(os.path.dirname(_APP_FOLDER), 'templates')
+)
+
+@main_bp.after_request
+def compress_response(response):
+    """Nén response (gzip/brotli) theo Accept-Encoding của trình duyệt"""
+    return ResponseCompressor.compress_response(request, response)
 
 @main_bp.route('/')
 def index():
@@ -127,20 +142,31 @@ def library():
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    books, error = library_service.get_user_library(session['user_id'])
+    status_filter = request.args.get('filter', 'all')
+    cursor = request.args.get('cursor')
+    
+    data, error = library_service.get_user_library(session['user_id'], cursor, status_filter)
     
     if error:
         flash(error, 'error')
     
-    return render_template('library.html', books=books)
+    return render_template('library.html',
+                         books=data['books'],
+                         stats=data['stats'],
+                         next_cursor=data['next_cursor'],
+                         status_filter=status_filter,
+                         is_first_page=not cursor)
 
 @main_bp.route('/search')
 def search():
     """Tìm kiếm sách"""
     query = request.args.get('q', '').strip()
     genre = request.args.get('genre', '').strip()
+    page = request.args.get('page', 1, type=int)
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
     
-    data = book_service.search_books(query, genre)
+    data = book_service.search_books(query, genre, page, limit, cursor)
     
     if 'error' in data:
         flash(data['error'], 'error')
@@ -149,7 +175,13 @@ def search():
                          books=data['books'], 
                          genres=data['genres'],
                          query=data['query'], 
-                         selected_genre=data['selected_genre'])
+                         selected_genre=data['selected_genre'],
+                         total=data['total'],
+                         page=data['page'],
+                         per_page=data['per_page'],
+                         total_pages=data['total_pages'],
+                         next_cursor=data['next_cursor'],
+                         limit=limit)
 
 @main_bp.route('/book/<int:book_id>')
 def book_detail(book_id):
@@ -157,7 +189,8 @@ def book_detail(book_id):
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    data, error = book_service.get_book_detail(book_id, session['user_id'])
+    notes_cursor = request.args.get('notes_cursor')
+    data, error = book_service.get_book_detail(book_id, session['user_id'], notes_cursor)
     
     if error:
         flash(error, 'error')
@@ -167,24 +200,86 @@ def book_detail(book_id):
                          book=data['book'],
                          genres=data['genres'],
                          user_book=data['user_book'],
-                         notes=data['notes'])
+                         notes=data['notes'],
+                         notes_next_cursor=data['notes_next_cursor'],
+                         is_first_notes_page=not notes_cursor)
+
+@main_bp.route('/book/<int:book_id>/status')
+def book_status(book_id):
+    """Trạng thái xử lý nền của sách (API endpoint để giao diện kiểm tra định kỳ)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    status, error = ingestion_service.get_status(book_id)
+    
+    if error:
+        return jsonify({'error': error}), 404
+    
+    return jsonify(status)
 
 @main_bp.route('/read/<int:book_id>')
-def read_book(book_id):
-    """Đọc sách"""
+async def read_book(book_id):
+    """Đọc sách (trích xuất nội dung trong thread pool việc nặng)"""
     if 'user_id' not in session:
         return redirect(url_for('main.login'))
     
-    data, error = reading_service.prepare_reading_session(book_id, session['user_id'])
+    try:
+        data, error = await reading_service.prepare_reading_session_async(book_id, session['user_id'])
+    except ExecutorBusyError as e:
+        return _busy_response(e, as_json=False)
     
     if error:
         flash(error, 'error')
         return redirect(url_for('main.index'))
     
-    return render_template('read.html', 
-                         book=data['book'],
-                         last_position=data['last_position'],
-                         book_content=data['book_content'])
+    # ETag theo phiên bản file sách, vị trí đọc và thông tin user hiển thị trên trang
+    # (bỏ qua khi có flash message vì thông báo chỉ hiển thị một lần)
+    etag = None
+    if data['content_version'] and not session.get('_flashes'):
+        etag = HttpCacheHelper.make_etag(
+            'read', tuple(data['book']), data['content_version'], data['last_position'],
+            session['user_id'], session.get('username'), session.get('full_name'), _PAGE_SOURCE_VERSION
+        )
+        if HttpCacheHelper.is_not_modified(request, etag):
+            return HttpCacheHelper.not_modified(current_app.response_class, etag)
+    
+    response = make_response(render_template('read.html', 
+                                             book=data['book'],
+                                             last_position=data['last_position'],
+                                             chunk=data['chunk']))
+    if etag:
+        HttpCacheHelper.set_etag(response, etag)
+    return response
+
+@main_bp.route('/read/<int:book_id>/chunk', defaults={'chunk_number': None})
+@main_bp.route('/read/<int:book_id>/chunk/<int:chunk_number>')
+async def read_chunk(book_id, chunk_number):
+    """Lấy một đoạn nội dung sách (API endpoint, đọc file trong thread pool việc nặng)
+    
+    Không có chunk_number thì trả về đoạn chứa offset ký tự (?offset=...).
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    offset = request.args.get('offset', 0, type=int)
+    
+    # Nội dung đoạn chỉ phụ thuộc phiên bản file sách: trả về 304 mà không cần đọc file
+    try:
+        content_version, error = await reading_service.get_content_version_async(book_id)
+        if error:
+            return jsonify({'error': error}), 404
+        etag = HttpCacheHelper.make_etag('chunk', book_id, content_version, chunk_number, offset)
+        if HttpCacheHelper.is_not_modified(request, etag):
+            return HttpCacheHelper.not_modified(current_app.response_class, etag)
+        
+        chunk, error = await reading_service.get_reading_chunk_async(book_id, chunk_number, offset)
+    except ExecutorBusyError as e:
+        return _busy_response(e)
+    
+    if error:
+        return jsonify({'error': error}), 404
+    
+    return HttpCacheHelper.set_etag(jsonify(chunk), etag)
 
 @main_bp.route('/add_to_library/<int:book_id>')
 def add_to_library(book_id):
@@ -208,9 +303,19 @@ def toggle_favorite(book_id):
     flash(message, 'success' if success else 'error')
     return redirect(url_for('main.book_detail', book_id=book_id))
 
+def _busy_response(error, as_json=True):
+    """Response 503 khi thread pool của view async đã đầy"""
+    if as_json:
+        response = jsonify({'error': str(error)})
+    else:
+        response = make_response(str(error))
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @main_bp.route('/save_progress', methods=['POST'])
-def save_progress():
-    """Lưu tiến độ đọc sách (API endpoint)"""
+async def save_progress():
+    """Lưu tiến độ đọc sách (API endpoint, ghi SQLite trong thread pool việc nhẹ)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
@@ -221,7 +326,12 @@ def save_progress():
     if not book_id:
         return jsonify({'error': 'Missing book_id'}), 400
     
-    success, message = reading_service.save_reading_progress(session['user_id'], book_id, position)
+    try:
+        success, message = await reading_service.save_reading_progress_async(
+            session['user_id'], book_id, position
+        )
+    except ExecutorBusyError as e:
+        return _busy_response(e)
     
     if success:
         return jsonify({'success': True, 'message': message})
@@ -286,9 +396,90 @@ def upload_book():
     
     return render_template('upload_book.html')
 
+@main_bp.route('/upload_book/chunked', methods=['POST'])
+def start_chunked_upload():
+    """Khởi tạo phiên upload nhiều phần (API endpoint)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    upload, error = upload_service.start_upload(
+        session['user_id'], data.get('filename', ''), data.get('size')
+    )
+    
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return jsonify(upload), 201
+
+@main_bp.route('/upload_book/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Các phần đã nhận của phiên upload, dùng để tiếp tục upload (API endpoint)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    upload, error = upload_service.get_upload_status(session['user_id'], upload_id)
+    
+    if error:
+        return jsonify({'error': error}), 404
+    
+    return jsonify(upload)
+
+@main_bp.route('/upload_book/chunked/<upload_id>/<int:chunk_index>', methods=['PUT'])
+def upload_chunk(upload_id, chunk_index):
+    """Nhận một phần của file, nội dung phần là body của request (API endpoint)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    upload, error = upload_service.save_chunk(session['user_id'], upload_id, chunk_index, request.stream)
+    
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return jsonify(upload)
+
+@main_bp.route('/upload_book/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Ghép các phần và tạo sách với thông tin trong form (API endpoint)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    book_id, error = upload_service.complete_upload(
+        session['user_id'], upload_id,
+        request.form.get('title', '').strip(),
+        request.form.get('author_name', '').strip(),
+        request.form.get('publisher_name', '').strip(),
+        request.form.get('description', '').strip(),
+        request.form.get('publication_year', type=int),
+        request.form.getlist('genres')
+    )
+    
+    if error:
+        return jsonify({'error': error}), 400
+    
+    flash('Đã upload sách thành công!', 'success')
+    return jsonify({
+        'success': True,
+        'book_id': book_id,
+        'redirect_url': url_for('main.book_detail', book_id=book_id)
+    })
+
+@main_bp.route('/upload_book/chunked/<upload_id>', methods=['DELETE'])
+def cancel_chunked_upload(upload_id):
+    """Hủy phiên upload nhiều phần (API endpoint)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    success, message = upload_service.cancel_upload(session['user_id'], upload_id)
+    
+    if not success:
+        return jsonify({'error': message}), 404
+    
+    return jsonify({'success': True, 'message': message})
+
 @main_bp.route('/search_in_book/<int:book_id>')
-def search_in_book(book_id):
-    """Tìm kiếm trong nội dung sách (API endpoint)"""
+async def search_in_book(book_id):
+    """Tìm kiếm trong nội dung sách (API endpoint, chạy trong thread pool việc nặng)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
@@ -296,16 +487,26 @@ def search_in_book(book_id):
     if not query:
         return jsonify({'results': [], 'total': 0})
     
-    results, error = reading_service.search_in_book(book_id, query)
+    try:
+        content_version, error = await reading_service.get_content_version_async(book_id)
+        if error:
+            return jsonify({'error': error}), 404
+        etag = HttpCacheHelper.make_etag('search', book_id, content_version, query, Config.MAX_SEARCH_RESULTS)
+        if HttpCacheHelper.is_not_modified(request, etag):
+            return HttpCacheHelper.not_modified(current_app.response_class, etag)
+        
+        search_result, error = await reading_service.search_in_book_async(book_id, query)
+    except ExecutorBusyError as e:
+        return _busy_response(e)
     
     if error:
         return jsonify({'error': error}), 500
     
-    return jsonify({
-        'results': results, 
-        'total': len(results),
+    return HttpCacheHelper.set_etag(jsonify({
+        'results': search_result['results'], 
+        'total': search_result['total'],
         'query': query
-    })
+    }), etag)
 
 # Error handlers
 @main_bp.errorhandler(404)
@@ -0,0 +1,8 @@
+"""
+Bộ benchmark hiệu năng cho EBook Reader
+
+Chạy từ thư mục gốc của project:
+    python -m benchmarks.bench_models --scales 1000,10000 --output models.json
+    python -m benchmarks.bench_extraction --sizes small,medium --output extraction.json
+    python -m benchmarks.compare old.json new.json
+"""
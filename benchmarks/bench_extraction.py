@@ -0,0 +1,560 @@
+"""
+Benchmark trích xuất nội dung và tìm kiếm trong sách trên bộ sách tổng hợp
+
+Bộ sách được sinh offline với seed cố định: mỗi kích thước (small/medium/
+large/xlarge, theo số trang) có cùng một nội dung tiếng Việt được ghi ra các
+định dạng PDF, EPUB và TXT (UTF-8, UTF-8 có BOM + CRLF, encoding dự phòng
+TXT_FALLBACK_ENCODING), nên có thể so sánh giữa các định dạng.
+
+Với mỗi file đo:
+    - thời gian trích xuất / mở sách khi chưa có cache, đọc một đoạn khi đã có cache
+    - bộ nhớ cao nhất khi mở sách và khi đánh chỉ mục tìm kiếm (tracemalloc và RSS,
+      chạy trong process riêng để cache của các phép đo khác không ảnh hưởng)
+    - thời gian tìm kiếm trong sách: quét tuần tự (BookSearcher) và qua chỉ mục FTS
+      (ReadingService.search_in_book) với từ khóa phổ biến, hiếm và không có
+
+Ví dụ:
+    python -m benchmarks.bench_extraction
+    python -m benchmarks.bench_extraction --sizes small,medium,large --output results/extraction.json
+    python -m benchmarks.bench_extraction --formats pdf,epub --corpus-dir .bench_data/corpus --no-memory
+
+So sánh hai lần chạy theo bộ nhớ:
+    python -m benchmarks.compare old.json new.json --metric traced_peak_mb
+"""
+import gc
+import os
+import sys
+import time
+import zlib
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import unicodedata
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.config import Config
+from app.models import DatabaseManager, BookModel
+from app.services import ReadingService
+from app.utils import BookContentReader, BookSearcher, TextNormalizer, book_content_cache
+from benchmarks.common import measure, environment_info, write_report, print_results
+from benchmarks.bench_models import WORDS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Kích thước sách theo số trang PDF (mỗi trang LINES_PER_PAGE dòng); EPUB/TXT có cùng nội dung
+SIZE_PAGES = {'small': 20, 'medium': 200, 'large': 2000, 'xlarge': 10000}
+DEFAULT_SIZES = ('small', 'medium')
+FORMATS = ('pdf', 'epub', 'txt-utf8', 'txt-utf8-bom-crlf', 'txt-legacy')
+LINES_PER_PAGE = 40
+PAGES_PER_CHAPTER = 10
+
+# Cụm từ chỉ xuất hiện ở vài trang cuối sách (không có trong WORDS) để đo trường hợp phải quét gần hết sách
+RARE_PHRASE = 'phượng hoàng'
+RARE_PAGE_RATIOS = (0.9, 0.95, 0.99)
+SEARCH_QUERIES = {
+    'common': 'sông',
+    'rare': RARE_PHRASE,
+    'absent': 'thiên thạch',
+    'phrase': f'"{RARE_PHRASE}"'
+}
+
+MB = 1024 * 1024
+
+def to_legacy_text(text, encoding):
+    """Giữ các ký tự encoding biểu diễn được, các ký tự khác bỏ dấu ("ợ" -> "o", "đ" -> "d")"""
+    table = {}
+    for char in set(text):
+        try:
+            char.encode(encoding)
+        except UnicodeEncodeError:
+            base = {'đ': 'd', 'Đ': 'D'}.get(char) or unicodedata.normalize('NFD', char)[0]
+            table[ord(char)] = base if base.isascii() else '?'
+    return text.translate(table)
+
+class CorpusGenerator:
+    """Sinh nội dung sách và ghi ra các định dạng"""
+
+    def __init__(self, seed=42):
+        self.seed = seed
+
+    def generate_pages(self, page_count):
+        """Sinh nội dung theo trang: list các trang, mỗi trang là list dòng"""
+        rng = random.Random(self.seed * 1000003 + page_count)
+        rare_pages = {min(page_count - 1, int(page_count * ratio)) for ratio in RARE_PAGE_RATIOS}
+        pages = []
+        for page_index in range(page_count):
+            lines = []
+            for _ in range(LINES_PER_PAGE):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(10, 16))]
+                lines.append(' '.join(words).capitalize() + rng.choice('.,;'))
+            if page_index in rare_pages:
+                lines[rng.randrange(LINES_PER_PAGE)] = f'Cánh chim {RARE_PHRASE} bay qua {rng.choice(WORDS)}.'
+            pages.append(lines)
+        return pages
+
+    @staticmethod
+    def rare_phrase_count(page_count):
+        return len({min(page_count - 1, int(page_count * ratio)) for ratio in RARE_PAGE_RATIOS})
+
+    def write(self, file_format, pages, file_path, title):
+        if file_format == 'pdf':
+            self.write_pdf(pages, file_path)
+        elif file_format == 'epub':
+            self.write_epub(pages, file_path, title)
+        else:
+            text = '\n'.join('\n'.join(lines) for lines in pages) + '\n'
+            if file_format == 'txt-utf8':
+                data = text.encode('utf-8')
+            elif file_format == 'txt-utf8-bom-crlf':
+                data = text.replace('\n', '\r\n').encode('utf-8-sig')
+            else:
+                encoding = Config.TXT_FALLBACK_ENCODING
+                data = to_legacy_text(text, encoding).encode(encoding)
+            with open(file_path, 'wb') as file:
+                file.write(data)
+
+    @staticmethod
+    def write_pdf(pages, file_path):
+        """Ghi PDF nhiều trang, nội dung nén Flate, font chuẩn Helvetica (WinAnsiEncoding)
+
+        Font chuẩn không có đủ ký tự tiếng Việt nên các ký tự ngoài cp1252 được
+        bỏ dấu, giống nhiều file PDF tiếng Việt cũ trích xuất được.
+        """
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        font_id = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+        # Các trang tham chiếu tới đối tượng Pages được thêm sau cùng
+        pages_id = 1 + 2 * len(pages) + 1
+        page_ids = []
+        for lines in pages:
+            operations = [b'BT /F1 11 Tf 50 770 Td 14 TL']
+            for line in lines:
+                encoded = to_legacy_text(line, 'cp1252').encode('cp1252')
+                encoded = encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+                operations.append(b'(' + encoded + b') Tj T*')
+            operations.append(b'ET')
+            stream = zlib.compress(b'\n'.join(operations))
+            content_id = add(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream')
+            page_ids.append(add(
+                b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R '
+                b'/Resources << /Font << /F1 %d 0 R >> >> >>' % (pages_id, content_id, font_id)
+            ))
+        add(b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+            + b'] /Count %d >>' % len(page_ids))
+        catalog_id = add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for object_id, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n' % object_id + body + b'\nendobj\n'
+        xref_offset = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(objects) + 1, catalog_id, xref_offset
+        )
+        with open(file_path, 'wb') as file:
+            file.write(output)
+
+    @staticmethod
+    def write_epub(pages, file_path, title):
+        """Ghi EPUB 2 (OPF + NCX), mỗi chương PAGES_PER_CHAPTER trang, mỗi dòng một đoạn <p>"""
+        chapters = [pages[start:start + PAGES_PER_CHAPTER] for start in range(0, len(pages), PAGES_PER_CHAPTER)]
+        names = [f'chap{index:04d}.xhtml' for index in range(1, len(chapters) + 1)]
+        fixed_time = (2020, 1, 1, 0, 0, 0)
+
+        def write_entry(archive, name, content, compress=zipfile.ZIP_DEFLATED):
+            # Thời gian cố định để file sinh ra giống hệt nhau giữa các lần chạy
+            info = zipfile.ZipInfo(name, fixed_time)
+            info.compress_type = compress
+            archive.writestr(info, content)
+
+        manifest = ''.join(
+            f'<item id="c{index}" href="{name}" media-type="application/xhtml+xml"/>'
+            for index, name in enumerate(names, start=1)
+        )
+        spine = ''.join(f'<itemref idref="c{index}"/>' for index in range(1, len(names) + 1))
+        nav_points = ''.join(
+            f'<navPoint id="n{index}" playOrder="{index}"><navLabel><text>Chương {index}</text></navLabel>'
+            f'<content src="{name}"/></navPoint>'
+            for index, name in enumerate(names, start=1)
+        )
+
+        with zipfile.ZipFile(file_path, 'w') as archive:
+            write_entry(archive, 'mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+            write_entry(archive, 'META-INF/container.xml',
+                        '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                        '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+                        'media-type="application/oebps-package+xml"/></rootfiles></container>')
+            write_entry(archive, 'OEBPS/content.opf',
+                        '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">'
+                        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                        f'<dc:title>{title}</dc:title><dc:creator>Benchmark</dc:creator>'
+                        '<dc:language>vi</dc:language>'
+                        f'<dc:identifier id="bookid">benchmark-{len(pages)}</dc:identifier></metadata>'
+                        '<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+                        f'{manifest}</manifest><spine toc="ncx">{spine}</spine></package>')
+            write_entry(archive, 'OEBPS/toc.ncx',
+                        '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+                        f'<head><meta name="dtb:uid" content="benchmark-{len(pages)}"/></head>'
+                        f'<docTitle><text>{title}</text></docTitle><navMap>{nav_points}</navMap></ncx>')
+            for index, (name, chapter_pages) in enumerate(zip(names, chapters), start=1):
+                paragraphs = ''.join(f'<p>{line}</p>' for lines in chapter_pages for line in lines)
+                write_entry(archive, f'OEBPS/{name}',
+                            '<?xml version="1.0" encoding="UTF-8"?>'
+                            '<html xmlns="http://www.w3.org/1999/xhtml" lang="vi"><head>'
+                            f'<title>Chương {index}</title></head>'
+                            f'<body><h1>Chương {index}</h1>{paragraphs}</body></html>')
+
+def prepare_corpus(corpus_dir, sizes, formats, seed, regenerate=False):
+    """Sinh (hoặc dùng lại) các file của bộ sách
+
+    Returns:
+        list: dict (size, format, file_path, pages, generate_seconds)
+    """
+    generator = CorpusGenerator(seed)
+    files = []
+    for size in sizes:
+        page_count = SIZE_PAGES[size]
+        pages = None
+        for file_format in formats:
+            extension = 'txt' if file_format.startswith('txt') else file_format
+            file_path = os.path.join(corpus_dir, f'{size}-seed{seed}-{file_format}.{extension}')
+            generate_seconds = None
+            if regenerate or not os.path.exists(file_path):
+                started = time.perf_counter()
+                if pages is None:
+                    pages = generator.generate_pages(page_count)
+                generator.write(file_format, pages, file_path, f'Sách thử nghiệm {size}')
+                generate_seconds = time.perf_counter() - started
+            files.append({
+                'size': size,
+                'format': file_format,
+                'file_path': file_path,
+                'pages': page_count,
+                'generate_seconds': generate_seconds
+            })
+    return files
+
+def clear_content_caches(extracted_folder):
+    """Xóa cache nội dung trong bộ nhớ và nội dung đã trích xuất lưu trên đĩa"""
+    book_content_cache.clear()
+    shutil.rmtree(extracted_folder, ignore_errors=True)
+
+class PeakRssSampler:
+    """Lấy mẫu RSS của process trong thread nền để biết mức cao nhất khi chạy một thao tác
+
+    Trên hệ thống không có /proc dùng ru_maxrss (mức cao nhất từ khi process
+    chạy, nên chỉ chính xác khi thao tác làm tăng mức cao nhất đó).
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.baseline_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current_rss_mb():
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def max_rss_mb():
+        if resource is None:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / MB if sys.platform == 'darwin' else max_rss / 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, self.current_rss_mb())
+
+    def __enter__(self):
+        self.baseline_mb = self.current_rss_mb()
+        if self.baseline_mb is None:
+            self.baseline_mb = self.max_rss_mb()
+        else:
+            self.peak_mb = self.baseline_mb
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, self.current_rss_mb())
+        else:
+            self.peak_mb = self.max_rss_mb()
+
+    @property
+    def peak_delta_mb(self):
+        if self.baseline_mb is None or self.peak_mb is None:
+            return None
+        return max(0.0, self.peak_mb - self.baseline_mb)
+
+def _run_memory_operation(operation, file_path, db_path, book_id):
+    if operation == 'open':
+        BookContentReader.read_book_content(file_path)
+        BookContentReader.get_chunk_index(file_path)
+    else:
+        ReadingService(DatabaseManager(db_path)).index_book_content(book_id, file_path)
+
+def _prepare_memory_operation(operation, file_path, db_path, book_id, extracted_folder):
+    gc.collect()
+    if operation == 'open':
+        clear_content_caches(extracted_folder)
+    else:
+        # Chỉ đo phần đánh chỉ mục: nội dung đã được trích xuất sẵn
+        BookContentReader.read_book_content(file_path)
+        ReadingService(DatabaseManager(db_path)).search_index.delete_index(book_id)
+
+def measure_memory_in_child(operation, file_path, db_path, book_id, extracted_folder):
+    """Chạy trong process riêng: đo RSS cao nhất rồi đo lại với tracemalloc
+
+    Returns:
+        dict: seconds, rss_peak_delta_mb, traced_peak_mb
+    """
+    Config.EXTRACTED_TEXT_FOLDER = extracted_folder
+
+    _prepare_memory_operation(operation, file_path, db_path, book_id, extracted_folder)
+    started = time.perf_counter()
+    with PeakRssSampler() as sampler:
+        _run_memory_operation(operation, file_path, db_path, book_id)
+    seconds = time.perf_counter() - started
+
+    # tracemalloc làm chậm và tốn thêm bộ nhớ nên chạy riêng sau khi đo RSS
+    _prepare_memory_operation(operation, file_path, db_path, book_id, extracted_folder)
+    tracemalloc.start()
+    try:
+        _run_memory_operation(operation, file_path, db_path, book_id)
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': seconds,
+        'rss_peak_delta_mb': sampler.peak_delta_mb,
+        'traced_peak_mb': traced_peak / MB
+    }
+
+def measure_memory(operation, file_path, db_path, book_id, extracted_folder):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(
+            measure_memory_in_child, operation, file_path, db_path, book_id, extracted_folder
+        ).result()
+
+class ExtractionBenchmark:
+    """Các phép đo trên một file của bộ sách"""
+
+    def __init__(self, corpus_file, db_manager, book_id, extracted_folder, repeat, max_seconds, seed=7):
+        self.corpus_file = corpus_file
+        self.file_path = corpus_file['file_path']
+        self.file_format = corpus_file['format']
+        self.db = db_manager
+        self.book_id = book_id
+        self.extracted_folder = extracted_folder
+        self.repeat = repeat
+        self.max_seconds = max_seconds
+        self.random = random.Random(seed)
+        self.reading_service = ReadingService(db_manager)
+
+    def _measure(self, func, setup=None, heavy=False):
+        # Thao tác nặng (trích xuất cả sách) chỉ chạy ít lần để bộ benchmark không quá lâu
+        if heavy:
+            return measure(func, repeat=self.repeat, warmup=1, max_seconds=self.max_seconds, min_runs=3, setup=setup)
+        return measure(func, repeat=self.repeat * 10, max_seconds=self.max_seconds, setup=setup)
+
+    def verify_content(self):
+        """Kiểm tra nội dung trích xuất được đầy đủ trước khi đo (tránh đo nhầm đường lỗi)"""
+        clear_content_caches(self.extracted_folder)
+        content = BookContentReader._load_cached_content(self.file_path)
+        expected = CorpusGenerator.rare_phrase_count(self.corpus_file['pages'])
+        found = TextNormalizer.fold(content).count(TextNormalizer.fold(RARE_PHRASE))
+        if found != expected:
+            raise RuntimeError(
+                f"Nội dung trích xuất từ {self.file_path} không đúng: "
+                f"tìm thấy {found}/{expected} lần cụm từ '{RARE_PHRASE}'"
+            )
+        info = {
+            'file_bytes': os.path.getsize(self.file_path),
+            'chars': len(content),
+            'lines': content.count('\n') + 1,
+            'chunks': len(BookContentReader.get_chunk_index(self.file_path))
+        }
+        if self.file_format == 'pdf':
+            # Khi trích xuất song song, bộ nhớ của các process trích xuất không được tính trong [memory]
+            info['parallel_extraction'] = BookContentReader._should_extract_pdf_in_parallel(self.corpus_file['pages'])
+        return info
+
+    def run(self, with_memory=True):
+        file_path = self.file_path
+        clear_all = lambda: clear_content_caches(self.extracted_folder)
+        clear_memory = book_content_cache.clear
+        results = {}
+
+        # Mở sách lần đầu: trích xuất toàn bộ (PDF/EPUB lưu kèm ra đĩa) và chia đoạn
+        results['extract[cold]'] = self._measure(
+            lambda: BookContentReader._load_cached_content(file_path), clear_all, heavy=True
+        )
+        results['open_first_chunk[cold]'] = self._measure(
+            lambda: BookContentReader.read_chunk(file_path, 0), clear_all, heavy=True
+        )
+        if self.file_format in ('pdf', 'epub'):
+            # Đã có nội dung trích xuất trên đĩa (ví dụ sau khi khởi động lại)
+            BookContentReader._load_cached_content(file_path)
+            results['extract[disk-cache]'] = self._measure(
+                lambda: BookContentReader._load_cached_content(file_path), clear_memory, heavy=True
+            )
+        if self.file_format == 'pdf':
+            results['read_pdf_pages[first]'] = self._measure(
+                lambda: BookContentReader.read_pdf_pages(file_path, 1), heavy=True
+            )
+        if self.file_format == 'epub':
+            results['read_epub_chapter[cold]'] = self._measure(
+                lambda: BookContentReader.read_epub_chapter(file_path, 0), clear_all, heavy=True
+            )
+        results['get_book_statistics'] = self._measure(
+            lambda: BookContentReader.get_book_statistics(file_path), clear_memory, heavy=True
+        )
+
+        # Đọc khi đã có cache
+        total_chunks = len(BookContentReader.get_chunk_index(file_path))
+        results['read_chunk[warm]'] = self._measure(
+            lambda: BookContentReader.read_chunk(file_path, self.random.randrange(total_chunks))
+        )
+
+        # Tìm kiếm tuần tự trên các dòng đã cache (đường dự phòng khi không có FTS5)
+        lines = BookContentReader.read_book_lines(file_path)
+        for name, query in SEARCH_QUERIES.items():
+            if name == 'phrase':
+                continue
+            query = self._query_for_file(query)
+            results[f'BookSearcher.search_in_lines[{name}]'] = self._measure(
+                lambda query=query: BookSearcher.search_in_lines(lines, query)
+            )
+
+        # Tìm kiếm qua chỉ mục FTS: lần đầu phải đánh chỉ mục cả sách
+        search_index = self.reading_service.search_index
+        results['search_in_book[index-build]'] = self._measure(
+            lambda: self.reading_service.search_in_book(self.book_id, SEARCH_QUERIES['rare']),
+            lambda: search_index.delete_index(self.book_id), heavy=True
+        )
+        for name, query in SEARCH_QUERIES.items():
+            results[f'search_in_book[{name}]'] = self._measure(
+                lambda query=query: self.reading_service.search_in_book(self.book_id, query)
+            )
+
+        if with_memory:
+            db_path = self.db.db_path
+            self.db.close_connections()
+            for operation in ('open', 'index'):
+                results[f'{operation}[memory]'] = measure_memory(
+                    operation, file_path, db_path, self.book_id, self.extracted_folder
+                )
+        return results
+
+    def _query_for_file(self, query):
+        """Từ khóa theo đúng các ký tự có trong file (PDF/TXT encoding cũ bị bỏ bớt dấu)"""
+        if self.file_format == 'pdf':
+            return to_legacy_text(query, 'cp1252')
+        if self.file_format == 'txt-legacy':
+            return to_legacy_text(query, Config.TXT_FALLBACK_ENCODING)
+        return query
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark trích xuất nội dung và tìm kiếm trong sách')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help=f"Các kích thước ({', '.join(f'{name}={pages} trang' for name, pages in SIZE_PAGES.items())}), "
+                             'mặc định %(default)s')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='Các định dạng (mặc định %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20, help='Số lần đo tối đa cho thao tác nặng (x10 cho thao tác nhẹ)')
+    parser.add_argument('--max-seconds', type=float, default=5.0, help='Thời gian tối đa cho mỗi phép đo')
+    parser.add_argument('--seed', type=int, default=42, help='Seed sinh nội dung')
+    parser.add_argument('--corpus-dir', help='Thư mục lưu (và dùng lại) bộ sách đã sinh; mặc định thư mục tạm')
+    parser.add_argument('--regenerate', action='store_true', help='Sinh lại bộ sách dù đã có trong --corpus-dir')
+    parser.add_argument('--no-memory', action='store_true', help='Bỏ qua đo bộ nhớ (mỗi phép đo chạy một process riêng)')
+    parser.add_argument('--output', '-o', help='File JSON kết quả (mặc định in ra stdout)')
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    formats = [file_format.strip() for file_format in args.formats.split(',') if file_format.strip()]
+    unknown = [name for name in sizes if name not in SIZE_PAGES] + [name for name in formats if name not in FORMATS]
+    if unknown:
+        parser.error(f"Không hỗ trợ: {', '.join(unknown)}")
+
+    work_dir = tempfile.mkdtemp(prefix='ebook-bench-extraction-')
+    corpus_dir = args.corpus_dir or os.path.join(work_dir, 'corpus')
+    os.makedirs(corpus_dir, exist_ok=True)
+    # Nội dung trích xuất và chỉ mục tìm kiếm luôn nằm trong thư mục tạm, không đụng dữ liệu thật
+    extracted_folder = os.path.join(work_dir, 'extracted_text')
+    Config.EXTRACTED_TEXT_FOLDER = extracted_folder
+
+    report = {
+        'benchmark': 'extraction',
+        'meta': environment_info(
+            seed=args.seed,
+            pdf_extract_workers=Config.PDF_EXTRACT_WORKERS,
+            pdf_parallel_min_pages=Config.PDF_PARALLEL_MIN_PAGES,
+            reading_chunk_chars=Config.READING_CHUNK_CHARS,
+            txt_fallback_encoding=Config.TXT_FALLBACK_ENCODING,
+            book_content_cache_max_bytes=Config.BOOK_CONTENT_CACHE_MAX_BYTES
+        ),
+        'groups': {}
+    }
+    try:
+        print("Chuẩn bị bộ sách...", file=sys.stderr)
+        corpus = prepare_corpus(corpus_dir, sizes, formats, args.seed, args.regenerate)
+
+        db = DatabaseManager(os.path.join(work_dir, 'benchmark.db'))
+        db.init_database()
+        book_model = BookModel(db)
+
+        for corpus_file in corpus:
+            group_name = f"{corpus_file['format']}/{corpus_file['size']}"
+            book_id = book_model.create_book(group_name, None, None, '', corpus_file['file_path'])
+            benchmark = ExtractionBenchmark(
+                corpus_file, db, book_id, extracted_folder, args.repeat, args.max_seconds
+            )
+            info = benchmark.verify_content()
+            info.update(pages=corpus_file['pages'], generate_seconds=corpus_file['generate_seconds'])
+            results = benchmark.run(with_memory=not args.no_memory)
+            report['groups'][group_name] = {'info': info, 'results': results}
+
+            print_results(group_name, {name: stats for name, stats in results.items() if 'median_ms' in stats})
+            memory_results = {name: stats for name, stats in results.items() if 'traced_peak_mb' in stats}
+            if memory_results:
+                print_results(f'{group_name} (bộ nhớ, MB)', memory_results,
+                              ('traced_peak_mb', 'rss_peak_delta_mb', 'seconds'))
+            book_content_cache.clear()
+        db.close_connections()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_report(report, args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""
+Benchmark tầng model và service trên database tổng hợp ở nhiều quy mô
+
+Mỗi quy mô là số sách; số user, tác giả, dòng thư viện và ghi chú tăng theo
+tỉ lệ cố định (xem SyntheticDataset). Dữ liệu được sinh với seed cố định nên
+hai lần chạy trên hai phiên bản code dùng cùng một bộ dữ liệu. Các phép đo
+chạy trên bản sao của database đã sinh, nên database lưu trong --data-dir
+không bị các phép đo ghi dữ liệu làm thay đổi giữa các lần chạy.
+
+Ví dụ:
+    python -m benchmarks.bench_models
+    python -m benchmarks.bench_models --scales 1000,10000,100000,1000000 --output results/models.json
+    python -m benchmarks.bench_models --scales 100000 --data-dir .bench_data --only search
+"""
+import os
+import sys
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app.config import Config
+from app.models import DatabaseManager, UserModel, BookModel, UserLibraryModel, NoteModel, get_progress_buffer
+from app.services import UserService, BookService, ReadingService, LibraryService, NoteService
+from benchmarks.common import measure, environment_info, write_report, print_results
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+# Từ vựng để sinh tiêu đề/mô tả có nghĩa cho tìm kiếm toàn văn (có dấu tiếng Việt)
+WORDS = (
+    'sông', 'núi', 'tình', 'yêu', 'chiến', 'tranh', 'mùa', 'thu', 'làng', 'quê', 'người', 'mẹ',
+    'cha', 'biển', 'trăng', 'gió', 'lịch', 'sử', 'khoa', 'học', 'kinh', 'tế', 'thành', 'phố',
+    'đêm', 'ngày', 'hoa', 'sen', 'đất', 'nước', 'hành', 'trình', 'bí', 'mật', 'ký', 'ức',
+    'tuổi', 'trẻ', 'giấc', 'mơ', 'ánh', 'sáng', 'bóng', 'tối', 'con', 'đường', 'mưa', 'nắng',
+    'cuộc', 'đời', 'tâm', 'hồn', 'trái', 'tim', 'bầu', 'trời', 'rừng', 'xanh', 'dòng', 'chảy'
+)
+GENRES = (
+    'Văn học', 'Tiểu thuyết', 'Truyện ngắn', 'Thơ', 'Lịch sử', 'Khoa học', 'Kinh doanh',
+    'Tâm lý', 'Giáo dục', 'Trinh thám', 'Kinh dị', 'Viễn tưởng', 'Thiếu nhi', 'Du ký',
+    'Hồi ký', 'Triết học', 'Tôn giáo', 'Nghệ thuật', 'Ẩm thực', 'Thể thao', 'Y học',
+    'Công nghệ', 'Kỹ năng sống', 'Ngoại ngữ', 'Chính trị', 'Pháp luật', 'Địa lý',
+    'Âm nhạc', 'Điện ảnh', 'Nhiếp ảnh'
+)
+READING_STATUSES = ('not_started', 'reading', 'reading', 'completed')
+BATCH_SIZE = 50000
+
+class SyntheticDataset:
+    """Sinh database tổng hợp cho một quy mô (số sách)"""
+
+    def __init__(self, books, seed=42):
+        self.books = books
+        self.users = max(10, books // 10)
+        self.authors = max(10, books // 20)
+        self.publishers = 50
+        self.library_rows = books * 2
+        self.notes = books
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.started_at = datetime(2020, 1, 1)
+
+    def counts(self):
+        return {
+            'books': self.books,
+            'users': self.users,
+            'authors': self.authors,
+            'publishers': self.publishers,
+            'genres': len(GENRES),
+            'library_rows': self.library_rows,
+            'notes': self.notes
+        }
+
+    def _phrase(self, min_words, max_words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(min_words, max_words)))
+
+    def _timestamp(self, index, total):
+        # Thời điểm trải đều trong 4 năm, tăng theo thứ tự để giống dữ liệu thật
+        seconds = int(index * (4 * 365 * 86400) / max(total, 1))
+        return (self.started_at + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _insert_batches(self, conn, sql, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                conn.executemany(sql, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(sql, batch)
+
+    def build(self, db_path):
+        """Tạo schema bằng DatabaseManager rồi ghi dữ liệu tổng hợp theo lô"""
+        DatabaseManager(db_path).init_database()
+        DatabaseManager(db_path).close_connections()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('BEGIN')
+            self._insert_batches(conn, '''
+                INSERT INTO users (user_id, username, email, password_hash, full_name)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                (user_id, f'user{user_id}', f'user{user_id}@example.com', 'benchmark', f'Người dùng {user_id}')
+                for user_id in range(1, self.users + 1)
+            ))
+            self._insert_batches(conn, 'INSERT INTO authors (author_id, author_name) VALUES (?, ?)', (
+                (author_id, f'{self._phrase(1, 2).title()} {author_id}') for author_id in range(1, self.authors + 1)
+            ))
+            self._insert_batches(conn, 'INSERT INTO publishers (publisher_id, publisher_name) VALUES (?, ?)', (
+                (publisher_id, f'NXB {self._phrase(1, 2).title()}') for publisher_id in range(1, self.publishers + 1)
+            ))
+            conn.executemany('INSERT INTO genres (genre_id, genre_name) VALUES (?, ?)', enumerate(GENRES, start=1))
+
+            self._insert_batches(conn, '''
+                INSERT INTO books (book_id, title, author_id, publisher_id, description, file_path,
+                                   publication_year, page_count, word_count, char_count,
+                                   reading_time_minutes, ingestion_status, added_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'ready', ?)
+            ''', self._book_rows())
+            self._insert_batches(conn, 'INSERT INTO book_genres (book_id, genre_id) VALUES (?, ?)', (
+                (book_id, genre_id)
+                for book_id in range(1, self.books + 1)
+                for genre_id in self.random.sample(range(1, len(GENRES) + 1), self.random.randint(1, 3))
+            ))
+            self._insert_batches(conn, '''
+                INSERT INTO user_library (user_id, book_id, is_favorite, last_read_position, reading_status, added_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', self._library_rows())
+            self._insert_batches(conn, '''
+                INSERT INTO notes (user_id, book_id, content, location_in_book, highlighted_text, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', self._note_rows())
+
+            DatabaseManager.index_catalog_books(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _book_rows(self):
+        for book_id in range(1, self.books + 1):
+            word_count = self.random.randint(5000, 150000)
+            yield (
+                book_id, self._phrase(2, 5).capitalize(),
+                self.random.randint(1, self.authors), self.random.randint(1, self.publishers),
+                self._phrase(15, 40).capitalize() + '.', f'static/uploads/synthetic-{book_id}.txt',
+                self.random.randint(1950, 2024), word_count // 250, word_count, word_count * 6,
+                word_count // Config.READING_WORDS_PER_MINUTE + 1, self._timestamp(book_id, self.books)
+            )
+
+    def _library_rows(self):
+        # Mỗi user có cùng số sách, chọn ngẫu nhiên không trùng
+        per_user = max(1, self.library_rows // self.users)
+        row_index = 0
+        for user_id in range(1, self.users + 1):
+            for book_id in self.random.sample(range(1, self.books + 1), min(per_user, self.books)):
+                row_index += 1
+                yield (
+                    user_id, book_id, self.random.random() < 0.1,
+                    self.random.randint(0, 500000), self.random.choice(READING_STATUSES),
+                    self._timestamp(row_index, self.library_rows)
+                )
+
+    def _note_rows(self):
+        for note_index in range(self.notes):
+            yield (
+                self.random.randint(1, self.users), self.random.randint(1, self.books),
+                self._phrase(5, 25).capitalize(), f'Trang {self.random.randint(1, 500)}',
+                self._phrase(3, 10) if self.random.random() < 0.5 else None,
+                self._timestamp(note_index, self.notes)
+            )
+
+class ModelBenchmark:
+    """Các phép đo trên một database đã sinh"""
+
+    def __init__(self, db_path, dataset, repeat, max_seconds, seed=7):
+        self.db = DatabaseManager(db_path)
+        self.dataset = dataset
+        self.repeat = repeat
+        self.max_seconds = max_seconds
+        self.random = random.Random(seed)
+
+        # Lấy sẵn các user có sách trong thư viện và các cặp (user, sách) có ghi chú
+        conn = self.db.get_connection()
+        try:
+            self.library_pairs = [tuple(row) for row in conn.execute(
+                'SELECT user_id, book_id FROM user_library ORDER BY RANDOM() LIMIT 500'
+            )]
+            self.note_pairs = [tuple(row) for row in conn.execute(
+                'SELECT user_id, book_id FROM notes ORDER BY RANDOM() LIMIT 500'
+            )]
+        finally:
+            conn.close()
+
+    def _book_id(self):
+        return self.random.randint(1, self.dataset.books)
+
+    def _user_id(self):
+        return self.random.randint(1, self.dataset.users)
+
+    def _word(self):
+        return self.random.choice(WORDS)
+
+    def _genre(self):
+        return self.random.choice(GENRES)
+
+    def cases(self):
+        """Danh sách (tên, hàm đo, hàm chuẩn bị không tính giờ hoặc None)"""
+        db = self.db
+        book_model, user_model = BookModel(db), UserModel(db)
+        library_model, note_model = UserLibraryModel(db), NoteModel(db)
+        book_service, user_service = BookService(db), UserService(db)
+        reading_service, library_service, note_service = ReadingService(db), LibraryService(db), NoteService(db)
+        library_pair = lambda: self.random.choice(self.library_pairs)
+        note_pair = lambda: self.random.choice(self.note_pairs)
+
+        # Cursor trang thứ hai để đo phân trang keyset
+        _, _, search_cursor = book_model.search_books(None, None, 1, Config.SEARCH_BOOKS_PER_PAGE)
+        user_id = self.library_pairs[0][0]
+        _, library_cursor = library_model.get_user_books(user_id, Config.LIBRARY_BOOKS_PER_PAGE)
+
+        return [
+            # UserModel
+            ('UserModel.get_user_by_id', lambda: user_model.get_user_by_id(self._user_id()), None),
+            ('UserModel.get_user_by_username_or_email',
+             lambda: user_model.get_user_by_username_or_email(f'user{self._user_id()}@example.com'), None),
+            # BookModel
+            ('BookModel.get_recent_books', lambda: book_model.get_recent_books(Config.DEFAULT_BOOKS_PER_PAGE), None),
+            ('BookModel.get_book_by_id', lambda: book_model.get_book_by_id(self._book_id()), None),
+            ('BookModel.get_book_detail', lambda: book_model.get_book_detail(*reversed(note_pair())), None),
+            ('BookModel.get_book_genres', lambda: book_model.get_book_genres(self._book_id()), None),
+            ('BookModel.get_all_genres', book_model.get_all_genres, None),
+            ('BookModel.search_books[browse]', lambda: book_model.search_books(None, None, 1), None),
+            ('BookModel.search_books[browse,page=50]', lambda: book_model.search_books(None, None, 50), None),
+            ('BookModel.search_books[browse,cursor]',
+             lambda: book_model.search_books(None, None, 1, cursor=search_cursor), None),
+            ('BookModel.search_books[query]', lambda: book_model.search_books(self._word()), None),
+            ('BookModel.search_books[query2]',
+             lambda: book_model.search_books(f'{self._word()} {self._word()}'), None),
+            ('BookModel.search_books[genre]', lambda: book_model.search_books(None, self._genre()), None),
+            ('BookModel.search_books[query+genre]',
+             lambda: book_model.search_books(self._word(), self._genre()), None),
+            ('BookModel.get_popular_books', lambda: book_model.get_popular_books(20), None),
+            ('BookModel.get_unprocessed_book_ids', book_model.get_unprocessed_book_ids, None),
+            # UserLibraryModel
+            ('UserLibraryModel.get_user_books',
+             lambda: library_model.get_user_books(library_pair()[0], Config.LIBRARY_BOOKS_PER_PAGE), None),
+            ('UserLibraryModel.get_user_books[cursor]',
+             lambda: library_model.get_user_books(user_id, Config.LIBRARY_BOOKS_PER_PAGE, library_cursor), None),
+            ('UserLibraryModel.get_user_books[reading]',
+             lambda: library_model.get_user_books(library_pair()[0], Config.LIBRARY_BOOKS_PER_PAGE,
+                                                  status_filter='reading'), None),
+            ('UserLibraryModel.get_library_stats', lambda: library_model.get_library_stats(library_pair()[0]), None),
+            ('UserLibraryModel.get_reading_books', lambda: library_model.get_reading_books(library_pair()[0]), None),
+            ('UserLibraryModel.get_user_book', lambda: library_model.get_user_book(*library_pair()), None),
+            ('UserLibraryModel.save_reading_progress',
+             lambda: library_model.save_reading_progress(*library_pair(), self.random.randint(0, 500000)), None),
+            ('UserLibraryModel.save_reading_progress_batch[100]',
+             lambda: library_model.save_reading_progress_batch(
+                 [(*library_pair(), self.random.randint(0, 500000)) for _ in range(100)]
+             ), None),
+            ('UserLibraryModel.toggle_favorite', lambda: library_model.toggle_favorite(*library_pair()), None),
+            # NoteModel
+            ('NoteModel.get_book_notes', lambda: note_model.get_book_notes(*note_pair()), None),
+            ('NoteModel.create_note',
+             lambda: note_model.create_note(*note_pair(), self._phrase_for_note()), None),
+            # Service (cache danh mục: [warm] dùng lại kết quả, [cold] xóa cache trước mỗi lần đo)
+            ('UserService.get_user_info', lambda: user_service.get_user_info(self._user_id()), None),
+            ('BookService.get_home_data', lambda: book_service.get_home_data(library_pair()[0]), None),
+            ('BookService.get_home_data[cold]',
+             lambda: book_service.get_home_data(library_pair()[0]), db.invalidate_catalog),
+            ('BookService.get_book_detail', lambda: book_service.get_book_detail(*reversed(note_pair())), None),
+            ('BookService.search_books[warm]', lambda: book_service.search_books('sông'), None),
+            ('BookService.search_books[cold]',
+             lambda: book_service.search_books(self._word()), db.invalidate_catalog),
+            ('BookService.search_books[cold,genre]',
+             lambda: book_service.search_books(None, self._genre()), db.invalidate_catalog),
+            ('LibraryService.get_user_library', lambda: library_service.get_user_library(library_pair()[0]), None),
+            ('LibraryService.toggle_favorite', lambda: library_service.toggle_favorite(*library_pair()), None),
+            ('ReadingService.save_reading_progress',
+             lambda: reading_service.save_reading_progress(*library_pair(), self.random.randint(0, 500000)), None),
+            ('NoteService.get_book_notes', lambda: note_service.get_book_notes(*note_pair()), None),
+            ('NoteService.add_note', lambda: note_service.add_note(*note_pair(), self._phrase_for_note()), None),
+        ]
+
+    def _phrase_for_note(self):
+        return ' '.join(self.random.choice(WORDS) for _ in range(12))
+
+    def run(self, only=None):
+        results = {}
+        for name, func, setup in self.cases():
+            if only and not any(pattern.lower() in name.lower() for pattern in only):
+                continue
+            results[name] = measure(func, repeat=self.repeat, max_seconds=self.max_seconds, setup=setup)
+        return results
+
+def prepare_database(dataset, data_dir, regenerate=False):
+    """Dùng lại database đã sinh trong data_dir nếu có, nếu không thì sinh mới
+
+    Returns:
+        tuple: (đường dẫn database, số giây sinh dữ liệu hoặc None nếu dùng lại)
+    """
+    db_path = os.path.join(data_dir, f'synthetic-{dataset.books}-seed{dataset.seed}.db')
+    if os.path.exists(db_path) and not regenerate:
+        # Áp dụng migration mới (nếu có) lên database cũ
+        DatabaseManager(db_path).init_database()
+        return db_path, None
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    started = time.perf_counter()
+    dataset.build(db_path)
+    return db_path, time.perf_counter() - started
+
+def copy_database(db_path, run_dir):
+    """Sao chép database đã sinh sang thư mục chạy riêng để các phép đo ghi dữ liệu
+    (lưu tiến độ, ghi chú, yêu thích) không làm thay đổi database được dùng lại
+
+    Returns:
+        str: Đường dẫn bản sao
+    """
+    DatabaseManager(db_path).close_connections()
+    run_path = os.path.join(run_dir, os.path.basename(db_path))
+    for suffix in ('', '-wal'):
+        if os.path.exists(db_path + suffix):
+            shutil.copy(db_path + suffix, run_path + suffix)
+    return run_path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark tầng model/service trên database tổng hợp')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help='Các quy mô (số sách), phân cách bằng dấu phẩy (mặc định %(default)s)')
+    parser.add_argument('--repeat', type=int, default=200, help='Số lần đo tối đa mỗi phép đo')
+    parser.add_argument('--max-seconds', type=float, default=2.0, help='Thời gian tối đa cho mỗi phép đo')
+    parser.add_argument('--seed', type=int, default=42, help='Seed sinh dữ liệu')
+    parser.add_argument('--data-dir', help='Thư mục lưu (và dùng lại) database đã sinh; mặc định thư mục tạm')
+    parser.add_argument('--regenerate', action='store_true', help='Sinh lại database dù đã có trong --data-dir')
+    parser.add_argument('--only', action='append', help='Chỉ chạy các phép đo có tên chứa chuỗi này (lặp lại được)')
+    parser.add_argument('--output', '-o', help='File JSON kết quả (mặc định in ra stdout)')
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ebook-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+
+    report = {
+        'benchmark': 'models',
+        'meta': environment_info(
+            seed=args.seed,
+            progress_write_behind=Config.PROGRESS_WRITE_BEHIND,
+            catalog_cache_ttl=Config.CATALOG_CACHE_TTL,
+            database_pool_size=Config.DATABASE_POOL_SIZE
+        ),
+        'groups': {}
+    }
+    try:
+        for scale in scales:
+            dataset = SyntheticDataset(scale, args.seed)
+            print(f"Chuẩn bị dữ liệu {scale} sách...", file=sys.stderr)
+            db_path, build_seconds = prepare_database(dataset, data_dir, args.regenerate)
+
+            run_dir = tempfile.mkdtemp(prefix='ebook-bench-run-')
+            run_path = copy_database(db_path, run_dir)
+            try:
+                results = ModelBenchmark(run_path, dataset, args.repeat, args.max_seconds).run(args.only)
+            finally:
+                # Ghi nốt tiến độ đang đệm rồi bỏ bản sao đã bị các phép đo ghi vào
+                progress_buffer = get_progress_buffer(run_path, create=False)
+                if progress_buffer:
+                    progress_buffer.close()
+                DatabaseManager(run_path).close_connections()
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+            group_name = f'scale={scale}'
+            report['groups'][group_name] = {
+                'info': {
+                    'counts': dataset.counts(),
+                    'build_seconds': build_seconds,
+                    'database_mb': os.path.getsize(db_path) / (1024 * 1024)
+                },
+                'results': results
+            }
+            print_results(group_name, results)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    write_report(report, args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
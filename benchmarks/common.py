@@ -0,0 +1,126 @@
+"""
+Các hàm dùng chung cho benchmark: đo thời gian, thông tin môi trường, ghi báo cáo JSON
+
+Báo cáo có dạng:
+    {
+        "benchmark": "models",
+        "meta": {...thông tin máy, phiên bản...},
+        "groups": {
+            "<nhóm, ví dụ scale=1000>": {
+                "info": {...},
+                "results": {"<tên phép đo>": {"median_ms": ..., ...}}
+            }
+        }
+    }
+nên hai lần chạy (trước/sau khi sửa code) có thể so sánh bằng benchmarks.compare.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize_timings(timings):
+    """Thống kê các lần đo (giây) thành mili giây"""
+    ordered = sorted(timings)
+    p95_index = min(len(ordered) - 1, max(0, round(len(ordered) * 0.95) - 1))
+    mean = statistics.fmean(ordered)
+    return {
+        'runs': len(ordered),
+        'mean_ms': mean * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[p95_index] * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'ops_per_sec': 1 / mean if mean else None
+    }
+
+def measure(func, repeat=100, warmup=3, max_seconds=2.0, min_runs=5, setup=None):
+    """Đo thời gian chạy func nhiều lần
+
+    Dừng sớm khi tổng thời gian vượt max_seconds (nhưng chạy ít nhất min_runs
+    lần) để các phép đo chậm ở dữ liệu lớn không kéo dài cả bộ benchmark.
+    setup() (nếu có) chạy trước mỗi lần đo và không được tính thời gian.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat:
+        if setup:
+            setup()
+        run_started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - run_started)
+        if len(timings) >= min_runs and time.perf_counter() - started > max_seconds:
+            break
+    return summarize_timings(timings)
+
+def get_git_revision():
+    """Commit hiện tại của project (None nếu không phải git repo)"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, timeout=10
+        )
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if revision.returncode != 0:
+        return None
+    return revision.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+def environment_info(**extra):
+    """Thông tin môi trường chạy benchmark, lưu kèm kết quả để so sánh đúng"""
+    info = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'argv': sys.argv[1:]
+    }
+    info.update(extra)
+    return info
+
+def write_report(report, output_path=None):
+    """Ghi báo cáo JSON ra file (hoặc stdout nếu không có output_path)"""
+    content = json.dumps(report, ensure_ascii=False, indent=2)
+    if not output_path:
+        print(content)
+        return
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        file.write(content + '\n')
+    print(f"Đã ghi kết quả: {output_path}", file=sys.stderr)
+
+def print_results(group_name, results, columns=('median_ms', 'p95_ms', 'runs')):
+    """In bảng kết quả của một nhóm ra stderr để theo dõi khi đang chạy"""
+    print(f"\n[{group_name}]", file=sys.stderr)
+    name_width = max((len(name) for name in results), default=10)
+    widths = [max(14, len(column) + 2) for column in columns]
+    print(f"  {'':<{name_width}}  " + ''.join(f'{column:>{width}}' for column, width in zip(columns, widths)),
+          file=sys.stderr)
+    for name, stats in results.items():
+        values = ''.join(
+            f'{stats[column]:>{width}.3f}' if isinstance(stats.get(column), float)
+            else f'{str(stats.get(column, "-")):>{width}}'
+            for column, width in zip(columns, widths)
+        )
+        print(f"  {name:<{name_width}}  {values}", file=sys.stderr)
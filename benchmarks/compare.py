@@ -0,0 +1,83 @@
+"""
+So sánh hai báo cáo benchmark JSON (ví dụ trước và sau một thay đổi)
+
+Ví dụ:
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.compare before.json after.json --metric p95_ms --threshold 15 --fail-on-regression
+"""
+import sys
+import json
+import argparse
+
+def load_report(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def compare_reports(old_report, new_report, metric='median_ms', threshold_percent=10.0):
+    """So sánh các phép đo có trong cả hai báo cáo
+
+    Returns:
+        list: Các dict (group, name, old, new, change_percent, status), status là
+              'regression' / 'improvement' / 'same' theo ngưỡng threshold_percent
+    """
+    rows = []
+    old_groups = old_report.get('groups', {})
+    for group_name, new_group in new_report.get('groups', {}).items():
+        old_results = old_groups.get(group_name, {}).get('results', {})
+        for name, new_stats in new_group.get('results', {}).items():
+            old_value = old_results.get(name, {}).get(metric)
+            new_value = new_stats.get(metric)
+            if not isinstance(old_value, (int, float)) or not isinstance(new_value, (int, float)):
+                continue
+
+            change_percent = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            if change_percent > threshold_percent:
+                status = 'regression'
+            elif change_percent < -threshold_percent:
+                status = 'improvement'
+            else:
+                status = 'same'
+            rows.append({
+                'group': group_name,
+                'name': name,
+                'old': old_value,
+                'new': new_value,
+                'change_percent': change_percent,
+                'status': status
+            })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='So sánh hai báo cáo benchmark')
+    parser.add_argument('old', help='Báo cáo trước khi thay đổi')
+    parser.add_argument('new', help='Báo cáo sau khi thay đổi')
+    parser.add_argument('--metric', default='median_ms', help='Chỉ số so sánh (mặc định median_ms, càng nhỏ càng tốt)')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Ngưỡng thay đổi (%%) để tính là chậm đi/nhanh lên')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Trả về mã lỗi 1 nếu có phép đo chậm đi')
+    args = parser.parse_args(argv)
+
+    old_report, new_report = load_report(args.old), load_report(args.new)
+    rows = compare_reports(old_report, new_report, args.metric, args.threshold)
+    if not rows:
+        print(f"Không có phép đo chung nào có chỉ số {args.metric}")
+        return 0
+
+    old_meta, new_meta = old_report.get('meta', {}), new_report.get('meta', {})
+    print(f"{args.metric}: {old_meta.get('git_revision')} -> {new_meta.get('git_revision')} (ngưỡng {args.threshold:g}%)")
+    name_width = max(len(row['name']) for row in rows)
+    current_group = None
+    for row in rows:
+        if row['group'] != current_group:
+            current_group = row['group']
+            print(f"\n[{current_group}]")
+        marker = {'regression': '  CHẬM HƠN', 'improvement': '  nhanh hơn', 'same': ''}[row['status']]
+        print(f"  {row['name']:<{name_width}}  {row['old']:>12.3f}  {row['new']:>12.3f}  "
+              f"{row['change_percent']:>+8.1f}%{marker}")
+
+    regressions = sum(1 for row in rows if row['status'] == 'regression')
+    improvements = sum(1 for row in rows if row['status'] == 'improvement')
+    print(f"\n{len(rows)} phép đo: {regressions} chậm hơn, {improvements} nhanh hơn")
+    return 1 if args.fail_on_regression and regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
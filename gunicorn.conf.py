@@ -0,0 +1,79 @@
+"""
+Cấu hình gunicorn cho môi trường production
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- App được tạo và nạp sẵn cache một lần trong master (preload_app), các
+  worker fork sau đó dùng chung bộ nhớ này theo copy-on-write.
+- Worker được thay mới sau GUNICORN_MAX_REQUESTS request (có jitter để các
+  worker không khởi động lại cùng lúc) hoặc khi bộ nhớ riêng của worker vượt
+  GUNICORN_MAX_WORKER_MEMORY_MB.
+- Khi tắt hoặc thay worker, request đang xử lý được chờ tối đa
+  graceful_timeout giây và tiến độ đọc đang đệm được ghi xuống database.
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+preload_app = True
+
+# Thay worker định kỳ để giới hạn phân mảnh bộ nhớ và rò rỉ tích lũy
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 1000)
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER') or 100)
+max_worker_memory_mb = int(os.environ.get('GUNICORN_MAX_WORKER_MEMORY_MB') or 512)
+
+timeout = 120  # Mở sách PDF lớn lần đầu có thể mất nhiều thời gian
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+def get_private_memory_mb():
+    """Bộ nhớ riêng của process (MB), không tính các trang dùng chung với master"""
+    try:
+        private_kb = 0
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    private_kb += int(line.split()[1])
+        return private_kb / 1024
+    except (OSError, ValueError):
+        # Không phải Linux: dùng RSS cao nhất (tính cả bộ nhớ dùng chung)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def post_worker_init(worker):
+    """Áp dụng số thread của worker cho giới hạn việc nặng của view async (kể cả khi đặt
+    bằng --threads); worker đầu tiên chạy các việc nền khi khởi động (không chạy trong
+    master trước khi fork)"""
+    from app.config import Config
+    Config.SERVER_THREADS = worker.cfg.threads
+    
+    if worker.age == 1:
+        from app import start_background_jobs
+        start_background_jobs(worker.wsgi)
+
+def pre_request(worker, req):
+    """Thay worker khi vượt giới hạn bộ nhớ: xử lý xong request này rồi thoát
+    
+    Kiểm tra trước khi xử lý để gunicorn đóng kết nối keep-alive của response
+    này, client không gửi request tiếp theo tới worker sắp thoát.
+    """
+    if not max_worker_memory_mb or not worker.alive:
+        return
+    memory_mb = get_private_memory_mb()
+    if memory_mb > max_worker_memory_mb:
+        worker.log.info(
+            "Worker %s dùng %.0fMB bộ nhớ riêng (giới hạn %sMB), khởi động lại",
+            worker.pid, memory_mb, max_worker_memory_mb
+        )
+        worker.alive = False
+
+def worker_exit(server, worker):
+    """Ghi nốt tiến độ đọc đang đệm trước khi worker thoát"""
+    from app.models import flush_progress_buffers
+    flush_progress_buffers()
@@ -0,0 +1,335 @@
+"""
+Script nhập hàng loạt sách từ một thư mục hoặc file manifest (CSV/JSONL)
+
+Metadata và nội dung sách (PDF/EPUB/TXT) được trích xuất song song trên nhiều
+process, sau đó ghi vào database theo từng lô lớn, mỗi lô một transaction.
+Có thể chạy lại sau khi bị ngắt giữa chừng: file có mã băm SHA-256 nội dung
+trùng với sách đã có trong database sẽ được bỏ qua.
+
+Manifest CSV cần cột path, các cột title, author, publisher, description,
+publication_year, genres (phân cách bằng dấu ;) là tùy chọn và được ưu tiên
+hơn metadata đọc từ file. Manifest JSONL dùng các khóa tương tự, genres có thể
+là danh sách. Đường dẫn tương đối được tính từ thư mục chứa manifest.
+
+Ví dụ:
+    python import_books.py /data/books --workers 8
+    python import_books.py manifest.csv --copy --genre "Văn học"
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from app.config import Config
+from app.models import DatabaseManager, BookModel, UnitOfWork
+from app.utils import FileProcessor, BookContentReader, BookMetadataExtractor, CoverImageProcessor, book_content_cache
+
+MANIFEST_FIELDS = ('title', 'author', 'publisher', 'description', 'publication_year', 'genres')
+
+# Mã băm các sách đã có trong database, được gửi sang mỗi worker một lần khi khởi tạo
+_known_hashes = frozenset()
+
+def _init_worker(known_hashes):
+    """Khởi tạo worker process"""
+    global _known_hashes
+    _known_hashes = known_hashes
+    # Đã song song theo từng file nên không mở thêm process con để đọc PDF lớn
+    Config.PDF_EXTRACT_WORKERS = 1
+
+def extract_book(task):
+    """Tính mã băm, đọc metadata, thông số và ảnh bìa của một file sách (chạy trong worker)
+    
+    Returns:
+        dict: Thông tin sách, hoặc có khóa 'skipped' (đã nhập) / 'error' (lỗi)
+    """
+    source_path = task['path']
+    result = {'path': source_path, 'size': 0}
+    file_path = source_path
+    copied = False
+    try:
+        result['size'] = os.path.getsize(source_path)
+        content_hash = FileProcessor.compute_file_hash(source_path)
+        result['content_hash'] = content_hash
+        if content_hash in _known_hashes:
+            result['skipped'] = True
+            return result
+        
+        if task['copy_to']:
+            # Đặt tên theo mã băm nên không ghi đè file khác trùng tên
+            file_extension = os.path.splitext(source_path)[1].lower()
+            file_path = os.path.join(task['copy_to'], content_hash + file_extension)
+            if not os.path.exists(file_path):
+                temp_path = f"{file_path}.{os.getpid()}.tmp"
+                shutil.copyfile(source_path, temp_path)
+                os.replace(temp_path, file_path)
+                copied = True
+        else:
+            file_path = os.path.abspath(source_path)
+        
+        metadata = BookMetadataExtractor.extract(file_path, os.path.basename(source_path))
+        metadata.update({field: value for field, value in task['metadata'].items() if value})
+        stats = BookContentReader.get_book_statistics(file_path)
+        
+        # srcset None: để CoverService tạo sau (khi chưa cài Pillow), rỗng: không có ảnh bìa
+        result['cover_image_url'], result['cover_srcset'] = None, None
+        if CoverImageProcessor.is_available():
+            result['cover_srcset'] = ''
+            cover_data = CoverImageProcessor.extract_cover(file_path)
+            if cover_data:
+                try:
+                    result['cover_image_url'], result['cover_srcset'] = \
+                        CoverImageProcessor.create_thumbnails(cover_data)
+                except Exception:
+                    pass  # Ảnh bìa hỏng không làm hỏng việc nhập sách
+        
+        result.update(metadata)
+        result.update(stats)
+        result['file_path'] = file_path
+        result['reading_time_minutes'] = math.ceil(stats['word_count'] / Config.READING_WORDS_PER_MINUTE)
+        return result
+    except Exception as e:
+        if copied:
+            os.remove(file_path)
+        result['error'] = str(e)
+        return result
+    finally:
+        # Mỗi file chỉ đọc một lần, không giữ nội dung trong cache của worker
+        if os.path.exists(file_path):
+            book_content_cache.invalidate(file_path)
+
+def _parse_genres(value):
+    """Chuyển cột genres của manifest thành danh sách tên thể loại"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    return [str(name).strip() for name in value if str(name).strip()]
+
+def _parse_year(value):
+    """Chuyển năm xuất bản trong manifest sang int (None nếu không hợp lệ)"""
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _manifest_task(entry, base_dir):
+    """Tạo task từ một dòng manifest"""
+    path = (entry.get('path') or '').strip()
+    if not path:
+        raise ValueError("Dòng manifest thiếu cột path")
+    
+    metadata = {field: entry.get(field) for field in MANIFEST_FIELDS}
+    metadata['genres'] = _parse_genres(metadata['genres'])
+    metadata['publication_year'] = _parse_year(metadata['publication_year'])
+    for field in ('title', 'author', 'publisher', 'description'):
+        if isinstance(metadata[field], str):
+            metadata[field] = metadata[field].strip()
+    return {'path': os.path.join(base_dir, path), 'metadata': metadata}
+
+def collect_tasks(source):
+    """Liệt kê các file cần nhập từ thư mục hoặc manifest"""
+    if os.path.isdir(source):
+        tasks = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if FileProcessor.is_allowed_file(filename):
+                    tasks.append({'path': os.path.join(root, filename), 'metadata': {}})
+        return tasks
+    
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8-sig', newline='') as manifest:
+        if source.lower().endswith('.jsonl'):
+            entries = (json.loads(line) for line in manifest if line.strip())
+            return [_manifest_task(entry, base_dir) for entry in entries]
+        if source.lower().endswith('.csv'):
+            return [_manifest_task(entry, base_dir) for entry in csv.DictReader(manifest)]
+    raise ValueError("Nguồn phải là thư mục, file .csv hoặc .jsonl")
+
+def write_batch(db, records, extra_genres):
+    """Ghi một lô sách trong một transaction, trả về số sách đã ghi"""
+    written = 0
+    with UnitOfWork(db) as uow:
+        for record in records:
+            # Sách cùng nội dung có thể vừa được upload trong lúc đang nhập
+            if uow.get_book_by_content_hash(record['content_hash']):
+                continue
+            book_id = uow.create_book(
+                record['title'],
+                uow.get_or_create_author(record['author']),
+                uow.get_or_create_publisher(record['publisher']),
+                record['description'] or '',
+                record['file_path'],
+                record['publication_year'],
+                content_hash=record['content_hash']
+            )
+            uow.save_ingestion_result(
+                book_id, record['page_count'], record['word_count'],
+                record['char_count'], record['reading_time_minutes']
+            )
+            if record['cover_srcset'] is not None:
+                uow.set_book_cover(book_id, record['cover_image_url'], record['cover_srcset'])
+            genre_ids = uow.get_or_create_genres(record['genres'] + extra_genres)
+            if genre_ids:
+                uow.link_book_genres(book_id, genre_ids)
+            written += 1
+    return written
+
+class ImportProgress:
+    """Đếm số file đã xử lý và in tiến độ, tốc độ định kỳ"""
+    
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.last_report = self.started_at
+        self.processed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_read = 0
+    
+    def add(self, result):
+        self.processed += 1
+        self.bytes_read += result['size']
+    
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        
+        elapsed = max(now - self.started_at, 1e-6)
+        files_per_second = self.processed / elapsed
+        remaining = self.total - self.processed
+        eta = f"{remaining / files_per_second / 60:.1f} phút" if files_per_second > 0 else '?'
+        percent = self.processed / self.total * 100 if self.total else 100
+        print(
+            f"[{self.processed}/{self.total}] {percent:.1f}% | nhập {self.imported}, "
+            f"bỏ qua {self.skipped}, lỗi {self.failed} | {files_per_second:.1f} file/s, "
+            f"{self.bytes_read / elapsed / (1024 * 1024):.1f} MB/s | còn lại ~{eta}",
+            flush=True
+        )
+    
+    def summary(self):
+        elapsed = time.monotonic() - self.started_at
+        print(
+            f"Hoàn tất trong {elapsed:.1f} giây: nhập {self.imported}, bỏ qua {self.skipped}, "
+            f"lỗi {self.failed} / {self.total} file ({self.bytes_read / (1024 * 1024):.1f} MB)",
+            flush=True
+        )
+
+def import_books(source, workers=None, batch_size=500, copy=False, extra_genres=None,
+                 database_path=None, progress_interval=5.0):
+    """Nhập toàn bộ sách từ nguồn, trả về đối tượng ImportProgress"""
+    db = DatabaseManager(database_path)
+    db.init_database()
+    
+    tasks = collect_tasks(source)
+    copy_to = None
+    if copy:
+        copy_to = Config.UPLOAD_FOLDER
+        os.makedirs(copy_to, exist_ok=True)
+    os.makedirs(Config.EXTRACTED_TEXT_FOLDER, exist_ok=True)
+    
+    seen_hashes = BookModel(db).get_content_hashes()
+    progress = ImportProgress(len(tasks), progress_interval)
+    extra_genres = list(extra_genres or [])
+    workers = workers or os.cpu_count() or 1
+    print(f"Tìm thấy {len(tasks)} file, {len(seen_hashes)} sách đã có trong database", flush=True)
+    
+    pending_records = []
+    
+    def flush():
+        if pending_records:
+            written = write_batch(db, pending_records, extra_genres)
+            progress.imported += written
+            progress.skipped += len(pending_records) - written
+            pending_records.clear()
+    
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(frozenset(seen_hashes),))
+    try:
+        task_iter = iter(tasks)
+        in_flight = set()
+        # Giới hạn số task đang chờ để bộ nhớ không tăng theo số file
+        max_in_flight = workers * 4
+        while True:
+            for task in task_iter:
+                task['copy_to'] = copy_to
+                in_flight.add(executor.submit(extract_book, task))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                progress.add(result)
+                if result.get('error'):
+                    progress.failed += 1
+                    print(f"Lỗi: {result['path']}: {result['error']}", file=sys.stderr, flush=True)
+                elif result.get('skipped') or result['content_hash'] in seen_hashes:
+                    # Đã nhập ở lần chạy trước hoặc trùng nội dung với file khác trong lần này
+                    progress.skipped += 1
+                else:
+                    seen_hashes.add(result['content_hash'])
+                    pending_records.append(result)
+            
+            if len(pending_records) >= batch_size:
+                flush()
+            progress.report()
+        
+        flush()
+    except KeyboardInterrupt:
+        # Lưu những sách đã xử lý xong để lần chạy sau không phải làm lại
+        print("Đã dừng, đang lưu các sách đã xử lý...", file=sys.stderr, flush=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+        flush()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        progress.report(force=True)
+    
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhập hàng loạt sách vào thư viện")
+    parser.add_argument('source', help="Thư mục chứa sách hoặc file manifest .csv/.jsonl")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Số process trích xuất (mặc định: số CPU)")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="Số sách ghi trong mỗi transaction (mặc định: 500)")
+    parser.add_argument('--copy', action='store_true',
+                        help="Sao chép file vào thư mục upload thay vì dùng đường dẫn gốc")
+    parser.add_argument('--genre', action='append', default=[],
+                        help="Thể loại gán thêm cho mọi sách (có thể lặp lại)")
+    parser.add_argument('--database', default=None,
+                        help="Đường dẫn database (mặc định: Config.DATABASE_PATH)")
+    parser.add_argument('--progress-interval', type=float, default=5.0,
+                        help="Số giây giữa các lần in tiến độ (mặc định: 5)")
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.source):
+        parser.error(f"Không tìm thấy {args.source}")
+    
+    try:
+        progress = import_books(
+            args.source, workers=args.workers, batch_size=args.batch_size, copy=args.copy,
+            extra_genres=args.genre, database_path=args.database,
+            progress_interval=args.progress_interval
+        )
+    except KeyboardInterrupt:
+        return 130
+    
+    progress.summary()
+    return 1 if progress.failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
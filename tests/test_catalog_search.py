@@ -0,0 +1,135 @@
+"""
+Kiểm tra tìm kiếm danh mục (FTS5, không phân biệt dấu) và phân trang keyset theo cursor
+"""
+import os
+import tempfile
+import unittest
+
+from app.models import BookModel, DatabaseManager, NoteModel, UnitOfWork, UserLibraryModel
+
+class CatalogSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.temp_dir.name, 'library.db'))
+        self.db.init_database()
+        self.book_model = BookModel(self.db)
+
+        conn = self.db.get_connection()
+        conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('an', 'an@x.vn', 'x')")
+        conn.commit()
+        conn.close()
+        self.user_id = 1
+
+    def tearDown(self):
+        self.db.close_connections()
+        self.temp_dir.cleanup()
+
+    def create_books(self, books):
+        """Tạo sách qua UnitOfWork (chỉ mục danh mục được cập nhật lúc commit)"""
+        book_ids = []
+        with UnitOfWork(self.db) as uow:
+            for title, author_name, genres in books:
+                book_id = uow.create_book(title, uow.get_or_create_author(author_name), None, '', f'{title}.txt')
+                uow.link_book_genres(book_id, uow.get_or_create_genres(genres))
+                uow.add_to_library(self.user_id, book_id)
+                book_ids.append(book_id)
+        return book_ids
+
+    def collect_pages(self, fetch_page):
+        """Duyệt hết các trang theo cursor, trả về id theo thứ tự và số trang"""
+        ids, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = fetch_page(cursor)
+            ids.extend(rows)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+
+    def search_ids(self, query, genre=None):
+        books, total, _ = self.book_model.search_books(query, genre=genre, per_page=50)
+        self.assertEqual(total, len(books))
+        return [book['book_id'] for book in books]
+
+    def test_search_ignores_case_and_diacritics(self):
+        kieu, so_do, de_men = self.create_books([
+            ('Truyện Kiều', 'Nguyễn Du', ['Thơ']),
+            ('Số Đỏ', 'Vũ Trọng Phụng', ['Tiểu thuyết']),
+            ('Dế Mèn phiêu lưu ký', 'Tô Hoài', ['Thiếu nhi']),
+        ])
+
+        self.assertEqual(self.search_ids('truyen kieu'), [kieu])
+        self.assertEqual(self.search_ids('TRUYỆN KIỀU'), [kieu])
+        self.assertEqual(self.search_ids('so do'), [so_do])
+        self.assertEqual(self.search_ids('nguyen du'), [kieu])
+        # Từ cuối được tìm theo tiền tố
+        self.assertEqual(self.search_ids('de men phieu'), [de_men])
+        self.assertEqual(self.search_ids('thieu nhi'), [de_men])
+        self.assertEqual(self.search_ids('"kieu truyen"'), [])
+        self.assertEqual(self.search_ids('truyen', genre='Tiểu thuyết'), [])
+        self.assertEqual(self.search_ids('!!!'), [])
+
+    def test_search_index_follows_updates(self):
+        book_id, = self.create_books([('Tắt đèn', 'Ngô Tất Tố', [])])
+        with UnitOfWork(self.db) as uow:
+            uow.link_book_genres(book_id, uow.get_or_create_genres(['Hiện thực']))
+        self.assertEqual(self.search_ids('hien thuc'), [book_id])
+
+    def test_search_cursor_visits_every_match_once(self):
+        book_ids = self.create_books([(f'Sách mẫu {index}', 'Tác giả', []) for index in range(23)])
+        self.create_books([('Không liên quan', 'Khác', [])])
+
+        def fetch_page(cursor):
+            books, total, next_cursor = self.book_model.search_books('sach mau', per_page=5, cursor=cursor)
+            self.assertEqual(total, 23)
+            return [book['book_id'] for book in books], next_cursor
+
+        ids, pages = self.collect_pages(fetch_page)
+        self.assertEqual(sorted(ids), book_ids)
+        self.assertEqual(pages, 5)
+
+    def test_listing_cursor_is_stable_when_books_are_added(self):
+        book_ids = self.create_books([(f'Sách {index}', 'Tác giả', []) for index in range(12)])
+
+        first_page, _, cursor = self.book_model.search_books(per_page=5)
+        # Mới nhất trước; thêm sách trong lúc xem không làm lặp hay sót sách ở trang sau
+        self.create_books([('Sách mới', 'Tác giả', [])])
+        seen = [book['book_id'] for book in first_page]
+        while cursor:
+            books, _, cursor = self.book_model.search_books(per_page=5, cursor=cursor)
+            seen.extend(book['book_id'] for book in books)
+
+        self.assertEqual(seen, sorted(book_ids, reverse=True))
+
+    def test_invalid_cursor_returns_first_page(self):
+        self.create_books([(f'Sách {index}', 'Tác giả', []) for index in range(3)])
+        first_page, _, _ = self.book_model.search_books(per_page=2)
+        for cursor in ('không-hợp-lệ', 'WzFd', ''):
+            books, _, _ = self.book_model.search_books(per_page=2, cursor=cursor)
+            self.assertEqual([book['book_id'] for book in books], [book['book_id'] for book in first_page])
+
+    def test_library_and_notes_cursors(self):
+        book_ids = self.create_books([(f'Sách {index}', 'Tác giả', []) for index in range(7)])
+        user_library = UserLibraryModel(self.db)
+
+        def fetch_library(cursor):
+            books, next_cursor = user_library.get_user_books(self.user_id, limit=3, cursor=cursor)
+            return [book['book_id'] for book in books], next_cursor
+
+        ids, pages = self.collect_pages(fetch_library)
+        self.assertEqual(ids, sorted(book_ids, reverse=True))
+        self.assertEqual(pages, 3)
+
+        note_model = NoteModel(self.db)
+        note_ids = [note_model.create_note(self.user_id, book_ids[0], f'Ghi chú {index}') for index in range(8)]
+
+        def fetch_notes(cursor):
+            notes, next_cursor = note_model.get_book_notes(self.user_id, book_ids[0], limit=3, cursor=cursor)
+            return [note['note_id'] for note in notes], next_cursor
+
+        ids, pages = self.collect_pages(fetch_notes)
+        self.assertEqual(ids, sorted(note_ids, reverse=True))
+        self.assertEqual(pages, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Kiểm tra upload nhiều phần: gửi lại phần lỗi, xem tiến độ và hoàn tất sau khi mất kết nối
+"""
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.config import Config
+from app.models import BookModel, DatabaseManager, UserLibraryModel
+from app.services import IngestionService, UploadService
+from app.utils import ChunkedUploadStore
+
+CHUNK_SIZE = 32
+BOOK_CONTENT = ('Trăm năm trong cõi người ta,\nChữ tài chữ mệnh khéo là ghét nhau.\n'
+                'Trải qua một cuộc bể dâu,\n').encode('utf-8')
+
+class ChunkedUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sessions_folder = os.path.join(self.temp_dir.name, 'sessions')
+        self.upload_folder = os.path.join(self.temp_dir.name, 'uploads')
+        self.db = DatabaseManager(os.path.join(self.temp_dir.name, 'library.db'))
+        self.db.init_database()
+
+        conn = self.db.get_connection()
+        conn.executemany(
+            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+            [('an', 'an@x.vn', 'x'), ('binh', 'binh@x.vn', 'x')]
+        )
+        conn.commit()
+        conn.close()
+
+        patches = [
+            mock.patch.object(Config, 'UPLOAD_CHUNK_SIZE', CHUNK_SIZE),
+            mock.patch.object(Config, 'UPLOAD_FOLDER', self.upload_folder),
+            mock.patch.object(IngestionService, 'enqueue')
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.service = self.make_service()
+
+    def tearDown(self):
+        self.db.close_connections()
+        self.temp_dir.cleanup()
+
+    def make_service(self):
+        return UploadService(self.db, ChunkedUploadStore(self.sessions_folder))
+
+    def chunk(self, chunk_index, content=BOOK_CONTENT):
+        return io.BytesIO(content[chunk_index * CHUNK_SIZE:(chunk_index + 1) * CHUNK_SIZE])
+
+    def start(self, user_id=1, filename='kieu.txt', content=BOOK_CONTENT):
+        upload, error = self.service.start_upload(user_id, filename, len(content))
+        self.assertIsNone(error)
+        return upload
+
+    def test_resume_after_interrupted_chunk(self):
+        upload = self.start()
+        upload_id = upload['upload_id']
+        self.assertEqual(upload['chunk_count'], 4)
+        self.assertEqual(upload['received_chunks'], [])
+
+        # Phần đầu tiên phải được gửi trước để kiểm tra định dạng
+        result, error = self.service.save_chunk(1, upload_id, 1, self.chunk(1))
+        self.assertIsNone(result)
+        self.assertIsNotNone(error)
+
+        for chunk_index in (0, 1, 3):
+            result, error = self.service.save_chunk(1, upload_id, chunk_index, self.chunk(chunk_index))
+            self.assertIsNone(error)
+
+        # Mất kết nối giữa chừng: phần bị cắt không được tính là đã nhận
+        truncated = io.BytesIO(self.chunk(2).read()[:10])
+        result, error = self.service.save_chunk(1, upload_id, 2, truncated)
+        self.assertIsNone(result)
+        self.assertIn('10 byte', error)
+
+        result, error = self.service.complete_upload(1, upload_id, 'Truyện Kiều', 'Nguyễn Du')
+        self.assertIsNone(result)
+        self.assertIn('1 phần', error)
+
+        # Process khác (worker khác) đọc lại được phiên upload từ đĩa
+        self.service = self.make_service()
+        status, error = self.service.get_upload_status(1, upload_id)
+        self.assertIsNone(error)
+        self.assertEqual(status['received_chunks'], [0, 1, 3])
+        self.assertEqual(status['received_ranges'], [[0, 64], [96, len(BOOK_CONTENT)]])
+        self.assertEqual(status['received_bytes'], len(BOOK_CONTENT) - CHUNK_SIZE)
+        self.assertFalse(status['complete'])
+
+        result, error = self.service.save_chunk(1, upload_id, 2, self.chunk(2))
+        self.assertIsNone(error)
+        self.assertTrue(result['complete'])
+
+        book_id, error = self.service.complete_upload(1, upload_id, 'Truyện Kiều', 'Nguyễn Du')
+        self.assertIsNone(error)
+        book = BookModel(self.db).get_book_by_id(book_id)
+        with open(book['file_path'], 'rb') as file:
+            self.assertEqual(file.read(), BOOK_CONTENT)
+        self.assertIsNotNone(UserLibraryModel(self.db).get_user_book(1, book_id))
+
+        # Phiên upload được xóa sau khi hoàn tất
+        self.assertEqual(self.service.get_upload_status(1, upload_id)[0], None)
+        self.assertEqual(os.listdir(self.sessions_folder), [])
+
+    def test_session_belongs_to_its_user(self):
+        upload_id = self.start()['upload_id']
+        self.assertIsNone(self.service.get_upload_status(2, upload_id)[0])
+        self.assertIsNone(self.service.save_chunk(2, upload_id, 0, self.chunk(0))[0])
+        self.assertIsNone(self.service.complete_upload(2, upload_id, 'Truyện Kiều', 'Nguyễn Du')[0])
+        self.assertIsNone(self.service.get_upload_status(1, '../' + upload_id)[0])
+
+    def test_invalid_first_chunk_discards_session(self):
+        content = b'\x00\x01binary' * 8
+        upload_id = self.start(content=content)['upload_id']
+
+        result, error = self.service.save_chunk(1, upload_id, 0, self.chunk(0, content))
+        self.assertIsNone(result)
+        self.assertIsNotNone(error)
+        self.assertIsNone(self.service.get_upload_status(1, upload_id)[0])
+
+    def test_start_rejects_invalid_uploads(self):
+        for filename, total_size in (('kieu.exe', 10), ('kieu.txt', 0), ('kieu.txt', '10'),
+                                     ('kieu.txt', Config.MAX_CONTENT_LENGTH + 1)):
+            upload, error = self.service.start_upload(1, filename, total_size)
+            self.assertIsNone(upload)
+            self.assertIsNotNone(error)
+
+if __name__ == '__main__':
+    unittest.main()
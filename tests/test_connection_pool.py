@@ -0,0 +1,117 @@
+"""
+Kiểm tra ConnectionPool: dùng lại kết nối, giới hạn số kết nối, chờ và hết thời gian chờ
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.config import Config
+from app.models import ConnectionPool, DatabaseManager, UserLibraryModel
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'library.db')
+        DatabaseManager(self.db_path).init_database()
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close_all()
+        DatabaseManager(self.db_path).close_connections()
+        self.temp_dir.cleanup()
+
+    def make_pool(self, max_size, timeout):
+        pool = ConnectionPool(self.db_path, max_size=max_size, timeout=timeout)
+        self.pools.append(pool)
+        return pool
+
+    def test_closed_connection_is_reused(self):
+        pool = self.make_pool(2, 1.0)
+        conn = pool.acquire()
+        conn.close()
+        # close() lặp lại không trả kết nối về pool lần nữa
+        conn.close()
+        self.assertIs(pool.acquire(), conn)
+
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['idle'], 0)
+
+    def test_release_rolls_back_open_transaction(self):
+        pool = self.make_pool(1, 1.0)
+        conn = pool.acquire()
+        conn.execute("INSERT INTO genres (genre_name) VALUES ('Thơ')")
+        conn.close()
+
+        conn = pool.acquire()
+        try:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM genres').fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        pool = self.make_pool(2, 0.2)
+        held = [pool.acquire(), pool.acquire()]
+
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pool.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(pool.stats()['size'], 2)
+
+        for conn in held:
+            conn.close()
+
+    def test_waiting_checkout_gets_released_connection(self):
+        pool = self.make_pool(1, 5.0)
+        conn = pool.acquire()
+        acquired = []
+
+        def wait_for_connection():
+            other = pool.acquire()
+            acquired.append(other)
+            other.close()
+
+        thread = threading.Thread(target=wait_for_connection)
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(acquired, [])
+        conn.close()
+        thread.join(5)
+
+        self.assertEqual(acquired, [conn])
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_toggle_favorite_uses_a_single_connection(self):
+        # Pool một kết nối: mượn lồng nhau sẽ tự chờ chính mình tới khi hết thời gian
+        with mock.patch.object(Config, 'DATABASE_POOL_SIZE', 1), \
+                mock.patch.object(Config, 'DATABASE_POOL_TIMEOUT', 0.5):
+            db = DatabaseManager(os.path.join(self.temp_dir.name, 'single.db'))
+            db.init_database()
+            try:
+                conn = db.get_connection()
+                conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('an', 'an@x.vn', 'x')")
+                conn.execute("INSERT INTO books (title) VALUES ('Truyện Kiều')")
+                conn.execute('INSERT INTO user_library (user_id, book_id) VALUES (1, 1)')
+                conn.commit()
+                conn.close()
+
+                user_library = UserLibraryModel(db)
+                self.assertTrue(user_library.toggle_favorite(1, 1))
+                self.assertFalse(user_library.toggle_favorite(1, 1))
+                self.assertFalse(user_library.toggle_favorite(1, 2))
+                self.assertEqual(db.get_pool_stats()['timeouts'], 0)
+            finally:
+                db.close_connections()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Kiểm tra MappedTextFile: số ký tự và nội dung đọc qua chỉ mục phải khớp với giải mã cả file
+"""
+import os
+import tempfile
+import unittest
+
+from app.utils import MappedTextFile
+
+class MappedTextFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, data):
+        file_path = os.path.join(self.temp_dir.name, 'book.txt')
+        with open(file_path, 'wb') as file:
+            file.write(data)
+        return file_path
+
+    def assert_matches_full_decode(self, data, encoding='utf-8'):
+        text_file = MappedTextFile(self.write_file(data))
+        expected = data.decode(encoding, errors='replace')
+        if expected.startswith('\ufeff'):
+            expected = expected[1:]
+        expected = expected.replace('\r\n', '\n')
+
+        self.assertEqual(text_file.encoding, encoding)
+        self.assertEqual(text_file.char_count, len(expected))
+        self.assertEqual(text_file.read_all(), expected)
+        # Đọc từng khoảng cắt ngang các dòng cũng phải khớp
+        for start in range(0, len(expected), 997):
+            self.assertEqual(text_file.read_chars(start, start + 1500), expected[start:start + 1500])
+        return text_file
+
+    def test_invalid_bytes_after_encoding_sample(self):
+        # Đoạn đầu (lớn hơn mẫu nhận diện 64KB) là UTF-8 hợp lệ, phía sau lẫn byte cp1252
+        valid = ''.join(f'Dòng tiếng Việt số {index}\n' for index in range(4000)).encode('utf-8')
+        self.assertGreater(len(valid), 64 * 1024)
+        invalid = b''.join(b'It\x92s \x93quoted\x94 %d\n' % index for index in range(50))
+        data = valid + invalid + 'Dòng cuối cùng'.encode('utf-8')
+
+        text_file = self.assert_matches_full_decode(data)
+        self.assertTrue(text_file.read_all().endswith('Dòng cuối cùng'))
+
+    def test_bom_and_crlf(self):
+        data = b'\xef\xbb\xbf' + 'Chương một\r\nNội dung\r\n\r\nHết'.encode('utf-8')
+        text_file = self.assert_matches_full_decode(data)
+        self.assertEqual(text_file.get_lines(0), ['Chương một', 'Nội dung', '', 'Hết'])
+
+    def test_fallback_encoding(self):
+        data = 'Café “quoted”\r\nsecond line\n'.encode('cp1252') + b'undefined \x81 byte'
+        self.assert_matches_full_decode(data, encoding='cp1252')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Kiểm tra ReadingProgressBuffer: gộp các lần lưu, ghi theo lô và ghi nốt khi process thoát
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from unittest import mock
+
+from app.config import Config
+from app.models import DatabaseManager, ReadingProgressBuffer, UserLibraryModel, get_progress_buffer
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ReadingProgressBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'library.db')
+        self.db = DatabaseManager(self.db_path)
+        self.db.init_database()
+        self.buffers = []
+
+        conn = self.db.get_connection()
+        conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('an', 'an@x.vn', 'x')")
+        conn.executemany('INSERT INTO books (title) VALUES (?)', [('Truyện Kiều',), ('Số Đỏ',)])
+        conn.executemany('INSERT INTO user_library (user_id, book_id) VALUES (1, ?)', [(1,), (2,)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        for progress_buffer in self.buffers:
+            progress_buffer.close()
+        self.db.close_connections()
+        self.temp_dir.cleanup()
+
+    def make_buffer(self, flush_interval_ms=60000, max_entries=None):
+        progress_buffer = ReadingProgressBuffer(self.db_path, flush_interval_ms, max_entries)
+        self.buffers.append(progress_buffer)
+        return progress_buffer
+
+    def stored_position(self, book_id):
+        conn = self.db.get_connection()
+        try:
+            return conn.execute(
+                'SELECT last_read_position FROM user_library WHERE user_id = 1 AND book_id = ?', (book_id,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_saves_are_coalesced_into_one_flush(self):
+        progress_buffer = self.make_buffer()
+        for position in (100, 200, 300):
+            progress_buffer.put(1, 1, position)
+        progress_buffer.put(1, 2, 50)
+
+        self.assertEqual(progress_buffer.get_pending(1, 1), 300)
+        self.assertEqual(self.stored_position(1), 0)
+
+        self.assertEqual(progress_buffer.flush(), 2)
+        self.assertEqual(progress_buffer.flush(), 0)
+        self.assertEqual((self.stored_position(1), self.stored_position(2)), (300, 50))
+        self.assertIsNone(progress_buffer.get_pending(1, 1))
+
+        stats = progress_buffer.stats()
+        self.assertEqual(
+            (stats['saves'], stats['coalesced'], stats['flushes'], stats['flushed_rows'], stats['pending']),
+            (4, 2, 1, 2, 0)
+        )
+
+    def test_reads_see_pending_position(self):
+        user_library = UserLibraryModel(self.db)
+        with mock.patch.object(Config, 'PROGRESS_WRITE_BEHIND', True):
+            user_library.save_reading_progress(1, 1, 777)
+
+        self.buffers.append(get_progress_buffer(self.db_path, create=False))
+        self.assertEqual(self.stored_position(1), 0)
+        self.assertEqual(user_library.get_user_book(1, 1)['last_read_position'], 777)
+
+        books, _ = user_library.get_user_books(1)
+        positions = {book['book_id']: book['last_read_position'] for book in books}
+        self.assertEqual(positions, {1: 777, 2: 0})
+
+    def test_background_thread_flushes_periodically(self):
+        progress_buffer = self.make_buffer(flush_interval_ms=50)
+        progress_buffer.put(1, 1, 1234)
+
+        deadline = time.monotonic() + 5
+        while self.stored_position(1) != 1234 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.stored_position(1), 1234)
+
+    def test_full_buffer_flushes_early(self):
+        progress_buffer = self.make_buffer(max_entries=2)
+        progress_buffer.put(1, 1, 10)
+        progress_buffer.put(1, 2, 20)
+
+        deadline = time.monotonic() + 5
+        while progress_buffer.stats()['flushes'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual((self.stored_position(1), self.stored_position(2)), (10, 20))
+
+    def test_close_flushes_and_later_saves_write_directly(self):
+        progress_buffer = self.make_buffer()
+        progress_buffer.put(1, 1, 500)
+        progress_buffer.close()
+        self.assertEqual(self.stored_position(1), 500)
+
+        progress_buffer.put(1, 2, 900)
+        self.assertEqual(self.stored_position(2), 900)
+        self.assertEqual(progress_buffer.stats()['pending'], 0)
+
+    def test_pending_positions_are_written_at_exit(self):
+        # Chu kỳ ghi rất dài: chỉ có hàm đăng ký với atexit ghi vị trí xuống database
+        script = textwrap.dedent('''
+            from app.models import DatabaseManager, UserLibraryModel
+            UserLibraryModel(DatabaseManager(%r)).save_reading_progress(1, 2, 4321)
+        ''' % self.db_path)
+        env = dict(os.environ, PROGRESS_WRITE_BEHIND='true', PROGRESS_FLUSH_INTERVAL_MS='600000')
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=PACKAGE_ROOT, env=env,
+            capture_output=True, text=True, timeout=60
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.stored_position(2), 4321)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Kiểm tra SchemaMigrator: nâng cấp database cũ (chưa có schema_migrations) lên phiên bản mới nhất
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app.models import BookModel, DatabaseManager, SchemaMigrator
+
+LATEST_VERSION = SchemaMigrator.MIGRATIONS[-1][0]
+
+class SchemaMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'library.db')
+        self.db = DatabaseManager(self.db_path)
+
+    def tearDown(self):
+        self.db.close_connections()
+        self.temp_dir.cleanup()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_legacy_database(self):
+        """Database của phiên bản đầu tiên: chỉ có các bảng cơ bản, không có schema_migrations"""
+        conn = self.connect()
+        SchemaMigrator.create_base_tables(conn.cursor())
+        conn.executescript('''
+            INSERT INTO users (username, email, password_hash) VALUES ('an', 'an@x.vn', 'x');
+            INSERT INTO authors (author_name) VALUES ('Nguyễn Du');
+            INSERT INTO books (title, author_id, file_path) VALUES ('Truyện Kiều', 1, 'kieu.txt');
+            INSERT INTO books (title, author_id, file_path) VALUES ('Văn tế', 1, 'van_te.txt');
+            -- Dòng trùng (user, sách) do thêm sách đồng thời ở phiên bản cũ
+            INSERT INTO user_library (user_id, book_id, is_favorite, last_read_position) VALUES (1, 1, 1, 500);
+            INSERT INTO user_library (user_id, book_id, is_favorite, last_read_position) VALUES (1, 1, 0, 1500);
+            INSERT INTO user_library (user_id, book_id, is_favorite, last_read_position) VALUES (1, 2, 0, 0);
+        ''')
+        conn.commit()
+        conn.close()
+
+    def column_names(self, conn, table):
+        return {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+    def index_sql(self, conn, name):
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+        return row['sql'] if row else None
+
+    def test_upgrade_legacy_database_to_latest(self):
+        self.create_legacy_database()
+        self.db.init_database()
+
+        conn = self.connect()
+        try:
+            versions = [row[0] for row in conn.execute('SELECT version FROM schema_migrations ORDER BY version')]
+            self.assertEqual(versions, [version for version, _ in SchemaMigrator.MIGRATIONS])
+            self.assertEqual(versions[-1], LATEST_VERSION)
+
+            self.assertLessEqual(
+                {'word_count', 'char_count', 'ingestion_status', 'content_hash', 'cover_srcset'},
+                self.column_names(conn, 'books')
+            )
+            self.assertIn('last_read_position_unit', self.column_names(conn, 'user_library'))
+
+            # Dòng trùng được gộp: giữ vị trí đọc xa nhất và trạng thái yêu thích
+            rows = conn.execute('''
+                SELECT book_id, is_favorite, last_read_position, last_read_position_unit
+                FROM user_library ORDER BY book_id
+            ''').fetchall()
+            self.assertEqual([tuple(row) for row in rows], [(1, 1, 1500, 'word'), (2, 0, 0, 'char')])
+            self.assertIn('UNIQUE', self.index_sql(conn, 'idx_user_library_user_book'))
+
+            content_hash_index = self.index_sql(conn, 'idx_books_content_hash')
+            self.assertIn('UNIQUE', content_hash_index)
+            self.assertIn('WHERE content_hash IS NOT NULL', content_hash_index)
+        finally:
+            conn.close()
+
+        # Sách có từ trước được đưa vào chỉ mục tìm kiếm danh mục
+        books, total, _ = BookModel(self.db).search_books('truyen kieu')
+        self.assertEqual(total, 1)
+        self.assertEqual(books[0]['title'], 'Truyện Kiều')
+
+    def test_migrate_is_idempotent(self):
+        self.db.init_database()
+        conn = self.db.get_connection()
+        try:
+            migrator = SchemaMigrator(conn)
+            self.assertEqual(migrator.migrate(), [])
+            self.assertEqual(migrator.current_version(), LATEST_VERSION)
+        finally:
+            conn.close()
+
+    def test_content_hash_migration_keeps_oldest_duplicate(self):
+        self.db.init_database()
+        conn = self.connect()
+        # Trạng thái trước migration 8: index thường, cho phép trùng mã băm
+        conn.executescript('''
+            DROP INDEX idx_books_content_hash;
+            CREATE INDEX idx_books_content_hash ON books (content_hash);
+            INSERT INTO books (title, content_hash) VALUES ('Bản gốc', 'abc');
+            INSERT INTO books (title, content_hash) VALUES ('Bản trùng', 'abc');
+            INSERT INTO books (title, content_hash) VALUES ('Sách khác', 'def');
+            INSERT INTO books (title) VALUES ('Chưa có mã băm');
+            DELETE FROM schema_migrations WHERE version >= 8;
+        ''')
+        conn.commit()
+        conn.close()
+
+        migrated = self.db.get_connection()
+        try:
+            self.assertEqual(SchemaMigrator(migrated).migrate(), list(range(8, LATEST_VERSION + 1)))
+        finally:
+            migrated.close()
+
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT title, content_hash FROM books ORDER BY book_id').fetchall()
+            self.assertEqual([tuple(row) for row in rows], [
+                ('Bản gốc', 'abc'), ('Bản trùng', None), ('Sách khác', 'def'), ('Chưa có mã băm', None)
+            ])
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute("INSERT INTO books (title, content_hash) VALUES ('Bản trùng mới', 'abc')")
+            # Nhiều sách chưa có mã băm vẫn được phép
+            conn.execute("INSERT INTO books (title) VALUES ('Chưa có mã băm 2')")
+        finally:
+            conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
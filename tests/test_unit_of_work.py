@@ -0,0 +1,133 @@
+"""
+Kiểm tra UnitOfWork (commit/rollback) và việc dùng lại sách trùng nội dung khi upload
+"""
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from werkzeug.datastructures import FileStorage
+
+from app.config import Config
+from app.models import BookModel, DatabaseManager, UnitOfWork, UserLibraryModel
+from app.services import BookService, IngestionService
+
+BOOK_CONTENT = 'Trăm năm trong cõi người ta,\nChữ tài chữ mệnh khéo là ghét nhau.\n'.encode('utf-8')
+
+class UnitOfWorkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.upload_folder = os.path.join(self.temp_dir.name, 'uploads')
+        self.db = DatabaseManager(os.path.join(self.temp_dir.name, 'library.db'))
+        self.db.init_database()
+
+        conn = self.db.get_connection()
+        conn.executemany(
+            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+            [('an', 'an@x.vn', 'x'), ('binh', 'binh@x.vn', 'x')]
+        )
+        conn.commit()
+        conn.close()
+
+        patches = [
+            mock.patch.object(Config, 'UPLOAD_FOLDER', self.upload_folder),
+            mock.patch.object(IngestionService, 'enqueue')
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.db.close_connections()
+        self.temp_dir.cleanup()
+
+    def count_rows(self, table):
+        conn = self.db.get_connection()
+        try:
+            return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        finally:
+            conn.close()
+
+    def upload(self, user_id, content=BOOK_CONTENT, title='Truyện Kiều'):
+        file = FileStorage(stream=io.BytesIO(content), filename='kieu.txt')
+        return BookService(self.db).upload_book(
+            file, title, 'Nguyễn Du', 'NXB Văn học', '', 1820, ['Thơ'], user_id
+        )
+
+    def stored_files(self):
+        return sorted(os.listdir(self.upload_folder)) if os.path.isdir(self.upload_folder) else []
+
+    def test_rollback_discards_rows_and_cached_names(self):
+        with self.assertRaises(RuntimeError):
+            with UnitOfWork(self.db) as uow:
+                author_id = uow.get_or_create_author('Nguyễn Du')
+                book_id = uow.create_book('Truyện Kiều', author_id, None, '', 'kieu.txt')
+                uow.link_book_genres(book_id, uow.get_or_create_genres(['Thơ', 'Thơ', ' ']))
+                raise RuntimeError('lỗi giữa chừng')
+
+        for table in ('authors', 'books', 'genres', 'book_genres'):
+            self.assertEqual(self.count_rows(table), 0, table)
+        # id của dòng đã rollback không được đưa vào cache dùng chung
+        self.assertEqual(UnitOfWork(self.db)._shared_names, {})
+
+        with UnitOfWork(self.db) as uow:
+            author_id = uow.get_or_create_author('Nguyễn Du')
+            book_id = uow.create_book('Truyện Kiều', author_id, None, '', 'kieu.txt')
+        self.assertEqual(self.count_rows('authors'), 1)
+        self.assertEqual(UnitOfWork(self.db)._shared_names, {('author', 'Nguyễn Du'): author_id})
+
+        # Sách được đưa vào chỉ mục tìm kiếm cùng lúc commit
+        books, total, _ = BookModel(self.db).search_books('truyen kieu')
+        self.assertEqual((total, books[0]['book_id']), (1, book_id))
+
+    def test_upload_same_content_reuses_book(self):
+        success, book_id = self.upload(1)
+        self.assertTrue(success, book_id)
+        IngestionService.enqueue.assert_called_once_with(book_id)
+
+        success, second_id = self.upload(2, title='Đoạn trường tân thanh')
+        self.assertTrue(success, second_id)
+        self.assertEqual(second_id, book_id)
+        self.assertEqual(IngestionService.enqueue.call_count, 1)
+
+        self.assertEqual(self.count_rows('books'), 1)
+        self.assertEqual(self.count_rows('authors'), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertIsNotNone(UserLibraryModel(self.db).get_user_book(2, book_id))
+
+    def test_upload_recovers_from_concurrent_duplicate(self):
+        success, book_id = self.upload(1)
+        self.assertTrue(success, book_id)
+
+        # Giả lập lượt upload khác commit cùng nội dung sau lúc tra mã băm
+        with mock.patch.object(UnitOfWork, 'get_book_by_content_hash', return_value=None):
+            success, second_id = self.upload(2)
+
+        self.assertTrue(success, second_id)
+        self.assertEqual(second_id, book_id)
+        self.assertEqual(self.count_rows('books'), 1)
+        self.assertIsNotNone(UserLibraryModel(self.db).get_user_book(2, book_id))
+
+    def test_failed_upload_removes_stored_file(self):
+        with mock.patch.object(UnitOfWork, 'create_book', side_effect=sqlite3.OperationalError('disk I/O error')):
+            success, message = self.upload(1)
+
+        self.assertFalse(success)
+        self.assertIn('disk I/O error', message)
+        self.assertEqual(self.stored_files(), [])
+        for table in ('books', 'authors', 'publishers', 'user_library'):
+            self.assertEqual(self.count_rows(table), 0, table)
+
+        # File đã có từ trước (sách khác đang dùng) không bị xóa khi lượt upload sau lỗi
+        success, book_id = self.upload(1)
+        self.assertTrue(success, book_id)
+        with mock.patch.object(UnitOfWork, 'get_book_by_content_hash', side_effect=sqlite3.OperationalError('lỗi')):
+            success, _ = self.upload(2)
+        self.assertFalse(success)
+        self.assertEqual(len(self.stored_files()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
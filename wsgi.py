@@ -0,0 +1,35 @@
+"""
+Entry point WSGI cho môi trường production (dùng với gunicorn.conf.py)
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Với preload_app, module này chạy một lần trong master: app được tạo, cache
+được nạp sẵn, rồi các kết nối database được đóng trước khi fork worker. Các
+việc nền khi khởi động (xử lý tiếp sách dang dở, tạo ảnh bìa thu nhỏ) không
+chạy trong master mà do worker đầu tiên chạy (xem post_worker_init).
+"""
+import os
+from app import create_app
+from app.models import DatabaseManager
+from app.services import WarmupService
+
+config_name = os.environ.get('FLASK_ENV', 'production')
+if config_name not in ['development', 'production', 'testing']:
+    config_name = 'production'
+
+app = create_app(config_name, start_jobs=False)
+
+db_manager = DatabaseManager(app.config.get('DATABASE_PATH'))
+if app.config.get('WARMUP_ON_START'):
+    try:
+        warmup = WarmupService(db_manager).warm_caches()
+        app.logger.info(
+            "Đã nạp sẵn cache: %d sách, bỏ qua %d, lỗi %d, %.2fs",
+            warmup['books_warmed'], warmup['books_skipped'], warmup['books_failed'], warmup['seconds']
+        )
+    except Exception:
+        # Thiếu cache chỉ làm các request đầu chậm hơn
+        app.logger.exception("Không thể nạp sẵn cache")
+
+# Không để worker thừa hưởng kết nối SQLite mở trong master
+db_manager.close_connections()